@@ -0,0 +1 @@
+"""Display-free chess logic: the board, FEN conversion, game history and move generation"""
@@ -0,0 +1,401 @@
+"""Compact binary game archives, with any game and any ply of it a seek away.
+
+An archive file is a header, the games one after another, a string table, and an index:
+  header  ARCHIVE_HEADER: magic and version
+  game    GAME_HEADER: result, number of tags, length of the starting FEN (0 for the usual
+          starting position) and number of moves; then the FEN, each tag as a pair of string ids
+          (each a varint), and a 16-bit MOVE per ply
+  strings the offset of each distinct tag name and value, then the UTF-8 text of them all
+  index   the offset of every game, then ARCHIVE_FOOTER: magic, number of games, number of
+          strings, and the offsets of the string table and the index
+Archive reads the footer of a memory-mapped file, so finding game N is one read of the index and
+nothing is parsed until a game is asked for. A move is movegen's move int (from square, to square
+and the piece promoted to) with CASTLE_FLAG added when moves_made has it as O-O or O-O-O, so the
+move texts come back without replaying the game. ArchivedGame.tree() only replays as far as the
+ply to be shown, and leaves the rest of the game for the GameTree to play when it gets there.
+Only a game's main line and tags are kept: PGN comments and variations are dropped.
+
+"python -m chesscore.archive pack ARCHIVE games.pgn [...]" adds PGN games to an archive,
+"unpack ARCHIVE" writes them out as PGN and "show ARCHIVE N [--ply P]" prints one."""
+
+import argparse
+import array
+import mmap
+import os
+import struct
+import sys
+import time
+
+from chesscore.board import *
+from chesscore.history import GameHistory, GameTree
+from chesscore.movegen import CASTLING_MOVES, apply_move, move_to_uci
+from chesscore.parallel import chunked, map_in_order
+from chesscore.pgn import PgnError, read_games, write_game
+from chesscore.san import parse_move
+
+ARCHIVE_MAGIC = b'MCGA'
+ARCHIVE_HEADER = struct.Struct('<4sI')  # Magic, version
+ARCHIVE_FOOTER = struct.Struct('<4sQIQQ')  # Magic, games, strings, string table offset, index offset
+ARCHIVE_VERSION = 1
+GAME_HEADER = struct.Struct('<BBBH')  # Result, tags, starting FEN length, moves
+OFFSET = struct.Struct('<Q')
+STRING_OFFSET = struct.Struct('<I')
+MOVE = struct.Struct('<H')
+CASTLE_FLAG = 1 << 15
+RESULT_CODES = {'*': 0, '1-0': 1, '0-1': 2, '1/2-1/2': 3}
+RESULTS = ['*', '1-0', '0-1', '1/2-1/2']
+PROMOTION_LETTERS = {'n': KNIGHT, 'b': BISHOP, 'r': ROOK, 'q': QUEEN}
+GAMES_PER_CHUNK = 200  # PGN games handed to a worker process at a time when packing
+COPY_CHUNK = 1 << 20  # Bytes of the old games copied at a time when adding to an archive
+
+
+class ArchiveError(ValueError):
+    """Raised for a file that isn't an archive, or a game that can't be stored in one"""
+
+
+def pack_move_text(move_text, white_to_move):
+    """A move from moves_made (coordinate notation, or O-O / O-O-O) as a 16-bit move"""
+    if move_text in ('O-O', 'O-O-O'):
+        option = ('w' if white_to_move else 'b') + ('k' if move_text == 'O-O' else 'q')
+        king_from, king_to = CASTLING_MOVES[option][:2]
+        return king_from | king_to << 6 | CASTLE_FLAG
+    if not 4 <= len(move_text) <= 5:
+        raise ArchiveError(f"can't store move {move_text!r}")
+    try:
+        from_sq = coords_to_index(square_to_coords(move_text[:2]))
+        to_sq = coords_to_index(square_to_coords(move_text[2:4]))
+        promotion = PROMOTION_LETTERS[move_text[4]] if len(move_text) == 5 else 0
+    except (ValueError, KeyError):
+        raise ArchiveError(f"can't store move {move_text!r}") from None
+    return from_sq | to_sq << 6 | promotion << 12
+
+def varint(number):
+    """number in 7-bit groups, low first, with the top bit set on all but the last"""
+    encoded = bytearray()
+    while number > 0x7F:
+        encoded.append(number & 0x7F | 0x80)
+        number >>= 7
+    encoded.append(number)
+    return bytes(encoded)
+
+def read_varint(data, offset):
+    """The number written by varint() at offset, and the offset after it"""
+    number = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+def unpack_move_text(packed):
+    """The moves_made text of a 16-bit move"""
+    if packed & CASTLE_FLAG:
+        return 'O-O' if (packed >> 6 & 7) > (packed & 7) else 'O-O-O'
+    return move_to_uci(packed)
+
+
+class ArchivedGame:
+    """One game of an archive. moves are its 16-bit moves, read from the archive when needed."""
+    __slots__ = ('result', 'starting_fen', 'tags', 'moves')
+
+    def __init__(self, result, starting_fen, tags, moves):
+        self.result = result
+        self.starting_fen = starting_fen
+        self.tags = tags
+        self.moves = moves
+
+    def __len__(self):
+        return len(self.moves)
+
+    @property
+    def headers(self):
+        headers = dict(self.tags)
+        headers['Result'] = self.result
+        if self.starting_fen != STARTING_FEN:
+            headers['SetUp'] = '1'
+            headers['FEN'] = self.starting_fen
+        return headers
+
+    def moves_made(self):
+        return [unpack_move_text(packed) for packed in self.moves]
+
+    def history(self, plies=None):
+        """A GameHistory of the game, or of its first plies moves. Raises ArchiveError if a move
+        can't be played."""
+        game_state = fen_to_gameboard(self.starting_fen)
+        history = GameHistory(game_state)
+        for ply, move_text in enumerate(self.moves_made()[:plies]):
+            self._play(history, game_state, move_text, ply)
+        return history
+
+    def tree(self, plies=0):
+        """A GameTree of the game with only its first plies moves played, and the rest left for the
+        tree to play when the line gets to them"""
+        game_state = fen_to_gameboard(self.starting_fen)
+        tree = GameTree(game_state)
+        moves_made = self.moves_made()
+        for ply, move_text in enumerate(moves_made[:plies]):
+            self._play(tree, game_state, move_text, ply)
+        tree.add_unplayed(moves_made[plies:])
+        return tree
+
+    def _play(self, history, game_state, move_text, ply):
+        try:
+            move = parse_move(game_state, move_text)
+        except ValueError as error:
+            raise ArchiveError(f"ply {ply + 1}: {error}") from None
+        apply_move(game_state, move)
+        game_state.flags['repetition_ct'] = history.count_repetitions(game_state)
+        history.append(game_state, move_text)
+
+
+class Archive:
+    """A memory-mapped archive file"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as archive_file:
+            self.data = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < ARCHIVE_HEADER.size + ARCHIVE_FOOTER.size:
+            self.data.close()
+            raise ArchiveError(f"{path} isn't a game archive")
+        magic, version = ARCHIVE_HEADER.unpack_from(self.data)
+        footer_magic, self.length, self.string_count, self.strings_offset, self.index_offset = \
+            ARCHIVE_FOOTER.unpack_from(self.data, len(self.data) - ARCHIVE_FOOTER.size)
+        if magic != ARCHIVE_MAGIC or footer_magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION \
+                or self.index_offset + self.length * OFFSET.size + ARCHIVE_FOOTER.size != len(self.data):
+            self.data.close()
+            raise ArchiveError(f"{path} isn't a game archive")
+        self.text_offset = self.strings_offset + (self.string_count + 1) * STRING_OFFSET.size
+
+    def __len__(self):
+        return self.length
+
+    def close(self):
+        self.data.close()
+
+    def string(self, string_id):
+        start, end = struct.unpack_from('<II', self.data, self.strings_offset + string_id * STRING_OFFSET.size)
+        return self.data[self.text_offset + start:self.text_offset + end].decode('utf-8')
+
+    def strings(self):
+        return [self.string(string_id) for string_id in range(self.string_count)]
+
+    def game_offset(self, number):
+        if not 0 <= number < self.length:
+            raise IndexError(f"game {number} out of range")
+        return OFFSET.unpack_from(self.data, self.index_offset + number * OFFSET.size)[0]
+
+    def game(self, number):
+        """The number'th game, counting from 0"""
+        offset = self.game_offset(number)
+        result, tag_count, fen_length, move_count = GAME_HEADER.unpack_from(self.data, offset)
+        offset += GAME_HEADER.size
+        starting_fen = self.data[offset:offset + fen_length].decode('ascii') if fen_length else STARTING_FEN
+        offset += fen_length
+        tags = []
+        for tag in range(tag_count):
+            name_id, offset = read_varint(self.data, offset)
+            value_id, offset = read_varint(self.data, offset)
+            tags.append((self.string(name_id), self.string(value_id)))
+        moves = array.array('H', self.data[offset:offset + move_count * MOVE.size])
+        if sys.byteorder == 'big':
+            moves.byteswap()
+        return ArchivedGame(RESULTS[result], starting_fen, tags, moves)
+
+    def __iter__(self):
+        for number in range(self.length):
+            yield self.game(number)
+
+
+class ArchiveWriter:
+    """Adds games to an archive file, creating it if it doesn't exist. The games so far are copied
+    to a temporary file next to it, the new ones written after them, and close() writes the string
+    table and index and renames the temporary file over the archive. Until then the archive, and
+    any Archive open on it, are untouched, and a process killed part way leaves the old archive."""
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = path + '.tmp'
+        self.offsets = array.array('Q')
+        self.string_ids = {}
+        self.file = open(self.temp_path, 'wb')
+        try:
+            if os.path.exists(path) and os.path.getsize(path):
+                archive = Archive(path)
+                try:
+                    self.offsets.extend(archive.game_offset(number) for number in range(len(archive)))
+                    for string in archive.strings():
+                        self.string_ids[string] = len(self.string_ids)
+                    for start in range(0, archive.strings_offset, COPY_CHUNK):
+                        self.file.write(archive.data[start:min(start + COPY_CHUNK, archive.strings_offset)])
+                finally:
+                    archive.close()
+            else:
+                self.file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+        except BaseException:
+            self.file.close()
+            os.remove(self.temp_path)
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def string_id(self, string):
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = self.string_ids[string] = len(self.string_ids)
+        return string_id
+
+    def add(self, starting_fen, moves_made, result='*', tags=()):
+        """Adds a game from its starting FEN, moves_made and (name, value) tags, leaving out Result,
+        SetUp and FEN, which the archive keeps itself. Returns its number."""
+        tags = [(name, value) for name, value in tags if name not in ('Result', 'SetUp', 'FEN')]
+        if len(tags) > 255 or len(moves_made) > 0xFFFF:
+            raise ArchiveError("too many tags or moves for one game")
+        white_to_move = starting_fen.split()[1] == 'w'
+        moves = array.array('H')
+        for move_text in moves_made:
+            moves.append(pack_move_text(move_text, white_to_move))
+            white_to_move = not white_to_move
+        if sys.byteorder == 'big':
+            moves.byteswap()
+        fen_bytes = b'' if starting_fen == STARTING_FEN else starting_fen.encode('ascii')
+        self.offsets.append(self.file.tell())
+        self.file.write(GAME_HEADER.pack(RESULT_CODES.get(result, 0), len(tags), len(fen_bytes), len(moves)))
+        self.file.write(fen_bytes)
+        for name, value in tags:
+            self.file.write(varint(self.string_id(name)) + varint(self.string_id(str(value))))
+        self.file.write(moves.tobytes())
+        return len(self.offsets) - 1
+
+    def add_history(self, history, result='*', tags=()):
+        """Adds a GameHistory or GameTree (the line it shows)"""
+        return self.add(history.starting_fen, history.moves_made, result, tags)
+
+    def close(self):
+        if self.file.closed:
+            return
+        strings_offset = self.file.tell()
+        encoded = [string.encode('utf-8') for string in self.string_ids]
+        text_offsets = array.array('I', [0])
+        for text in encoded:
+            text_offsets.append(text_offsets[-1] + len(text))
+        if sys.byteorder == 'big':
+            text_offsets.byteswap()
+        self.file.write(text_offsets.tobytes())
+        self.file.write(b''.join(encoded))
+        index_offset = self.file.tell()
+        offsets = array.array('Q', self.offsets)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        self.file.write(offsets.tobytes())
+        self.file.write(ARCHIVE_FOOTER.pack(ARCHIVE_MAGIC, len(self.offsets), len(encoded), strings_offset,
+                                            index_offset))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+
+def _pack_chunk(games):
+    """(starting FEN, moves_made, result, tags) of each PGN game that can be played out, and the
+    number that couldn't"""
+    packed = []
+    failed = 0
+    for game in games:
+        try:
+            history = game.history()
+        except (PgnError, FenError):
+            failed += 1
+            continue
+        packed.append((history.starting_fen, history.moves_made, game.result, list(game.headers.items())))
+    return packed, failed
+
+def pack_pgn(writer, paths, jobs=1, progress=None):
+    """Adds the games of PGN files to an ArchiveWriter, checking their moves in that many processes.
+    Returns (games added, games skipped)."""
+    added = skipped = 0
+    for path in paths:
+        for chunk, (packed, failed) in map_in_order(_pack_chunk, chunked(read_games(path), GAMES_PER_CHUNK), jobs):
+            for starting_fen, moves_made, result, tags in packed:
+                writer.add(starting_fen, moves_made, result, tags)
+            added += len(packed)
+            skipped += failed
+            if progress is not None:
+                progress(added)
+    return added, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m chesscore.archive', description="Pack games into a binary archive")
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser('pack', help="add the games in PGN files to an archive")
+    pack.add_argument('archive')
+    pack.add_argument('pgn_files', nargs='+')
+    pack.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+    unpack = commands.add_parser('unpack', help="write an archive's games as PGN")
+    unpack.add_argument('archive')
+    unpack.add_argument('-o', '--output', help="PGN file to write (default standard output)")
+    show = commands.add_parser('show', help="print one game, and the position after a ply of it")
+    show.add_argument('archive')
+    show.add_argument('number', type=int, help="game number, from 1")
+    show.add_argument('--ply', type=int)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'pack':
+            start_time = time.perf_counter()
+            old_size = os.path.getsize(args.archive) if os.path.exists(args.archive) else 0
+            with ArchiveWriter(args.archive) as writer:
+                added, skipped = pack_pgn(writer, args.pgn_files, args.jobs)
+            elapsed = time.perf_counter() - start_time
+            pgn_size = sum(os.path.getsize(path) for path in args.pgn_files)
+            growth = os.path.getsize(args.archive) - old_size
+            print(f"{added} games added in {elapsed:.1f}s, {skipped} skipped; the archive grew by {growth} "
+                  f"bytes ({pgn_size / growth if growth > 0 else 0:.1f}x smaller than the PGN)")
+            return 0
+        archive = Archive(args.archive)
+    except (OSError, ArchiveError) as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    try:
+        if args.command == 'unpack':
+            out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+            try:
+                for game in archive:
+                    write_game(out, game.history(), game.headers)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+        else:
+            if not 1 <= args.number <= len(archive):
+                print(f"no game {args.number}, the archive has {len(archive)}", file=sys.stderr)
+                return 1
+            start_time = time.perf_counter()
+            game = archive.game(args.number - 1)
+            ply = len(game) if args.ply is None else min(max(args.ply, 0), len(game))
+            tree = game.tree(ply)
+            elapsed = time.perf_counter() - start_time
+            for name, value in game.headers.items():
+                print(f'[{name} "{value}"]')
+            print(' '.join(game.moves_made()))
+            print(f"after {ply} plies: {tree.position(ply).make_fen()}")
+            print(f"loaded in {elapsed * 1e3:.2f}ms")
+    except ArchiveError as error:
+        print(error, file=sys.stderr)
+        return 1
+    finally:
+        archive.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""Benchmarks of the board, FEN and history operations behind the GUI, at several game lengths.
+
+Each benchmark runs on a reproducible game: seeded random moves that make a legal game for its
+whole length, never reaching the 75-move rule or a fivefold repetition, so the halfmove clock,
+and the repetition search along with it, stay within what real play can reach. For 100, 1,000 and 10,000 plies it
+times
+  fen_round_trip  make_fen then fen_to_gameboard, for every position of the game
+  make_move       playing the game's moves on a GameBoard with apply_move
+  repetition      what HistoryBoard.finish_turn does with the history each ply: counting
+                  repetitions and appending the position to the GameTree
+  navigation      stepping the GameTree's line from end to start and back, then jumping to
+                  random positions
+  variations      starting a variation at random positions, as playing a move part way
+                  through the game does: cutting the line, appending a different move, then
+                  selecting the old continuation again
+and measures the memory a GameTree of that many plies takes with tracemalloc.
+
+Each timing is the best of --repeat runs, as seconds per operation. Results are written as JSON,
+and --baseline compares them with an earlier results file, exiting with 1 if anything got slower
+(or bigger) by more than --tolerance. Nothing here needs Tk.
+
+Run with "python -m chesscore.bench [-o results.json] [--baseline old.json]"."""
+
+import argparse
+import collections
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from chesscore.board import *
+from chesscore.history import GameTree
+from chesscore.movegen import CLAIMABLE_DRAWS, apply_move, game_outcome, legal_moves, move_to_uci
+
+GAME_LENGTHS = (100, 1000, 10000)
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.15  # Allowed slowdown against a baseline, as a fraction
+NAVIGATION_JUMPS = 1000
+RESET_CLOCK_AT = 140  # Halfmove clock at which the generated game moves a pawn or captures, short of 150
+VARIATION_POINTS = 100
+GAME_SEED = 2024
+
+
+def generate_game(plies, seed=GAME_SEED):
+    """plies moves of a seeded random game from the starting position, which game_outcome lets go
+    on throughout. Pieces other than pawns move and capture nothing until the halfmove clock
+    reaches RESET_CLOCK_AT; then a pawn moves, or failing that something is captured, so the game
+    keeps going for as long as needed without reaching the 75-move rule. No position comes up a
+    fifth time. Shorter if no move lets the game go on."""
+    chooser = random.Random(seed)
+    game_state = fen_to_gameboard(STARTING_FEN)
+    seen = collections.Counter([game_state.zobrist_key])  # Positions since the last pawn move or capture
+    moves = []
+    while len(moves) < plies:
+        squares = game_state.squares
+        piece_moves, pawn_moves, promotions, captures = [], [], [], []
+        for move in legal_moves(game_state):
+            if squares[move >> 6 & 63]:
+                captures.append(move)
+            elif squares[move & 63] & 7 == PAWN:
+                (promotions if move >> 12 else pawn_moves).append(move)
+            else:
+                piece_moves.append(move)
+        if game_state.flags['halfmove_clock'] < RESET_CLOCK_AT:
+            preferences = (piece_moves, pawn_moves, promotions, captures)
+        else:
+            preferences = (pawn_moves, promotions, captures, piece_moves)
+        move = next((move for group in preferences for move in chooser.sample(group, len(group))
+                     if game_goes_on(game_state, move, seen)), None)
+        if move is None:
+            break
+        apply_move(game_state, move)
+        if game_state.flags['halfmove_clock'] == 0:
+            seen.clear()
+        seen[game_state.zobrist_key] += 1
+        moves.append(move)
+    return moves
+
+def game_goes_on(game_state, move, seen):
+    """Whether game_outcome would let the game go on after move, counting repetitions in seen"""
+    after = game_state.copy()
+    apply_move(after, move)
+    clock = after.flags['halfmove_clock']
+    after.flags['repetition_ct'] = 1 + (seen[after.zobrist_key] if clock else 0)
+    outcome = game_outcome(after)
+    return outcome is None or outcome[1] in CLAIMABLE_DRAWS
+
+def game_positions(moves):
+    """A GameBoard for the start and after every move"""
+    game_state = fen_to_gameboard(STARTING_FEN)
+    positions = [game_state.copy()]
+    for move in moves:
+        apply_move(game_state, move)
+        positions.append(game_state.copy())
+    return positions
+
+def build_tree(positions, move_texts):
+    tree = GameTree(positions[0])
+    for game_state, move_text in zip(positions[1:], move_texts):
+        game_state.flags['repetition_ct'] = tree.count_repetitions(game_state)
+        tree.append(game_state, move_text)
+    return tree
+
+def variation_starts(positions, move_texts):
+    """(index, position, move text) for VARIATION_POINTS random plies of the game, where the
+    position is reached by a different move from the one played after index plies"""
+    starts = []
+    chooser = random.Random(GAME_SEED)
+    for index in sorted(chooser.choices(range(len(move_texts)), k=VARIATION_POINTS)):
+        others = [move for move in legal_moves(positions[index]) if move_to_uci(move) != move_texts[index]]
+        if others:
+            game_state = positions[index].copy()
+            move = chooser.choice(others)
+            apply_move(game_state, move)
+            starts.append((index, game_state, move_to_uci(move)))
+    return starts
+
+
+def best_time(function, repeat):
+    """The shortest of repeat calls of function, in seconds"""
+    best = None
+    for run in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start_time
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def timing_result(seconds, operations):
+    return {'seconds_per_op': seconds / operations, 'ops_per_second': operations / seconds if seconds else 0,
+            'operations': operations}
+
+
+def bench_fen_round_trip(positions, repeat):
+    def run():
+        for game_state in positions:
+            fen_to_gameboard(game_state.make_fen())
+    return timing_result(best_time(run, repeat), len(positions))
+
+def bench_make_move(moves, repeat):
+    def run():
+        game_state = fen_to_gameboard(STARTING_FEN)
+        for move in moves:
+            apply_move(game_state, move)
+    return timing_result(best_time(run, repeat), len(moves))
+
+def bench_repetition(positions, move_texts, repeat):
+    return timing_result(best_time(lambda: build_tree(positions, move_texts), repeat), len(move_texts))
+
+def bench_navigation(tree, repeat):
+    last_idx = len(tree) - 1
+    jumps = random.Random(GAME_SEED).choices(range(len(tree)), k=NAVIGATION_JUMPS)
+
+    def run():
+        for index in range(last_idx, -1, -1):
+            tree.squares_at(index)
+        for index in range(last_idx + 1):
+            tree.squares_at(index)
+        for index in jumps:
+            tree.position(index)
+    return timing_result(best_time(run, repeat), 2 * (last_idx + 1) + len(jumps))
+
+def bench_variations(positions, move_texts, repeat):
+    """Each variation start is a cut, an append and a select, on a fresh tree every run"""
+    starts = variation_starts(positions, move_texts)
+
+    def run():
+        tree = build_tree(positions, move_texts)
+        start_time = time.perf_counter()
+        for index, game_state, move_text in starts:
+            tree.cut(index + 1)
+            tree.append(game_state, move_text)
+            tree.select(index, 0)
+        return time.perf_counter() - start_time
+    return timing_result(min(run() for run_number in range(repeat)), 3 * len(starts))
+
+def measure_history_memory(positions, move_texts):
+    """Bytes allocated by building and keeping the GameTree"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tree = build_tree(positions, move_texts)
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del tree
+    return {'bytes': used, 'bytes_per_ply': used / max(len(move_texts), 1)}
+
+
+def run_benchmarks(lengths=GAME_LENGTHS, repeat=DEFAULT_REPEAT, progress=None):
+    """name -> result dict for every benchmark at every game length"""
+    all_moves = generate_game(max(lengths))
+    results = {}
+    for length in lengths:
+        moves = all_moves[:length]
+        positions = game_positions(moves)
+        move_texts = [move_to_uci(move) for move in moves]
+        tree = build_tree(positions, move_texts)
+        for name, run in (('fen_round_trip', lambda: bench_fen_round_trip(positions, repeat)),
+                          ('make_move', lambda: bench_make_move(moves, repeat)),
+                          ('repetition', lambda: bench_repetition(positions, move_texts, repeat)),
+                          ('navigation', lambda: bench_navigation(tree, repeat)),
+                          ('variations', lambda: bench_variations(positions, move_texts, repeat)),
+                          ('history_memory', lambda: measure_history_memory(positions, move_texts))):
+            key = f"{name}/{len(moves)}"
+            results[key] = run()
+            if progress is not None:
+                progress(key, results[key])
+    return results
+
+def result_value(result):
+    """The number compared against a baseline: lower is better"""
+    return result['seconds_per_op'] if 'seconds_per_op' in result else result['bytes']
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """(key, baseline value, new value, ratio, regressed) for each result also in the baseline"""
+    rows = []
+    for key, result in results.items():
+        if key in baseline:
+            old_value = result_value(baseline[key])
+            new_value = result_value(result)
+            ratio = new_value / old_value if old_value else 1.0
+            rows.append((key, old_value, new_value, ratio, ratio > 1 + tolerance))
+    return rows
+
+def describe(result):
+    if 'bytes' in result:
+        return f"{result['bytes'] / 1024:10.1f} KiB  {result['bytes_per_ply']:8.1f} B/ply"
+    return f"{result['seconds_per_op'] * 1e6:10.2f} us/op  {result['ops_per_second']:10.0f} ops/s"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m chesscore.bench',
+                                     description="Benchmark board, FEN and history operations")
+    parser.add_argument('-o', '--output', help="file to write the results to as JSON")
+    parser.add_argument('--baseline', help="results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown against the baseline, as a fraction (default %(default)s)")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="runs per timing, best taken")
+    parser.add_argument('--plies', type=int, nargs='+', default=list(GAME_LENGTHS), help="game lengths")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.plies, args.repeat,
+                             progress=lambda key, result: print(f"{key:<22} {describe(result)}", file=sys.stderr))
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'repeat': args.repeat, 'results': results}, results_file, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = 0
+        for key, old_value, new_value, ratio, regressed in compare(results, baseline, args.tolerance):
+            regressions += regressed
+            print(f"{key:<22} {ratio:6.2f}x  {'REGRESSED' if regressed else 'ok'}")
+        if regressions:
+            print(f"{regressions} regression{'s' if regressions != 1 else ''} beyond {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
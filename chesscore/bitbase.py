@@ -0,0 +1,430 @@
+"""Endgame bitbases: whether a KPK, KRK, KQK or KBNK position is won or drawn, found by
+retrograde analysis and looked up in constant time.
+
+In each endgame White is taken to be the side with the pieces; a position with them on the Black
+side is probed with the board mirrored and the colours swapped. Positions are numbered by the
+squares of the white king, the black king and the white pieces, after moving the white king into
+a corner triangle (a1-d1-d4) by the board's symmetries, or onto the a-d files when there is a
+pawn. The lone king can never win, so one bit per position is enough: for White to move it is
+set if White wins, for Black to move if Black loses. Everything else is a draw.
+
+Generation starts from the checkmates, found in worker processes a white king square at a time,
+and works backwards: a White-to-move position is won if some move reaches a lost Black-to-move
+position, and a Black-to-move position is lost once every move reaches a won one. KPK also
+starts from its winning promotions, so KQK and KRK are generated first.
+
+A bitbase file is a header and then the White-to-move and Black-to-move bits. Bitbase opens one
+memory-mapped, and Bitbases opens a directory of them and probes GameBoards.
+
+"python -m chesscore.bitbase generate DIR" writes the tables, "probe DIR FEN" looks a position
+up and "bench DIR" reports probes per second."""
+
+import argparse
+import itertools
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+
+from chesscore.board import *
+from chesscore.movegen import KING_TARGETS, KNIGHT_TARGETS, PAWN_CAPTURES, SLIDER_RAYS
+from chesscore.parallel import map_in_order
+
+BITBASE_MAGIC = b'MCBB'
+BITBASE_HEADER = struct.Struct('<4sI8sQ')  # Magic, version, endgame name, positions per side to move
+BITBASE_VERSION = 1
+ENDGAMES = {'kqk': (QUEEN,), 'krk': (ROOK,), 'kbnk': (BISHOP, KNIGHT), 'kpk': (PAWN,)}  # Name -> White's pieces
+PROMOTION_ENDGAMES = ((QUEEN, 'kqk'), (ROOK, 'krk'))  # Promotions KPK tries, and the tables they lead to
+BENCH_PROBES = 200000
+
+
+def _transform(square, symmetry):
+    """A square under one of the 8 symmetries of the board: bit 2 swaps files and ranks, then bit 0
+    mirrors the files and bit 1 the ranks"""
+    x, y = square & 7, square >> 3
+    if symmetry & 4:
+        x, y = y, x
+    if symmetry & 1:
+        x = 7 - x
+    if symmetry & 2:
+        y = 7 - y
+    return y * 8 + x
+
+SYMMETRIES = [[_transform(square, symmetry) for square in range(64)] for symmetry in range(8)]
+TRIANGLE = [square for square in range(64) if square >> 3 <= square & 7 <= 3]  # a1, b1, b2, c1, ... d4
+HALF_BOARD = [square for square in range(64) if square & 7 <= 3]  # Files a to d
+# White king square -> the square mapping that moves it into TRIANGLE, or onto HALF_BOARD
+PAWNLESS_SYMMETRY = [next(SYMMETRIES[symmetry] for symmetry in range(8) if SYMMETRIES[symmetry][square] in TRIANGLE)
+                     for square in range(64)]
+PAWN_SYMMETRY = [SYMMETRIES[0] if square & 7 <= 3 else SYMMETRIES[1] for square in range(64)]
+
+KING_SETS = [frozenset(targets) for targets in KING_TARGETS]
+KNIGHT_SETS = [frozenset(targets) for targets in KNIGHT_TARGETS]
+WHITE_PAWN_ATTACKS = [frozenset(targets) for targets in PAWN_CAPTURES[0]]
+
+
+def _between_table(rays_by_square):
+    """origin -> target -> the squares strictly between them along a ray, or None if no ray joins them"""
+    table = [[None] * 64 for origin in range(64)]
+    for origin in range(64):
+        for ray in rays_by_square[origin]:
+            for distance, target in enumerate(ray):
+                table[origin][target] = tuple(ray[:distance])
+    return table
+
+SLIDER_BETWEEN = {kind: _between_table(rays) for kind, rays in SLIDER_RAYS.items()}
+
+
+class Layout:
+    """How the positions of one endgame are numbered"""
+    def __init__(self, name):
+        self.name = name
+        self.kinds = ENDGAMES[name]
+        self.has_pawn = PAWN in self.kinds
+        self.king_squares = HALF_BOARD if self.has_pawn else TRIANGLE
+        self.king_slots = [None] * 64
+        for slot, square in enumerate(self.king_squares):
+            self.king_slots[square] = slot
+        self.symmetry = PAWN_SYMMETRY if self.has_pawn else PAWNLESS_SYMMETRY
+        self.size = len(self.king_squares) * 64 ** (1 + len(self.kinds))
+
+    def index(self, white_king, black_king, others):
+        """The number of a position, after moving the white king into place"""
+        mapping = self.symmetry[white_king]
+        index = self.king_slots[mapping[white_king]] * 64 + mapping[black_king]
+        for square in others:
+            index = index * 64 + mapping[square]
+        return index
+
+    def decode(self, index):
+        """(white king, black king, white pieces' squares) of a position number"""
+        others = []
+        for kind in self.kinds:
+            index, square = divmod(index, 64)
+            others.append(square)
+        slot, black_king = divmod(index, 64)
+        return self.king_squares[slot], black_king, tuple(reversed(others))
+
+
+def attacked_by_white(kinds, white_king, others, square, occupied):
+    """Whether White's king or pieces (kinds on the squares in others) attack square, with
+    occupied the squares that block sliding pieces. A piece on square itself is taken to be captured."""
+    if square in KING_SETS[white_king]:
+        return True
+    for kind, origin in zip(kinds, others):
+        if origin == square:
+            continue
+        if kind == PAWN:
+            if square in WHITE_PAWN_ATTACKS[origin]:
+                return True
+        elif kind == KNIGHT:
+            if square in KNIGHT_SETS[origin]:
+                return True
+        else:
+            between = SLIDER_BETWEEN[kind][origin][square]
+            if between is not None and not any(blocker in occupied for blocker in between):
+                return True
+    return False
+
+def is_legal_position(kinds, white_king, black_king, others, white_to_move):
+    """Whether the pieces are on different squares, no pawn is on the first or last rank, the kings
+    aren't touching and the side that just moved isn't in check"""
+    occupied = (white_king, black_king) + others
+    if len(set(occupied)) != len(occupied) or black_king in KING_SETS[white_king]:
+        return False
+    for kind, square in zip(kinds, others):
+        if kind == PAWN and not 8 <= square < 56:
+            return False
+    return not (white_to_move and attacked_by_white(kinds, white_king, others, black_king, occupied))
+
+def black_moves(kinds, white_king, black_king, others):
+    """The black king's legal moves, as (target square, whether it captures)"""
+    occupied = (white_king,) + others
+    moves = []
+    for target in KING_TARGETS[black_king]:
+        if target in KING_SETS[white_king] or target == white_king:
+            continue
+        if not attacked_by_white(kinds, white_king, others, target, occupied):
+            moves.append((target, target in others))
+    return moves
+
+def white_unmoves(kinds, white_king, black_king, others):
+    """The legal White-to-move positions that a White move (never a capture) leads from to this one,
+    as (white king, white pieces)"""
+    occupied = {white_king, black_king, *others}
+    positions = []
+    for origin in KING_TARGETS[white_king]:
+        if origin not in occupied and origin not in KING_SETS[black_king]:
+            positions.append((origin, others))
+    for number, (kind, square) in enumerate(zip(kinds, others)):
+        if kind == PAWN:
+            origins = []
+            if square >> 3 >= 2 and square - 8 not in occupied:
+                origins.append(square - 8)
+                if square >> 3 == 3 and square - 16 not in occupied:
+                    origins.append(square - 16)
+        elif kind == KNIGHT:
+            origins = [origin for origin in KNIGHT_TARGETS[square] if origin not in occupied]
+        else:
+            origins = []
+            for ray in SLIDER_RAYS[kind][square]:
+                for origin in ray:
+                    if origin in occupied:
+                        break
+                    origins.append(origin)
+        for origin in origins:
+            positions.append((white_king, others[:number] + (origin,) + others[number + 1:]))
+    return [(king, pieces) for king, pieces in positions
+            if not attacked_by_white(kinds, king, pieces, black_king, (king, black_king) + pieces)]
+
+
+def _find_mates(job):
+    """Numbers of the Black-to-move checkmates with the white king on one square"""
+    name, white_king = job
+    layout = Layout(name)
+    kinds = layout.kinds
+    mates = []
+    for black_king in range(64):
+        if black_king == white_king or black_king in KING_SETS[white_king]:
+            continue
+        for others in itertools.product(range(64), repeat=len(kinds)):
+            if not is_legal_position(kinds, white_king, black_king, others, False):
+                continue
+            if attacked_by_white(kinds, white_king, others, black_king, (white_king, black_king) + others) \
+                    and not black_moves(kinds, white_king, black_king, others):
+                mates.append(layout.index(white_king, black_king, others))
+    return mates
+
+def _promotion_wins(layout, promotion_tables):
+    """Numbers of the White-to-move KPK positions won by promoting straight away"""
+    wins = []
+    for white_king in layout.king_squares:
+        for black_king in range(64):
+            for pawn in range(48, 56):
+                others = (pawn,)
+                if pawn + 8 in (white_king, black_king) \
+                        or not is_legal_position(layout.kinds, white_king, black_king, others, True):
+                    continue
+                if any(table.probe_squares(False, white_king, black_king, (pawn + 8,))
+                       for table in promotion_tables):
+                    wins.append(layout.index(white_king, black_king, others))
+    return wins
+
+def generate(name, jobs=1, promotion_tables=()):
+    """(White-to-move wins, Black-to-move losses) for an endgame, as a bytearray each with a byte per
+    position number. KPK needs the KQK and KRK Bitbases as promotion_tables."""
+    layout = Layout(name)
+    kinds = layout.kinds
+    white_wins = bytearray(layout.size)
+    black_losses = bytearray(layout.size)
+    lost = []
+    for job, mates in map_in_order(_find_mates, ((name, square) for square in layout.king_squares), jobs):
+        lost.extend(mates)
+    won = _promotion_wins(layout, promotion_tables) if layout.has_pawn else []
+    for index in lost:
+        black_losses[index] = 1
+    for index in won:
+        white_wins[index] = 1
+
+    while lost or won:
+        for index in lost:  # A move to a lost position wins
+            white_king, black_king, others = layout.decode(index)
+            for king, pieces in white_unmoves(kinds, white_king, black_king, others):
+                predecessor = layout.index(king, black_king, pieces)
+                if not white_wins[predecessor]:
+                    white_wins[predecessor] = 1
+                    won.append(predecessor)
+        lost = []
+        for index in won:  # Black loses when every move leads to a won position
+            white_king, black_king, others = layout.decode(index)
+            occupied = (white_king,) + others
+            for origin in KING_TARGETS[black_king]:
+                if origin in occupied or origin in KING_SETS[white_king]:
+                    continue
+                predecessor = layout.index(white_king, origin, others)
+                if black_losses[predecessor]:
+                    continue
+                if all(not captures and white_wins[layout.index(white_king, target, others)]
+                       for target, captures in black_moves(kinds, white_king, origin, others)):
+                    black_losses[predecessor] = 1
+                    lost.append(predecessor)
+        won = []
+    return white_wins, black_losses
+
+
+def pack_bits(flags):
+    """A bytearray of 0s and 1s packed 8 to a byte, lowest bit first"""
+    packed = bytearray((len(flags) + 7) // 8)
+    for index in range(0, len(flags), 8):
+        byte = 0
+        for bit, flag in enumerate(flags[index:index + 8]):
+            byte |= flag << bit
+        packed[index >> 3] = byte
+    return packed
+
+def write_bitbase(path, name, white_wins, black_losses):
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as bitbase_file:
+        bitbase_file.write(BITBASE_HEADER.pack(BITBASE_MAGIC, BITBASE_VERSION, name.encode(), len(white_wins)))
+        bitbase_file.write(pack_bits(white_wins))
+        bitbase_file.write(pack_bits(black_losses))
+    os.replace(temporary_path, path)
+
+
+class Bitbase:
+    """One memory-mapped bitbase file"""
+    def __init__(self, path):
+        with open(path, 'rb') as bitbase_file:
+            self.data = mmap.mmap(bitbase_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, name, self.size = BITBASE_HEADER.unpack_from(self.data)
+        self.name = name.rstrip(b'\0').decode('ascii', 'replace')
+        side_bytes = (self.size + 7) // 8
+        if magic != BITBASE_MAGIC or version != BITBASE_VERSION or self.name not in ENDGAMES \
+                or len(self.data) != BITBASE_HEADER.size + 2 * side_bytes:
+            self.data.close()
+            raise ValueError(f"{path} isn't a bitbase")
+        self.layout = Layout(self.name)
+        self.offsets = (BITBASE_HEADER.size + side_bytes, BITBASE_HEADER.size)  # Indexed by white to move
+
+    def close(self):
+        self.data.close()
+
+    def probe_index(self, white_to_move, index):
+        """The bit of a position number: won for White to move, lost for Black to move"""
+        return self.data[self.offsets[white_to_move] + (index >> 3)] >> (index & 7) & 1
+
+    def probe_squares(self, white_to_move, white_king, black_king, others):
+        return self.probe_index(white_to_move, self.layout.index(white_king, black_king, others))
+
+
+def piece_kinds(game_state):
+    """(White's piece kinds, Black's piece kinds), kings left out, from the material signature"""
+    return tuple([kind for kind in range(PAWN, KING) for count in range(game_state.piece_count(colour | kind))]
+                 for colour in (0, BLACK))
+
+
+class Bitbases:
+    """The bitbases in a directory, probed by GameBoard"""
+    def __init__(self, directory):
+        self.tables = {}  # Sorted tuple of White's piece kinds -> Bitbase
+        for name in ENDGAMES:
+            path = os.path.join(directory, name + '.bin')
+            if os.path.exists(path):
+                self.tables[tuple(sorted(ENDGAMES[name]))] = Bitbase(path)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables = {}
+
+    def probe(self, game_state):
+        """'win', 'draw' or 'loss' for the side to move, or None if there is no table for the position"""
+        white, black = piece_kinds(game_state)
+        if white and black or not white and not black:
+            return None
+        strong = BLACK if black else 0
+        table = self.tables.get(tuple(sorted(black or white)))
+        if table is None:
+            return None
+        # Put the pieces on White's side: mirror the ranks when they are Black's
+        flip = 56 if strong else 0
+        squares = game_state.squares
+        white_king = squares.find(strong | KING) ^ flip
+        black_king = squares.find((strong ^ BLACK) | KING) ^ flip
+        others = tuple(squares.find(strong | kind) ^ flip for kind in table.layout.kinds)
+        strong_to_move = (game_state.flags['next_move'] == 'b') == bool(strong)
+        if table.probe_squares(strong_to_move, white_king, black_king, others):
+            return 'win' if strong_to_move else 'loss'
+        return 'draw'
+
+
+def generate_all(directory, names=tuple(ENDGAMES), jobs=1, progress=None):
+    """Writes the bitbases named to directory as NAME.bin, generating KQK and KRK first if KPK needs them"""
+    os.makedirs(directory, exist_ok=True)
+    if 'kpk' in names:
+        names = [name for name in ENDGAMES if name in names
+                 or (name in ('kqk', 'krk') and not os.path.exists(os.path.join(directory, name + '.bin')))]
+    for name in names:
+        start_time = time.perf_counter()
+        promotion_tables = [Bitbase(os.path.join(directory, table_name + '.bin'))
+                            for kind, table_name in PROMOTION_ENDGAMES] if name == 'kpk' else []
+        white_wins, black_losses = generate(name, jobs, promotion_tables)
+        for table in promotion_tables:
+            table.close()
+        write_bitbase(os.path.join(directory, name + '.bin'), name, white_wins, black_losses)
+        if progress is not None:
+            progress(name, len(white_wins), sum(white_wins), sum(black_losses), time.perf_counter() - start_time)
+
+
+def bench(directory, probes=BENCH_PROBES):
+    """Probes random legal positions of each table, printing probes per second for GameBoards and for
+    bare position numbers"""
+    bitbases = Bitbases(directory)
+    chooser = random.Random(0)
+    for table in bitbases.tables.values():
+        layout = table.layout
+        boards = []
+        while len(boards) < 1000:
+            white_king, black_king, *others = chooser.sample(range(64), 2 + len(layout.kinds))
+            if not is_legal_position(layout.kinds, white_king, black_king, tuple(others), True):
+                continue
+            board = GameBoard({}, dict(STARTING_FLAGS, wk=False, wq=False, bk=False, bq=False))
+            board.set_piece(white_king, KING)
+            board.set_piece(black_king, BLACK | KING)
+            for kind, square in zip(layout.kinds, others):
+                board.set_piece(square, kind)
+            boards.append(board)
+        start_time = time.perf_counter()
+        for count in range(probes // len(boards)):
+            for board in boards:
+                bitbases.probe(board)
+        board_rate = probes / (time.perf_counter() - start_time)
+        indices = [chooser.randrange(layout.size) for count in range(1000)]
+        start_time = time.perf_counter()
+        for count in range(probes // len(indices)):
+            for index in indices:
+                table.probe_index(True, index)
+        index_rate = probes / (time.perf_counter() - start_time)
+        print(f"{table.name:<5} {board_rate:>10.0f} board probes/s  {index_rate:>10.0f} index probes/s")
+    bitbases.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m chesscore.bitbase', description="Generate and probe endgame bitbases")
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate_command = commands.add_parser('generate', help="write bitbases to a directory")
+    generate_command.add_argument('directory')
+    generate_command.add_argument('endgames', nargs='*', metavar='ENDGAME',
+                                  help=f"which of {', '.join(ENDGAMES)} (default all)")
+    generate_command.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+    probe_command = commands.add_parser('probe', help="look up a position")
+    probe_command.add_argument('directory')
+    probe_command.add_argument('fen')
+    bench_command = commands.add_parser('bench', help="measure probes per second")
+    bench_command.add_argument('directory')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        unknown = [name for name in args.endgames if name not in ENDGAMES]
+        if unknown:
+            parser.error(f"unknown endgame {unknown[0]}")
+
+        def report(name, size, white_wins, black_losses, elapsed):
+            print(f"{name:<5} {size:>9} positions a side  {white_wins:>9} won with White to move  "
+                  f"{black_losses:>9} lost with Black to move  {elapsed:7.1f}s")
+        generate_all(args.directory, args.endgames or tuple(ENDGAMES), args.jobs, report)
+    elif args.command == 'probe':
+        bitbases = Bitbases(args.directory)
+        outcome = bitbases.probe(fen_to_gameboard(args.fen))
+        bitbases.close()
+        print(outcome or "no bitbase for this position")
+        return 0 if outcome else 1
+    else:
+        bench(args.directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
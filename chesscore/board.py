@@ -0,0 +1,334 @@
+"""The board, FEN and history logic of the game, with no dependency on a display"""
+
+import random
+
+BOARD_DIMENSIONS = 8
+PIECE_CODES = ['bK', 'bQ', 'bR', 'bB', 'bN', 'bP', 'wK', 'wQ', 'wR', 'wB', 'wN', 'wP']
+STARTING_COORDS = {'wP': [(i,1) for i in range(8)], 'bP':[(i,6) for i in range(8)],
+                   'wK': [(4, 0)], 'wQ': [(3,0)], 'wR': [(0,0), (7,0)], 'wB': [(2,0),(5,0)], 'wN': [(1,0),(6,0)],
+                   'bK': [(4,7)], 'bQ': [(3,7)], 'bR': [(0,7), (7,7)], 'bB': [(2,7),(5,7)], 'bN': [(1,7),(6,7)],}
+
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+STARTING_FLAGS = {'wk': True, 'wq': True, 'bk': True, 'bq': True, 'next_move':'w',
+                  'ep_target':None, 'repetition_ct':0, 'halfmove_clock': 0, 'move_number': 1}
+
+FILES = ['a','b','c', 'd','e','f','g','h']
+RANKS = ['1','2','3','4','5','6','7','8']
+FEN_CORRESPONDENCES = {'p':'bP','k':'bK','q':'bQ','r':'bR','n':'bN','b':'bB',
+                       'P':'wP', 'K':'wK', 'Q':'wQ', 'R':'wR', 'N':'wN', 'B':'wB'}
+REVERSED_CORRESPONDENCES = {'bP':'p','bK':'k','bQ':'q','bR':'r','bN':'n','bB':'b',
+                       'wP':'P', 'wK':'K', 'wQ':'Q', 'wR':'R', 'wN':'N', 'wB':'B'}
+
+# Integer piece codes stored in the 64-byte board. The low three bits give the piece type,
+# and the BLACK bit gives the colour, so 0 is an empty square.
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(1, 7)
+BLACK = 8
+PIECE_TO_CODE = {'wP': PAWN, 'wN': KNIGHT, 'wB': BISHOP, 'wR': ROOK, 'wQ': QUEEN, 'wK': KING,
+                 'bP': BLACK | PAWN, 'bN': BLACK | KNIGHT, 'bB': BLACK | BISHOP,
+                 'bR': BLACK | ROOK, 'bQ': BLACK | QUEEN, 'bK': BLACK | KING}
+CODE_TO_PIECE = [''] * 16
+for piece_name, piece_code in PIECE_TO_CODE.items():
+    CODE_TO_PIECE[piece_code] = piece_name
+FEN_TO_CODE = {char: PIECE_TO_CODE[piece] for char, piece in FEN_CORRESPONDENCES.items()}
+CODE_TO_FEN = [''] * 16
+for fen_char, piece_code in FEN_TO_CODE.items():
+    CODE_TO_FEN[piece_code] = fen_char
+ALL_COORDS = [(x, y) for x in range(BOARD_DIMENSIONS) for y in range(BOARD_DIMENSIONS)]
+# Byte translation tables between a FEN rank with its digits written out as '1's and piece codes
+EXPAND_FEN_DIGITS = str.maketrans({str(run): '1' * run for run in range(1, 9)})
+FEN_BYTES_TO_CODES = bytearray(b'\xff' * 256)
+FEN_BYTES_TO_CODES[ord('1')] = EMPTY
+for fen_char, piece_code in FEN_TO_CODE.items():
+    FEN_BYTES_TO_CODES[ord(fen_char)] = piece_code
+FEN_BYTES_TO_CODES = bytes(FEN_BYTES_TO_CODES)
+CODES_TO_FEN_BYTES = bytes(ord(CODE_TO_FEN[code] or '1') for code in range(16)) + b'?' * 240
+
+# Zobrist keys, seeded so that a position hashes to the same value in every session
+_zobrist_random = random.Random(0x6D636865)
+ZOBRIST_PIECES = [[_zobrist_random.getrandbits(64) for square in range(64)] for piece_code in range(16)]
+ZOBRIST_CASTLING = {option: _zobrist_random.getrandbits(64) for option in ['wk', 'wq', 'bk', 'bq']}
+ZOBRIST_EP_FILE = [_zobrist_random.getrandbits(64) for file in range(8)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+# A GameBoard's material signature counts the pieces of each code in 8 bits at 8 * code. The
+# unused codes 7 and BLACK | 7 count the white and black bishops on light squares, which never
+# change colour, so MATERIAL_UNITS[piece][square] is what a piece on a square adds to it.
+MATERIAL_UNITS = [[0] * 64 for piece_code in range(16)]
+for piece_code in PIECE_TO_CODE.values():
+    for square in range(64):
+        MATERIAL_UNITS[piece_code][square] = 1 << 8 * piece_code
+        if piece_code & 7 == BISHOP and (square + (square >> 3)) & 1:
+            MATERIAL_UNITS[piece_code][square] |= 1 << 8 * (piece_code | 7)
+# Signature bits of the pawns, rooks and queens of both sides, any of which is enough to mate with
+MATING_MATERIAL = sum(0xFF << 8 * (colour | kind) for colour in (0, BLACK) for kind in (PAWN, ROOK, QUEEN))
+# Castling rights lost when a piece leaves or lands on each of these squares
+CASTLING_SQUARES = {0: ('wq',), 4: ('wk', 'wq'), 7: ('wk',), 56: ('bq',), 60: ('bk', 'bq'), 63: ('bk',)}
+
+
+class FenError(ValueError):
+    """Raised by fen_to_gameboard for a FEN it can't read. kind names the part of the FEN at fault,
+    such as 'placement' or 'castling', so errors can be counted by class."""
+    def __init__(self, kind, message):
+        super().__init__(f"{kind}: {message}")
+        self.kind = kind
+        self.message = message
+
+
+def fen_to_gameboard(fen_string):
+    """Reads a FEN into a GameBoard. The halfmove clock and move number can be left off, as in EPD,
+    in which case they are 0 and 1. Raises FenError if the FEN is malformed."""
+    fields = fen_string.split()
+    if len(fields) not in (4, 6):
+        raise FenError('fields', f"expected 6 fields, found {len(fields)}")
+    piece_configuration, next_move, castling, ep_square = fields[:4]
+
+    rows = piece_configuration.split('/')
+    if len(rows) != BOARD_DIMENSIONS:
+        raise FenError('placement', f"expected 8 ranks, found {len(rows)}")
+    squares = bytearray(BOARD_DIMENSIONS * BOARD_DIMENSIONS)
+    for row_idx, row in zip(range(7, -1, -1), rows):
+        row_codes = row.translate(EXPAND_FEN_DIGITS).encode('ascii', 'replace').translate(FEN_BYTES_TO_CODES)
+        if 255 in row_codes:
+            character = next(character for character in row
+                             if character not in FEN_TO_CODE and character not in '12345678')
+            raise FenError('placement', f"unexpected {character!r} on rank {row_idx + 1}")
+        if len(row_codes) != 8:
+            raise FenError('placement', f"rank {row_idx + 1} has {len(row_codes)} squares")
+        squares[row_idx * 8:row_idx * 8 + 8] = row_codes
+
+    halfmove_clock, move_number = check_fen_fields(fields)
+
+    flags = {'next_move': next_move, 'halfmove_clock': halfmove_clock, 'move_number': move_number,
+             'repetition_ct': 0,
+             'ep_target': None if ep_square == '-' else square_to_coords(ep_square)}
+    if castling != '-':
+        if 'k' in castling:
+            flags['bk'] = True
+        if 'q' in castling:
+            flags['bq'] = True
+        if 'K' in castling:
+            flags['wk'] = True
+        if 'Q' in castling:
+            flags['wq'] = True
+
+    resultingGameboard = GameBoard({}, flags)
+    resultingGameboard.set_all_squares(squares)
+    return resultingGameboard
+
+def check_fen_fields(fields):
+    """Checks the fields of a FEN after the piece placement, given 4 or 6 fields, and returns the
+    halfmove clock and move number. Raises FenError as fen_to_gameboard does."""
+    next_move, castling, ep_square = fields[1:4]
+    if next_move not in ('w', 'b'):
+        raise FenError('side to move', f"expected w or b, found {next_move!r}")
+    if castling != '-' and (not set(castling) <= set('KQkq') or len(set(castling)) != len(castling)):
+        raise FenError('castling', f"can't read {castling!r}")
+    if ep_square != '-' and (len(ep_square) != 2 or ep_square[0] not in FILES
+                             or ep_square[1] != ('6' if next_move == 'w' else '3')):
+        raise FenError('en passant', f"{ep_square!r} isn't a square a pawn could have just skipped")
+    try:
+        halfmove_clock, move_number = (int(fields[4]), int(fields[5])) if len(fields) == 6 else (0, 1)
+    except ValueError:
+        raise FenError('counters', f"can't read {fields[4]!r} {fields[5]!r}") from None
+    if halfmove_clock < 0 or move_number < 1:
+        raise FenError('counters', f"{halfmove_clock} {move_number} out of range")
+    return halfmove_clock, move_number
+
+def square_to_coords(square_string):
+    """Takes a square as a string, like 'A1', and returns in-board coordinates"""
+    x_coord = FILES.index(square_string[0])
+    y_coord = RANKS.index(square_string[1])
+    return (x_coord, y_coord)
+
+def coords_to_square(coord):
+    """Goes coordinates (W.r.t. 'A1' square) into a string representing the square"""
+    x_coord, y_coord = coord
+    return FILES[x_coord] + RANKS[y_coord]
+
+def coords_to_index(coord):
+    """Turns in-board coordinates into an index into the 64-byte board, with 'a1' as 0 and 'h8' as 63"""
+    x, y = coord
+    return y * 8 + x
+
+def index_to_coords(index):
+    """Inverse of coords_to_index"""
+    return (index % 8, index // 8)
+
+def is_light(coord):
+    x,y = coord
+    return ((x+y) % 2 == 1)
+
+def flip_coordinates(coord):
+    """Flips in-board coordinates between white and black representations"""
+    x,y = coord
+    return (7-x, 7-y)
+
+class GameBoard:
+    """The position of a game. Pieces live in a 64-byte array of integer piece codes indexed by
+    coords_to_index, so a copy of the piece placement is just a bytes snapshot. material is the
+    material signature, kept up to date alongside zobrist_key."""
+    __slots__ = ('squares', 'flags', 'zobrist_key', 'material')
+
+    def __init__(self, piece_positions, flags):
+        self.squares = bytearray(BOARD_DIMENSIONS * BOARD_DIMENSIONS)
+        for piece_code in piece_positions:
+            for coordinate in piece_positions[piece_code]:
+                self.squares[coords_to_index(coordinate)] = PIECE_TO_CODE[piece_code]
+        self.flags = dict(flags)
+        """flags should be a dictionary, with (potential) keys of each side castling kingside or queenside,
+         threefold repetition counter, whose move it is, halfmove clock (for 50 move rule) and turn counter"""
+        self.zobrist_key = self.compute_zobrist_key()
+        self.material = self.compute_material()
+
+    def compute_zobrist_key(self):
+        """Hashes the pieces, side to move, castling rights and en passant file from scratch.
+        make_move and the flag updates keep zobrist_key equal to this incrementally."""
+        key = 0
+        for index, piece in enumerate(self.squares):
+            if piece:
+                key ^= ZOBRIST_PIECES[piece][index]
+        for option in ZOBRIST_CASTLING:
+            if self.can_castle(option):
+                key ^= ZOBRIST_CASTLING[option]
+        if self.flags['next_move'] == 'b':
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ self.ep_hash()
+
+    def compute_material(self):
+        """The material signature from scratch"""
+        return sum(MATERIAL_UNITS[piece][index] for index, piece in enumerate(self.squares) if piece)
+
+    def piece_count(self, piece):
+        """How many of a piece code there are on the board"""
+        return self.material >> 8 * piece & 0xFF
+
+    def has_insufficient_material(self):
+        """Whether neither side could ever checkmate: kings with at most one knight or bishop
+        between them, or with only bishops, all on squares of one colour"""
+        material = self.material
+        if material & MATING_MATERIAL:
+            return False
+        knights = (material >> 8 * KNIGHT & 0xFF) + (material >> 8 * (BLACK | KNIGHT) & 0xFF)
+        bishops = (material >> 8 * BISHOP & 0xFF) + (material >> 8 * (BLACK | BISHOP) & 0xFF)
+        if knights + bishops <= 1:
+            return True
+        light_bishops = (material >> 8 * (BISHOP | 7) & 0xFF) + (material >> 8 * (BLACK | BISHOP | 7) & 0xFF)
+        return not knights and light_bishops in (0, bishops)
+
+    def ep_hash(self):
+        """The en passant file only counts towards the position when a pawn could actually take
+        en passant, as in the FIDE definition of a repeated position"""
+        ep_target = self.flags.get('ep_target')
+        if not ep_target:
+            return 0
+        x, y = ep_target
+        capturer, pawn_rank = (PAWN, 4) if y == 5 else (BLACK | PAWN, 3)
+        for capturer_x in (x - 1, x + 1):
+            if 0 <= capturer_x < 8 and self.squares[pawn_rank * 8 + capturer_x] == capturer:
+                return ZOBRIST_EP_FILE[x]
+        return 0
+
+    def discard_castling_right(self, option):
+        if self.flags.pop(option, False):
+            self.zobrist_key ^= ZOBRIST_CASTLING[option]
+
+    def piece_at(self, coord):
+        """Returns the piece on a square as a string like 'wP', or '' if the square is empty"""
+        return CODE_TO_PIECE[self.squares[coords_to_index(coord)]]
+
+    def can_castle(self, option):
+        """Takes colour (w or b) and side (k or q) and returns whether castling that way is permitted"""
+        return self.flags.get(option, False)
+
+    def whose_move(self):
+        return self.flags["next_move"]
+
+    def update_move_counters(self):
+        self.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.flags["next_move"] == 'b':
+            self.flags["next_move"] = 'w'
+            self.flags['move_number'] += 1
+        else:
+            self.flags["next_move"] = 'b'
+
+    def update_halfmove_clock(self, from_coord, to_coord):
+        squares = self.squares
+        if squares[coords_to_index(to_coord)] or squares[coords_to_index(from_coord)] & 7 == PAWN:
+            self.flags['halfmove_clock'] = 0
+        else:
+            self.flags['halfmove_clock'] = self.flags['halfmove_clock'] + 1
+
+    def make_move(self, from_coord, to_coord):
+        """Moves a piece, updating the castling rights, en passant target and zobrist key"""
+        self.move_piece(coords_to_index(from_coord), coords_to_index(to_coord))
+
+    def move_piece(self, from_idx, to_idx):
+        """make_move, taking board indices rather than coordinates"""
+        squares = self.squares
+        piece = squares[from_idx]
+        captured = squares[to_idx]
+        key = self.zobrist_key ^ self.ep_hash()
+        key ^= ZOBRIST_PIECES[piece][from_idx] ^ ZOBRIST_PIECES[piece][to_idx]
+        if captured:
+            key ^= ZOBRIST_PIECES[captured][to_idx]
+        units = MATERIAL_UNITS[piece]
+        self.material += units[to_idx] - units[from_idx] - MATERIAL_UNITS[captured][to_idx]
+        squares[to_idx] = piece
+        squares[from_idx] = EMPTY
+        self.zobrist_key = key
+        for index in (from_idx, to_idx):
+            for option in CASTLING_SQUARES.get(index, ()):
+                self.discard_castling_right(option)
+        if piece & 7 == PAWN and abs(to_idx - from_idx) == 16:
+            self.flags['ep_target'] = index_to_coords((from_idx + to_idx) // 2)
+            self.zobrist_key ^= self.ep_hash()
+        else:
+            self.flags['ep_target'] = None
+
+    def set_piece(self, index, piece):
+        """Puts a piece code (or EMPTY) on a square, as for promotions and en passant captures"""
+        old_piece = self.squares[index]
+        if old_piece:
+            self.zobrist_key ^= ZOBRIST_PIECES[old_piece][index]
+        if piece:
+            self.zobrist_key ^= ZOBRIST_PIECES[piece][index]
+        self.material += MATERIAL_UNITS[piece][index] - MATERIAL_UNITS[old_piece][index]
+        self.squares[index] = piece
+
+    def set_all_squares(self, new_square_set):
+        """Takes a 64-byte bytes/bytearray snapshot and makes it the piece placement"""
+        self.squares = bytearray(new_square_set)
+        self.zobrist_key = self.compute_zobrist_key()
+        self.material = self.compute_material()
+
+    def snapshot(self):
+        """Returns an immutable copy of the piece placement"""
+        return bytes(self.squares)
+
+    def copy(self):
+        """A copy of the position, made slot by slot rather than through __init__, which would
+        hash and count an empty board only for the results to be replaced"""
+        board_copy = object.__new__(GameBoard)
+        board_copy.flags = dict(self.flags)
+        board_copy.squares = self.squares[:]
+        board_copy.zobrist_key = self.zobrist_key
+        board_copy.material = self.material
+        return board_copy
+
+    def make_fen(self):
+        ep_square = coords_to_square(self.flags['ep_target']) if self.flags['ep_target'] else '-'
+        if any({self.can_castle(option) for option in ['wk','wq','bk','bq']}):
+            castling_string = ''.join([(op[1].upper() if op[0]=='w' else op[1]) if self.can_castle(op)
+                                       else '' for op in ['wk','wq','bk','bq']])
+        else:
+            castling_string = '-'
+        extra_descriptors = ' '.join([self.flags['next_move'], castling_string, ep_square,
+                                      str(self.flags['halfmove_clock']), str(self.flags['move_number'])])
+
+        placement = self.squares.translate(CODES_TO_FEN_BYTES).decode('ascii')  # '1' for every empty square
+        rows = [placement[row * 8:row * 8 + 8] for row in range(7, -1, -1)]
+        piece_string = '/'.join(rows)
+        for run in range(8, 1, -1):
+            piece_string = piece_string.replace('1' * run, str(run))
+
+        return piece_string + ' ' + extra_descriptors
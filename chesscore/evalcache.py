@@ -0,0 +1,144 @@
+"""A cache of engine analysis, so going back to a position shows what was already worked out.
+
+Positions are keyed by their FEN without the move counters, and with the en passant square only
+when a pawn can take there, so the same position reached by different move orders shares an
+entry. A deeper result replaces a shallower one but never the other way round. Entries are kept
+in memory up to a size limit, least recently used first out, and can also be kept in an SQLite
+file between sessions."""
+
+import collections
+import sqlite3
+
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+ENTRY_OVERHEAD_BYTES = 400  # Rough size of an entry in memory, besides its key and pv
+FLUSH_EVERY = 200  # Changed entries kept before they are written to the SQLite file
+
+
+def position_key(game_state):
+    """The first four fields of the FEN, with the en passant square dropped if no pawn can use it"""
+    fields = game_state.make_fen().split(' ')
+    if fields[3] != '-' and not game_state.ep_hash():
+        fields[3] = '-'
+    return ' '.join(fields[:4])
+
+
+class CacheEntry:
+    """The result of searching a position: the depth reached, the score as ('cp', n) or ('mate', n)
+    for the side to move, the principal variation as coordinate moves, and the nodes searched"""
+    __slots__ = ('depth', 'score', 'pv', 'nodes')
+
+    def __init__(self, depth, score, pv, nodes=0):
+        self.depth = depth
+        self.score = score
+        self.pv = list(pv)
+        self.nodes = nodes
+
+    def __repr__(self):
+        return f"CacheEntry(depth={self.depth}, score={self.score}, pv={' '.join(self.pv)}, nodes={self.nodes})"
+
+    def size(self):
+        return ENTRY_OVERHEAD_BYTES + 64 * len(self.pv)
+
+
+class AnalysisCache:
+    """position_key -> CacheEntry, limited to max_bytes in memory. With a path, entries are also
+    kept in an SQLite file: lookups that miss in memory fall back to it, and new results are
+    written to it in batches and on close(). engine separates the results of different engines
+    sharing a file."""
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, path=None, engine=''):
+        self.max_bytes = max_bytes
+        self.engine = engine
+        self.entries = collections.OrderedDict()  # Least recently used first
+        self.used_bytes = 0
+        self.dirty = set()  # Keys changed since the last flush
+        self.hits = self.misses = 0
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS analysis (engine TEXT, position TEXT, depth INTEGER, score_kind TEXT,"
+                " score INTEGER, pv TEXT, nodes INTEGER, PRIMARY KEY (engine, position))")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """The entry for a position key, or None"""
+        entry = self._find(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def _find(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+        if self.connection is not None:
+            row = self.connection.execute(
+                "SELECT depth, score_kind, score, pv, nodes FROM analysis WHERE engine = ? AND position = ?",
+                (self.engine, key)).fetchone()
+            if row is not None:
+                depth, score_kind, score, pv, nodes = row
+                entry = CacheEntry(depth, (score_kind, score), pv.split(), nodes)
+                self._insert(key, entry)
+                return entry
+        return None
+
+    def store(self, key, depth, score, pv, nodes=0):
+        """Keeps a search result unless the position already has one from a deeper search.
+        Returns whether it was kept."""
+        entry = self._find(key)
+        if entry is not None and entry.depth > depth:
+            return False
+        if entry is not None:
+            self.used_bytes -= entry.size()
+            entry.depth, entry.score, entry.pv, entry.nodes = depth, score, list(pv), nodes
+            self.used_bytes += entry.size()
+            self._evict()
+        else:
+            self._insert(key, CacheEntry(depth, score, pv, nodes))
+        if self.connection is not None:
+            self.dirty.add(key)
+            if len(self.dirty) >= FLUSH_EVERY:
+                self.flush()
+        return True
+
+    def _insert(self, key, entry):
+        self.entries[key] = entry
+        self.used_bytes += entry.size() + len(key)
+        self._evict()
+
+    def _evict(self):
+        while self.used_bytes > self.max_bytes and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            if key in self.dirty:  # Don't lose it before it reaches the file
+                self._write([(key, entry)])
+                self.dirty.discard(key)
+            self.used_bytes -= entry.size() + len(key)
+
+    def _write(self, items):
+        self.connection.executemany(
+            "INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (engine, position) DO UPDATE SET"
+            " depth = excluded.depth, score_kind = excluded.score_kind, score = excluded.score, pv = excluded.pv,"
+            " nodes = excluded.nodes WHERE excluded.depth >= analysis.depth",
+            [(self.engine, key, entry.depth, entry.score[0], entry.score[1], ' '.join(entry.pv), entry.nodes)
+             for key, entry in items])
+        self.connection.commit()
+
+    def flush(self):
+        """Writes changed entries to the SQLite file"""
+        if self.connection is not None and self.dirty:
+            self._write([(key, self.entries[key]) for key in self.dirty if key in self.entries])
+            self.dirty.clear()
+
+    def close(self):
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,270 @@
+"""Opening explorer: for every position reached in a collection of games, the moves played from
+it and how the games went.
+
+The index is a directory of segment files. Each segment holds fixed-size records of
+(zobrist key, move, games, white wins, draws, black wins), sorted by key and move, and is read
+through a memory map with a binary search, so a lookup costs a few dozen reads whatever the size
+of the index. Adding games writes a new segment next to the old ones, and compact() merges them
+all into one.
+
+"python -m chesscore.explorer build INDEX games.pgn [...]" adds games to an index, and
+"python -m chesscore.explorer query INDEX [FEN]" shows the moves from a position."""
+
+import argparse
+import collections
+import itertools
+import mmap
+import os
+import struct
+import sys
+import time
+
+from chesscore.board import *
+from chesscore.movegen import apply_move, legal_moves, move_to_uci
+from chesscore.parallel import chunked, map_in_order
+from chesscore.pgn import read_games
+from chesscore.san import move_to_san, san_to_move
+
+SEGMENT_MAGIC = b'MCXI'
+SEGMENT_HEADER = struct.Struct('<4sIQ')  # Magic, version, number of records
+SEGMENT_VERSION = 1
+RECORD = struct.Struct('<QHIIII')  # Zobrist key, move, games, white wins, draws, black wins
+KEY = struct.Struct('<Q')
+DEFAULT_MAX_PLIES = 40  # How far into each game positions are indexed
+STATS_PER_SEGMENT = 2000000  # Distinct (position, move) pairs gathered before a segment is written
+GAMES_PER_CHUNK = 200  # Games handed to a worker process at a time
+RESULT_COLUMNS = {'1-0': 1, '1/2-1/2': 2, '0-1': 3}  # Result -> which of the counters after games it adds to
+
+
+class MoveStats:
+    """How often a move was played from a position, and the results of those games"""
+    __slots__ = ('move', 'games', 'white_wins', 'draws', 'black_wins')
+
+    def __init__(self, move, games, white_wins, draws, black_wins):
+        self.move = move
+        self.games = games
+        self.white_wins = white_wins
+        self.draws = draws
+        self.black_wins = black_wins
+
+    def __repr__(self):
+        return f"MoveStats({move_to_uci(self.move)}, {self.games} games, " \
+               f"+{self.white_wins} ={self.draws} -{self.black_wins})"
+
+
+def game_statistics(games, max_plies=DEFAULT_MAX_PLIES):
+    """(key, move) -> [games, white wins, draws, black wins] over the first max_plies of each game.
+    Games with a move that can't be played count up to that move."""
+    stats = collections.defaultdict(lambda: [0, 0, 0, 0])
+    for game in games:
+        result_column = RESULT_COLUMNS.get(game.result)
+        try:
+            game_state = game.starting_board()
+        except ValueError:
+            continue
+        for san in itertools.islice(game.sans(), max_plies):
+            try:
+                move = san_to_move(game_state, san)
+            except ValueError:
+                break
+            counts = stats[(game_state.zobrist_key, move)]
+            counts[0] += 1
+            if result_column:
+                counts[result_column] += 1
+            apply_move(game_state, move)
+    return stats
+
+def _game_chunk_statistics(games_and_plies):
+    games, max_plies = games_and_plies
+    return dict(game_statistics(games, max_plies))
+
+
+def write_segment(path, stats):
+    """Writes (key, move) -> counts as a sorted segment file"""
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as segment_file:
+        segment_file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, len(stats)))
+        for (key, move), counts in sorted(stats.items()):
+            segment_file.write(RECORD.pack(key, move, *counts))
+    os.replace(temporary_path, path)
+
+
+class Segment:
+    """One memory-mapped segment file"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as segment_file:
+            self.data = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.length = SEGMENT_HEADER.unpack_from(self.data)
+        if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION \
+                or len(self.data) != SEGMENT_HEADER.size + self.length * RECORD.size:
+            self.data.close()
+            raise ValueError(f"{path} isn't an explorer segment")
+
+    def close(self):
+        self.data.close()
+
+    def lookup(self, key):
+        """The records for a key, as (move, games, white wins, draws, black wins) tuples"""
+        data = self.data
+        low, high = 0, self.length
+        while low < high:  # Find the first record with this key
+            middle = (low + high) // 2
+            if KEY.unpack_from(data, SEGMENT_HEADER.size + middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        records = []
+        offset = SEGMENT_HEADER.size + low * RECORD.size
+        end = SEGMENT_HEADER.size + self.length * RECORD.size
+        while offset < end:
+            record = RECORD.unpack_from(data, offset)
+            if record[0] != key:
+                break
+            records.append(record[1:])
+            offset += RECORD.size
+        return records
+
+    def records(self):
+        for offset in range(SEGMENT_HEADER.size, SEGMENT_HEADER.size + self.length * RECORD.size, RECORD.size):
+            yield RECORD.unpack_from(self.data, offset)
+
+
+class ExplorerIndex:
+    """An opening explorer index stored in a directory"""
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.segments = [Segment(os.path.join(directory, name)) for name in self.segment_names()]
+
+    def segment_names(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.startswith('segment-') and name.endswith('.bin'))
+
+    def next_segment_path(self):
+        names = self.segment_names()
+        number = int(names[-1][8:-4]) + 1 if names else 1
+        return os.path.join(self.directory, f"segment-{number:06d}.bin")
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    def lookup_key(self, key):
+        """The moves played from the position with this zobrist key, most played first"""
+        if len(self.segments) == 1:
+            found = [MoveStats(*record) for record in self.segments[0].lookup(key)]
+        else:
+            totals = {}
+            for segment in self.segments:
+                for move, *counts in segment.lookup(key):
+                    if move in totals:
+                        totals[move] = [total + count for total, count in zip(totals[move], counts)]
+                    else:
+                        totals[move] = counts
+            found = [MoveStats(move, *counts) for move, counts in totals.items()]
+        found.sort(key=lambda stats: stats.games, reverse=True)
+        return found
+
+    def lookup(self, game_state):
+        return self.lookup_key(game_state.zobrist_key)
+
+    def add_statistics(self, stats):
+        """Writes the statistics as a new segment"""
+        if stats:
+            path = self.next_segment_path()
+            write_segment(path, stats)
+            self.segments.append(Segment(path))
+
+    def add_games(self, games, max_plies=DEFAULT_MAX_PLIES, jobs=1, progress=None):
+        """Indexes games (PgnGames), writing a segment each time STATS_PER_SEGMENT (position, move)
+        pairs have been gathered. jobs > 1 replays them in that many processes. progress is called
+        with the number of games done so far after each chunk. Returns the number of games."""
+        stats = collections.defaultdict(lambda: [0, 0, 0, 0])
+        game_count = 0
+        chunks = ((chunk, max_plies) for chunk in chunked(games, GAMES_PER_CHUNK))
+        for (chunk, max_plies), chunk_stats in map_in_order(_game_chunk_statistics, chunks, jobs):
+            for position_move, counts in chunk_stats.items():
+                totals = stats[position_move]
+                for column in range(4):
+                    totals[column] += counts[column]
+            game_count += len(chunk)
+            if len(stats) >= STATS_PER_SEGMENT:
+                self.add_statistics(stats)
+                stats.clear()
+            if progress is not None:
+                progress(game_count)
+        self.add_statistics(stats)
+        return game_count
+
+    def compact(self):
+        """Merges every segment into one"""
+        if len(self.segments) < 2:
+            return
+        merged = collections.defaultdict(lambda: [0, 0, 0, 0])
+        for segment in self.segments:
+            for key, move, *counts in segment.records():
+                totals = merged[(key, move)]
+                for column in range(4):
+                    totals[column] += counts[column]
+        old_paths = [segment.path for segment in self.segments]
+        path = self.next_segment_path()
+        write_segment(path, merged)
+        self.close()
+        for old_path in old_paths:
+            os.remove(old_path)
+        self.segments = [Segment(path)]
+
+
+def stats_lines(game_state, move_stats):
+    """Text lines for a position's moves: SAN, number of games, and White win / draw / Black win %"""
+    moves = legal_moves(game_state)
+    lines = []
+    for stats in move_stats:
+        san = move_to_san(game_state, stats.move, moves) if stats.move in moves else move_to_uci(stats.move)
+        games = stats.games
+        lines.append(f"{san:<7} {games:>8}  {100 * stats.white_wins / games:3.0f}% {100 * stats.draws / games:3.0f}% "
+                     f"{100 * stats.black_wins / games:3.0f}%")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m chesscore.explorer', description="Build and query an opening explorer index")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="add the games in PGN files to an index")
+    build.add_argument('index')
+    build.add_argument('pgn_files', nargs='+')
+    build.add_argument('--max-plies', type=int, default=DEFAULT_MAX_PLIES)
+    build.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+    build.add_argument('--compact', action='store_true', help="merge the segments afterwards")
+    query = commands.add_parser('query', help="show the moves played from a position")
+    query.add_argument('index')
+    query.add_argument('fen', nargs='?', default=STARTING_FEN)
+    args = parser.parse_args(argv)
+
+    index = ExplorerIndex(args.index)
+    if args.command == 'build':
+        start_time = time.perf_counter()
+        total = 0
+        for path in args.pgn_files:
+            total += index.add_games(read_games(path), args.max_plies, args.jobs)
+        if args.compact:
+            index.compact()
+        elapsed = time.perf_counter() - start_time
+        print(f"{total} games indexed in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} games/s), "
+              f"{len(index.segments)} segment{'s' if len(index.segments) != 1 else ''}")
+    else:
+        game_state = fen_to_gameboard(args.fen)
+        start_time = time.perf_counter()
+        move_stats = index.lookup(game_state)
+        elapsed = time.perf_counter() - start_time
+        for line in stats_lines(game_state, move_stats):
+            print(line)
+        print(f"{len(move_stats)} moves, looked up in {elapsed * 1e6:.0f}us")
+    index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
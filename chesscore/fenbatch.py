@@ -0,0 +1,145 @@
+"""Batch FEN cleaning: reads FENs a line at a time, checks and normalises each one in a pool of
+worker processes, and writes the normalised FENs out in the order they came in.
+
+A FEN is rejected if fen_to_gameboard can't read it, or if the position couldn't happen (no king,
+pawns on the first or last rank, the side not to move in check). Normalising drops castling
+rights whose king or rook has left home, and en passant squares no pawn can take on. The result
+must read back to the same FEN and zobrist key.
+
+Run with "python -m chesscore.fenbatch [options] [file ...]" from the top of the repository.
+With no files, or "-", it reads standard input. The throughput and the count of each class of
+error go to standard error at the end."""
+
+import argparse
+import collections
+import itertools
+import os
+import sys
+import time
+
+from chesscore.board import *
+from chesscore.movegen import CASTLING_MOVES, is_attacked
+from chesscore.parallel import chunked, map_in_order
+
+CHUNK_SIZE = 2000  # FENs sent to a worker at a time
+
+
+def check_position(board):
+    """Raises FenError if the position read from a FEN could never come up in a game"""
+    squares = board.squares
+    for colour, name in ((0, 'white'), (BLACK, 'black')):
+        kings = squares.count(colour | KING)
+        if kings != 1:
+            raise FenError('kings', f"{name} has {kings} kings")
+    if any(squares[index] & 7 == PAWN for index in itertools.chain(range(8), range(56, 64))):
+        raise FenError('pawns', "pawn on the first or last rank")
+    waiting_side = 0 if board.whose_move() == 'b' else BLACK
+    if is_attacked(squares, squares.find(waiting_side | KING), waiting_side ^ BLACK):
+        raise FenError('check', "the side not to move is in check")
+
+def normalize(board):
+    """Drops castling rights and en passant squares that can't be used"""
+    squares = board.squares
+    for option, castling_move in CASTLING_MOVES.items():
+        king_from, rook_from = castling_move[0], castling_move[2]
+        colour = BLACK if option[0] == 'b' else 0
+        if squares[king_from] != colour | KING or squares[rook_from] != colour | ROOK:
+            board.discard_castling_right(option)
+    if board.flags['ep_target'] and not board.ep_hash():
+        board.flags['ep_target'] = None
+
+def clean_fen(fen):
+    """The normalised form of a FEN. Raises FenError if it is malformed, impossible, or doesn't
+    survive being written out and read back."""
+    board = fen_to_gameboard(fen)
+    check_position(board)
+    normalize(board)
+    normalized = board.make_fen()
+    reread = fen_to_gameboard(normalized)
+    if reread.make_fen() != normalized or reread.zobrist_key != board.zobrist_key:
+        raise FenError('round trip', f"{normalized} doesn't read back the same")
+    return normalized
+
+def clean_chunk(lines):
+    """(normalised FEN or None, error kind or None, error message or None) for each line"""
+    results = []
+    for line in lines:
+        try:
+            results.append((clean_fen(line), None, None))
+        except FenError as error:
+            results.append((None, error.kind, str(error)))
+    return results
+
+
+def read_numbered_lines(paths):
+    """(line number, line) for every non-blank line of the files, or of standard input. Lines are
+    numbered from 1 through all the files, blank ones included."""
+    number = 0
+    for path in paths or ['-']:
+        source = sys.stdin if path == '-' else open(path, encoding='utf-8', errors='replace')
+        try:
+            for line in source:
+                number += 1
+                line = line.strip()
+                if line:
+                    yield number, line
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+def read_lines(paths):
+    """Every non-blank line of the files, or of standard input"""
+    for number, line in read_numbered_lines(paths):
+        yield line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m chesscore.fenbatch', description=__doc__.split('\n\n')[0])
+    parser.add_argument('files', nargs='*', help="FEN files, one position per line (default: standard input)")
+    parser.add_argument('-o', '--output', help="where to write the normalised FENs (default: standard output)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="FENs sent to a worker at a time")
+    parser.add_argument('-u', '--unique', action='store_true',
+                        help="leave out positions already written, ignoring the move counters")
+    parser.add_argument('--show-errors', action='store_true', help="write each rejected line to standard error")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    error_counts = collections.Counter()
+    seen = set()
+    total = written = duplicates = 0
+    start_time = time.perf_counter()
+    try:
+        for chunk, results in map_in_order(clean_chunk, chunked(read_lines(args.files), args.chunk_size), args.jobs):
+            output_lines = []
+            for line, (normalized, error_kind, error_message) in zip(chunk, results):
+                total += 1
+                if normalized is None:
+                    error_counts[error_kind] += 1
+                    if args.show_errors:
+                        print(f"line {total}: {error_message}: {line}", file=sys.stderr)
+                    continue
+                if args.unique:
+                    position = normalized.rsplit(' ', 2)[0]
+                    if position in seen:
+                        duplicates += 1
+                        continue
+                    seen.add(position)
+                output_lines.append(normalized + '\n')
+            written += len(output_lines)
+            out.writelines(output_lines)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start_time
+
+    print(f"{total} positions in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} positions/s) "
+          f"with {args.jobs} job{'s' if args.jobs != 1 else ''}", file=sys.stderr)
+    print(f"{written} written, {duplicates} duplicates, {sum(error_counts.values())} rejected", file=sys.stderr)
+    for kind, count in error_counts.most_common():
+        print(f"  {kind:<14} {count}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""The history of a game: every position reached, the moves between them and repetition counts.
+GameHistory keeps one line of play; GameTree keeps every line tried from a position."""
+
+from chesscore.board import *
+from chesscore.movegen import apply_move, move_to_uci
+from chesscore.san import parse_move
+
+HISTORY_CHECKPOINT_INTERVAL = 32  # Plies between full snapshots in a MoveHistory or GameTree
+
+
+def position_changes(squares, flags, game_state):
+    """What changes from squares and flags to game_state: bytes of (square, old piece, new piece)
+    triples, and a tuple of (flag, old value, new value)"""
+    new_squares = game_state.squares
+    changes = bytearray()
+    for index in range(BOARD_DIMENSIONS * BOARD_DIMENSIONS):
+        if squares[index] != new_squares[index]:
+            changes += bytes((index, squares[index], new_squares[index]))
+    flag_changes = tuple((flag, flags.get(flag), game_state.flags.get(flag))
+                         for flag in flags.keys() | game_state.flags.keys()
+                         if flags.get(flag) != game_state.flags.get(flag))
+    return bytes(changes), flag_changes
+
+
+class MoveHistory:
+    """The positions reached in a game. Each ply is stored as a compact record of the squares and
+    flags it changed, with a full snapshot every HISTORY_CHECKPOINT_INTERVAL plies. The position at
+    the cursor is kept built, so stepping one ply either way only touches what that ply changed."""
+    def __init__(self, game_state):
+        self.records = []  # (bytes of (square, old piece, new piece) triples, ((flag, old, new), ...))
+        self.checkpoints = [(game_state.snapshot(), dict(game_state.flags))]
+        self.cursor = 0
+        self.squares = bytearray(game_state.squares)
+        self.flags = dict(game_state.flags)
+
+    def __len__(self):
+        return len(self.records) + 1
+
+    def append(self, game_state):
+        """Records the move leading from the last position to game_state"""
+        self.seek(len(self.records))
+        squares = self.squares
+        self.records.append(position_changes(squares, self.flags, game_state))
+        squares[:] = game_state.squares
+        self.flags = dict(game_state.flags)
+        self.cursor += 1
+        if self.cursor % HISTORY_CHECKPOINT_INTERVAL == 0:
+            self.checkpoints.append((bytes(squares), dict(self.flags)))
+
+    def truncate(self, length):
+        """Keeps only the first length positions"""
+        if self.cursor >= length:
+            self.seek(length - 1)
+        del self.records[length - 1:]
+        del self.checkpoints[(length - 1) // HISTORY_CHECKPOINT_INTERVAL + 1:]
+
+    def forwards(self):
+        changes, flag_changes = self.records[self.cursor]
+        for i in range(0, len(changes), 3):
+            self.squares[changes[i]] = changes[i + 2]
+        for flag, old_value, new_value in flag_changes:
+            self.flags[flag] = new_value
+        self.cursor += 1
+
+    def backwards(self):
+        self.cursor -= 1
+        changes, flag_changes = self.records[self.cursor]
+        for i in range(0, len(changes), 3):
+            self.squares[changes[i]] = changes[i + 1]
+        for flag, old_value, new_value in flag_changes:
+            self.flags[flag] = old_value
+
+    def seek(self, index):
+        """Moves the cursor to a position, replaying from the nearest checkpoint if that is closer"""
+        checkpoint_idx = index // HISTORY_CHECKPOINT_INTERVAL
+        if index - checkpoint_idx * HISTORY_CHECKPOINT_INTERVAL < abs(index - self.cursor):
+            piece_state, flag_state = self.checkpoints[checkpoint_idx]
+            self.squares = bytearray(piece_state)
+            self.flags = dict(flag_state)
+            self.cursor = checkpoint_idx * HISTORY_CHECKPOINT_INTERVAL
+        while self.cursor < index:
+            self.forwards()
+        while self.cursor > index:
+            self.backwards()
+
+    def position(self, index):
+        """Returns a new GameBoard of the position after index plies"""
+        self.seek(index)
+        game_state = GameBoard({}, self.flags)
+        game_state.set_all_squares(self.squares)
+        return game_state
+
+
+class GameHistory:
+    """Record of a game from its starting position: the positions in a MoveHistory, the moves made
+    between them, and a zobrist key -> occurrences table for repetitions. HistoryBoard displays
+    one of these, and it can be used on its own without a display."""
+    def __init__(self, game_state):
+        self.starting_fen = game_state.make_fen()
+        self.board_history = MoveHistory(game_state)
+        self.key_history = [game_state.zobrist_key]  # Zobrist key of each position in board_history
+        self.repetition_table = {game_state.zobrist_key: 1}
+        self.moves_made = []
+
+    def __len__(self):
+        return len(self.board_history)
+
+    def position(self, index):
+        """Returns a new GameBoard of the position after index plies"""
+        return self.board_history.position(index)
+
+    def squares_at(self, index):
+        """The piece placement after index plies, without building a GameBoard. Only valid until
+        the history is next used."""
+        self.board_history.seek(index)
+        return self.board_history.squares
+
+    def count_repetitions(self, game_state):
+        """How many times game_state would have occurred if it were added next, including itself"""
+        return self.repetition_table.get(game_state.zobrist_key, 0) + 1
+
+    def truncate(self, length):
+        """Keeps only the first length positions and the moves between them"""
+        for key in self.key_history[length:]:
+            remaining = self.repetition_table[key] - 1
+            if remaining:
+                self.repetition_table[key] = remaining
+            else:
+                del self.repetition_table[key]
+        del self.key_history[length:]
+        self.board_history.truncate(length)
+        del self.moves_made[length - 1:]
+
+    def append(self, game_state, move_made):
+        """Adds the position reached by move_made from the last position"""
+        key = game_state.zobrist_key
+        self.repetition_table[key] = self.repetition_table.get(key, 0) + 1
+        self.key_history.append(key)
+        self.moves_made.append(move_made)
+        self.board_history.append(game_state)
+
+    def play(self, game_state, move):
+        """Plays a move from movegen on game_state, which must be the last position, and records it"""
+        apply_move(game_state, move)
+        game_state.flags['repetition_ct'] = self.count_repetitions(game_state)
+        self.append(game_state, move_to_uci(move))
+
+
+class VariationNode:
+    """A position in a GameTree, stored as the move text that reached it and what that move changed.
+    selected is the child the current line goes on with. A node with no children can hold unplayed
+    moves that carry on from it, in reverse order, to be played onto the tree when they are needed."""
+    __slots__ = ('parent', 'children', 'selected', 'move_text', 'changes', 'flag_changes', 'key', 'depth',
+                 'snapshot', 'unplayed')
+
+    def __init__(self, parent, move_text, changes, flag_changes, key):
+        self.parent = parent
+        self.children = []
+        self.selected = None
+        self.move_text = move_text
+        self.changes = changes
+        self.flag_changes = flag_changes
+        self.key = key
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.snapshot = None  # (squares, flags) at every HISTORY_CHECKPOINT_INTERVAL plies
+        self.unplayed = None
+
+
+class GameTree:
+    """Every line played from a starting position, as a tree of VariationNodes. Lines share the
+    nodes of the moves they have in common, and each node only holds what its move changed, so the
+    tree grows with the number of distinct positions visited rather than lines times their length.
+
+    The tree shows one line at a time, which works like a GameHistory: len(), position(index),
+    squares_at(index), moves_made and key_history all follow it from the root, taking each node's
+    selected child. Moving along the line steps through one node's changes, and cut() and append()
+    start a new variation without throwing the old continuation away.
+
+    The end of the line can be left unplayed: add_unplayed() gives moves that carry the line on,
+    which count in len() and moves_made but only become nodes when something looks at them. They
+    are held by the last node of the line, and stay unplayed below it when the line is cut short."""
+    def __init__(self, game_state):
+        self.starting_fen = game_state.make_fen()
+        self.root = VariationNode(None, '', b'', (), game_state.zobrist_key)
+        self.root.snapshot = (bytes(game_state.squares), dict(game_state.flags))
+        self.node_count = 1
+        self.line = [self.root]  # The nodes of the line shown
+        self.moves_made = []
+        self.key_history = [game_state.zobrist_key]
+        self.cursor = self.root  # The node whose position squares and flags hold
+        self.squares = bytearray(game_state.squares)
+        self.flags = dict(game_state.flags)
+
+    @classmethod
+    def from_history(cls, history):
+        """A tree holding the one line of a GameHistory"""
+        tree = cls(history.position(0))
+        for index, move_made in enumerate(history.moves_made, 1):
+            tree.append(history.position(index), move_made)
+        return tree
+
+    def __len__(self):
+        return len(self.line) + len(self.line[-1].unplayed or ())
+
+    def add_unplayed(self, move_texts):
+        """Carries the line on with moves that are only played onto the tree when it gets to them.
+        Only a node with no children can hold them, so while the line ends at one with children the
+        moves are played straight away."""
+        self.moves_made.extend(move_texts)
+        move_texts = list(reversed(move_texts))
+        while move_texts and self.line[-1].children:
+            node = self._play_onto_line(move_texts.pop())
+            if node.unplayed == move_texts:  # The line goes on the way an earlier one did
+                return
+            if node.unplayed:  # Left from an earlier line; play its first move so the node can branch
+                self._play_unplayed(len(self.line))
+                del self.line[-1]
+                del self.key_history[-1]
+        if move_texts:
+            self.line[-1].unplayed = move_texts + (self.line[-1].unplayed or [])
+
+    def _play_unplayed(self, index):
+        """Plays unplayed moves until the line has a node for the position after index plies. The
+        moves after it stay unplayed, held by that node."""
+        while len(self.line) <= index and self.line[-1].unplayed:
+            node = self.line[-1]
+            unplayed, node.unplayed = node.unplayed, None
+            child = self._play_onto_line(unplayed.pop())
+            child.unplayed = unplayed or None
+
+    def _play_onto_line(self, move_text):
+        """Plays move_text from the end of the line, adds its node to the line and returns it"""
+        node = self.line[-1]
+        game_state = self.position(len(self.line) - 1)
+        apply_move(game_state, parse_move(game_state, move_text))
+        game_state.flags['repetition_ct'] = self.count_repetitions(game_state)
+        child = self._add_child(node, game_state, move_text)
+        node.selected = child
+        self.line.append(child)
+        self.key_history.append(child.key)
+        return child
+
+    def _forwards(self, node):
+        """Steps the cursor to one of its children"""
+        changes = node.changes
+        for i in range(0, len(changes), 3):
+            self.squares[changes[i]] = changes[i + 2]
+        for flag, old_value, new_value in node.flag_changes:
+            self.flags[flag] = new_value
+        self.cursor = node
+
+    def _backwards(self):
+        """Steps the cursor to its parent"""
+        node = self.cursor
+        changes = node.changes
+        for i in range(0, len(changes), 3):
+            self.squares[changes[i]] = changes[i + 1]
+        for flag, old_value, new_value in node.flag_changes:
+            self.flags[flag] = old_value
+        self.cursor = node.parent
+
+    def seek(self, index):
+        """Moves the cursor to the position after index plies of the line, stepping along the line
+        or from the nearest checkpoint before it, whichever is shorter"""
+        if index >= len(self.line):
+            self._play_unplayed(index)
+        line = self.line
+        cursor = self.cursor
+        if cursor is line[index]:
+            return
+        checkpoint_idx = index - index % HISTORY_CHECKPOINT_INTERVAL
+        on_line = cursor.depth < len(line) and line[cursor.depth] is cursor
+        if not on_line or index - checkpoint_idx < abs(index - cursor.depth):
+            piece_state, flag_state = line[checkpoint_idx].snapshot
+            self.squares = bytearray(piece_state)
+            self.flags = dict(flag_state)
+            self.cursor = line[checkpoint_idx]
+        while self.cursor.depth < index:
+            self._forwards(line[self.cursor.depth + 1])
+        while self.cursor.depth > index:
+            self._backwards()
+
+    def position(self, index):
+        """Returns a new GameBoard of the position after index plies of the line"""
+        self.seek(index)
+        game_state = GameBoard({}, self.flags)
+        game_state.set_all_squares(self.squares)
+        return game_state
+
+    def squares_at(self, index):
+        """The piece placement after index plies of the line, without building a GameBoard. Only
+        valid until the tree is next used."""
+        self.seek(index)
+        return self.squares
+
+    def count_repetitions(self, game_state):
+        """How many times game_state would have occurred if it were added to the end of the line,
+        including itself. Only positions since the last capture or pawn move can repeat it."""
+        key = game_state.zobrist_key
+        count = 1
+        node = self.line[-1]
+        for ply in range(game_state.flags.get('halfmove_clock', 0)):
+            if node is None:
+                break
+            if node.key == key:
+                count += 1
+            node = node.parent
+        return count
+
+    def cut(self, length):
+        """Ends the line after its first length positions. The moves after stay in the tree, as the
+        variation the next append() branches from. Of those still unplayed, only the first is played,
+        to give the variation a node; the rest stay unplayed below it."""
+        self._play_unplayed(length)
+        del self.line[length:]
+        del self.key_history[length:]
+        del self.moves_made[length - 1:]
+
+    def append(self, game_state, move_made):
+        """Adds the position reached by move_made from the end of the line and selects it. If that
+        move was already tried from there, its node is reused and the line carries on with the
+        continuation selected below it. Returns the number of plies added to the line. Any unplayed
+        moves are played first, as the new position follows the last of them."""
+        self._play_unplayed(len(self) - 1)
+        parent = self.line[-1]
+        child = self._add_child(parent, game_state, move_made)
+        parent.selected = child
+        length = len(self.line)
+        self._extend_line(child)
+        return len(self.line) - length
+
+    def _add_child(self, parent, game_state, move_made):
+        """The child of parent reached by move_made, added to the tree if it isn't there yet"""
+        for child in parent.children:
+            if child.key == game_state.zobrist_key and child.move_text == move_made:
+                return child
+        self.seek(parent.depth)
+        child = VariationNode(parent, move_made, *position_changes(self.squares, self.flags, game_state),
+                              game_state.zobrist_key)
+        if child.depth % HISTORY_CHECKPOINT_INTERVAL == 0:
+            child.snapshot = (bytes(game_state.squares), dict(game_state.flags))
+        parent.children.append(child)
+        self.node_count += 1
+        return child
+
+    def _extend_line(self, node):
+        """Adds node and then its selected continuation to the end of the line, including any moves
+        left unplayed at the end of it"""
+        while node is not None:
+            self.line.append(node)
+            self.moves_made.append(node.move_text)
+            self.key_history.append(node.key)
+            node = node.selected
+        self.moves_made.extend(reversed(self.line[-1].unplayed or ()))
+
+    def variations(self, index):
+        """The moves tried from the position after index plies, and which of them the line takes"""
+        self._play_unplayed(index + 1)
+        node = self.line[index]
+        return [child.move_text for child in node.children], \
+            node.children.index(node.selected) if node.selected is not None else None
+
+    def select(self, index, variation):
+        """Makes the line go on from the position after index plies with the variation'th move
+        tried from there"""
+        self._play_unplayed(index + 1)
+        node = self.line[index]
+        node.selected = node.children[variation]
+        self.cut(index + 1)
+        self._extend_line(node.selected)
+
+    def play(self, game_state, move):
+        """Plays a move from movegen on game_state, which must be the end of the line, and records it"""
+        apply_move(game_state, move)
+        game_state.flags['repetition_ct'] = self.count_repetitions(game_state)
+        self.append(game_state, move_to_uci(move))
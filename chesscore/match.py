@@ -0,0 +1,451 @@
+"""Engine matches: many games between two UCI engines, played in worker processes with no display.
+
+Games start from the positions of a FEN book (one per line, EPD operations ignored), each played
+twice with the engines swapping colours, or from the usual starting position. The games are
+handed out to the workers in chunks of up to GAMES_PER_CHUNK, fewer when a short match would
+otherwise leave workers idle; a worker keeps its two engine processes for the whole chunk and
+referees each game with a GameHistory, so repetitions and the 50 move rule come from the same
+flags the GUI uses. Draws a player could claim are claimed straight away.
+
+A game also ends when an engine runs out of time (a draw if the other side has only its king),
+plays an illegal move, crashes or hangs, and it can be adjudicated by a move limit, by both
+engines' scores staying past --resign-score or inside --draw-score for a number of moves, or by
+endgame bitbases.
+
+Finished games are written as they come in, as PGN or, for a path ending in .jsonl, as one JSON
+record per line. At the end the runner prints the score with an Elo estimate, games per second,
+how busy the CPUs were (from os.times, so engine CPU time is only counted on systems that report
+it for child processes) and, for each worker, how much of its time went on anything other than
+an engine thinking.
+
+Run with "python -m chesscore.match [options] ENGINE1 ENGINE2", where an engine is a command line
+or 'builtin' for chesscore.search."""
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import os
+import shlex
+import sys
+import time
+
+from chesscore.board import *
+from chesscore.history import GameHistory
+from chesscore.movegen import game_outcome, legal_moves, move_to_uci
+from chesscore.parallel import map_in_order
+from chesscore.pgn import game_headers, write_game
+from chesscore.uci import EngineError, UciEngine, position_command
+
+BUILT_IN_ENGINE = [sys.executable, '-m', 'chesscore.search']
+DEFAULT_TIME_CONTROL = '10+0.1'
+GAMES_PER_CHUNK = 8
+MOVE_TIMEOUT_GRACE = 5.0  # Seconds past its clock, or its move time, before an engine is taken to have hung
+HANG_TIMEOUT = 300.0  # Seconds a depth or nodes search may take before the engine is taken to have hung
+MATE_CP = 100000  # Centipawns a mate score counts as for adjudication
+PGN_TERMINATIONS = {'checkmate': 'normal', 'stalemate': 'normal', 'insufficient material': 'normal',
+                    'repetition': 'normal', 'fivefold repetition': 'normal', '50 move rule': 'normal',
+                    '75 move rule': 'normal', 'time forfeit': 'time forfeit', 'illegal move': 'rules infraction',
+                    'engine crashed': 'abandoned', 'engine hung': 'abandoned'}  # Anything else is an adjudication
+
+
+def parse_time_control(text):
+    """'10+0.1' or '60' -> (base seconds, increment seconds)"""
+    base, plus, increment = text.partition('+')
+    try:
+        return float(base), float(increment) if plus else 0.0
+    except ValueError:
+        raise ValueError(f"can't read time control {text!r}") from None
+
+def engine_command(text):
+    return list(BUILT_IN_ENGINE) if text == 'builtin' else shlex.split(text)
+
+def read_book(path):
+    """The FENs in a book file, one position per line, with EPD operations left off. Raises
+    FenError naming the line of the first position fen_to_gameboard can't read."""
+    fens = []
+    with open(path) as book_file:
+        for line_number, line in enumerate(book_file, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+                fen = ' '.join(fields[:6])
+            else:
+                fen = ' '.join(fields[:4])
+            try:
+                fens.append(fen_to_gameboard(fen).make_fen())
+            except FenError as error:
+                raise FenError(error.kind, f"line {line_number}: {error}") from None
+    return fens
+
+def game_specs(fens, games):
+    """(round, starting FEN, whether the first engine has White) for each game"""
+    return [(number + 1, fens[number // 2 % len(fens)], number % 2 == 0) for number in range(games)]
+
+def only_king(game_state, colour):
+    """Whether a side (0 or BLACK) has nothing left but its king"""
+    return all(not game_state.piece_count(colour | kind) for kind in range(PAWN, KING))
+
+
+class Player:
+    """An engine as used by a worker, started when first needed and restarted after it crashes or hangs"""
+    def __init__(self, command, options):
+        self.command = command
+        self.options = options
+        self.engine = None
+        self.name = command[-1] if command else '?'
+        self.start_seconds = 0.0
+
+    async def new_game(self):
+        if self.engine is None:
+            start_time = time.perf_counter()
+            self.engine = UciEngine(self.command)
+            try:
+                await self.engine.start()
+                for name, value in self.options:
+                    await self.engine.set_option(name, value)
+            except EngineError:
+                await self.close()
+                raise
+            finally:
+                self.start_seconds += time.perf_counter() - start_time
+            self.name = self.engine.name or self.name
+        await self.engine.new_game()
+
+    async def close(self):
+        engine, self.engine = self.engine, None
+        if engine is None or engine.process is None:
+            return
+        try:
+            await engine.quit()
+        except (EngineError, OSError):
+            pass
+        if engine.process.returncode is None:
+            try:
+                engine.process.kill()
+            except OSError:
+                pass
+            await engine.process.wait()
+
+
+def adjudicate(scores, settings, plies):
+    """(result, reason) from the engines' recent scores (centipawns from White's point of view,
+    one per ply, None where an engine gave none), or None"""
+    resign_plies = 2 * settings['resign_moves']
+    if settings['resign_score'] is not None and len(scores) >= resign_plies:
+        recent = scores[-resign_plies:]
+        if None not in recent:
+            if all(score >= settings['resign_score'] for score in recent):
+                return '1-0', 'resignation score'
+            if all(score <= -settings['resign_score'] for score in recent):
+                return '0-1', 'resignation score'
+    draw_plies = 2 * settings['draw_moves']
+    if settings['draw_score'] is not None and plies >= 2 * settings['draw_from_move'] and len(scores) >= draw_plies:
+        recent = scores[-draw_plies:]
+        if None not in recent and all(abs(score) <= settings['draw_score'] for score in recent):
+            return '1/2-1/2', 'draw score'
+    return None
+
+async def play_game(players, spec, settings, bitbases):
+    """Plays one game and returns its record. players[0] is the first engine."""
+    round_number, fen, first_is_white = spec
+    colour_players = (players[0], players[1]) if first_is_white else (players[1], players[0])
+    game_state = fen_to_gameboard(fen)
+    history = GameHistory(game_state)
+    moves = legal_moves(game_state)
+    base, increment = settings['time_control'] or (0.0, 0.0)
+    clocks = [base, base]  # White's and Black's seconds left
+    scores = []
+    thinking = 0.0
+    start_time = time.perf_counter()
+    outcome = error = None
+
+    for colour, player in enumerate(colour_players):
+        try:
+            await player.new_game()
+        except EngineError as engine_error:
+            outcome = ('0-1' if colour == 0 else '1-0'), 'engine crashed'
+            error = f"{player.name}: {engine_error}"
+            break
+
+    while outcome is None:
+        outcome = game_outcome(game_state, moves)
+        if outcome is not None:
+            break
+        if bitbases is not None:
+            endgame = bitbases.probe(game_state)
+            if endgame is not None:
+                white_to_move = game_state.whose_move() == 'w'
+                if endgame == 'draw':
+                    outcome = '1/2-1/2', 'bitbase'
+                else:
+                    outcome = ('1-0' if (endgame == 'win') == white_to_move else '0-1'), 'bitbase'
+                break
+        outcome = adjudicate(scores, settings, len(history) - 1)
+        if outcome is not None:
+            break
+        if settings['max_plies'] and len(history) - 1 >= settings['max_plies']:
+            outcome = '1/2-1/2', 'move limit'
+            break
+
+        side = 0 if game_state.whose_move() == 'w' else 1
+        player = colour_players[side]
+        loss = '0-1' if side == 0 else '1-0'
+        if settings['time_control']:
+            limits = {'wtime': max(int(clocks[0] * 1000), 1), 'btime': max(int(clocks[1] * 1000), 1),
+                      'winc': int(increment * 1000), 'binc': int(increment * 1000)}
+            timeout = clocks[side] + MOVE_TIMEOUT_GRACE
+        else:
+            limits = {name: settings[name] for name in ('movetime', 'depth', 'nodes') if settings[name]}
+            timeout = settings['movetime'] / 1000 + MOVE_TIMEOUT_GRACE if settings['movetime'] else HANG_TIMEOUT
+        last_score = []
+
+        def record_score(info):
+            if 'score' in info:
+                last_score[:] = [info['score']]
+
+        move_start = time.perf_counter()
+        try:
+            best_move, ponder = await asyncio.wait_for(
+                player.engine.analyse(position_command(history), record_score, **limits), timeout)
+        except asyncio.TimeoutError:
+            thinking += time.perf_counter() - move_start
+            await player.close()
+            outcome = loss, 'engine hung'
+            break
+        except EngineError as engine_error:
+            await player.close()
+            outcome = loss, 'engine crashed'
+            error = f"{player.name}: {engine_error}"
+            break
+        elapsed = time.perf_counter() - move_start
+        thinking += elapsed
+
+        if settings['time_control']:
+            clocks[side] -= elapsed
+            if clocks[side] < 0:
+                outcome = ('1/2-1/2' if only_king(game_state, BLACK if side == 0 else 0) else loss), 'time forfeit'
+                break
+            clocks[side] += increment
+        move = next((move for move in moves if move_to_uci(move) == best_move), None)
+        if move is None:
+            outcome = loss, 'illegal move'
+            error = f"{player.name} played {best_move} in {game_state.make_fen()}"
+            break
+        if last_score:
+            kind, value = last_score[0]
+            score = (MATE_CP if value > 0 else -MATE_CP) if kind == 'mate' else value
+            scores.append(score if side == 0 else -score)
+        else:
+            scores.append(None)
+        history.play(game_state, move)
+        moves = legal_moves(game_state)
+
+    result, reason = outcome
+    names = [player.name for player in colour_players]
+    return {'round': round_number, 'white': names[0], 'black': names[1], 'first_is_white': first_is_white,
+            'fen': fen, 'moves': history.moves_made, 'result': result, 'reason': reason, 'error': error,
+            'seconds': time.perf_counter() - start_time, 'thinking': thinking}
+
+async def _play_chunk(chunk, settings):
+    players = [Player(command, settings['options']) for command in settings['engines']]
+    bitbases = None
+    if settings['bitbases']:
+        from chesscore.bitbase import Bitbases
+        bitbases = Bitbases(settings['bitbases'])
+    records = []
+    try:
+        for spec in chunk:
+            records.append(await play_game(players, spec, settings, bitbases))
+    finally:
+        for player in players:
+            await player.close()
+        if bitbases is not None:
+            bitbases.close()
+    return records, sum(player.start_seconds for player in players)
+
+def play_chunk(job):
+    """Plays a chunk of games in this process. Returns (game records, worker stats)."""
+    chunk, settings = job
+    start_times = os.times()
+    start_time = time.perf_counter()
+    records, start_seconds = asyncio.run(_play_chunk(chunk, settings))
+    end_times = os.times()
+    wall = time.perf_counter() - start_time
+    thinking = sum(record['thinking'] for record in records)
+    stats = {'pid': os.getpid(), 'games': len(records), 'wall': wall, 'thinking': thinking,
+             'engine_starts': start_seconds,
+             'max_stall': max(record['seconds'] - record['thinking'] for record in records),
+             'referee_cpu': end_times.user + end_times.system - start_times.user - start_times.system,
+             'engine_cpu': end_times.children_user + end_times.children_system
+                           - start_times.children_user - start_times.children_system}
+    return records, stats
+
+
+def record_history(record):
+    """The GameHistory of a game record"""
+    game_state = fen_to_gameboard(record['fen'])
+    history = GameHistory(game_state)
+    for move_text in record['moves']:
+        history.play(game_state, next(move for move in legal_moves(game_state) if move_to_uci(move) == move_text))
+    return history
+
+def write_record(out, record, settings, json_lines):
+    if json_lines:
+        out.write(json.dumps({key: value for key, value in record.items() if key != 'thinking'}) + '\n')
+        return
+    termination = PGN_TERMINATIONS.get(record['reason'], 'adjudication')
+    tags = {'Event': settings['event'], 'Round': str(record['round']), 'White': record['white'],
+            'Black': record['black'], 'PlyCount': str(len(record['moves'])), 'Termination': termination}
+    if settings['time_control']:
+        base, increment = settings['time_control']
+        tags['TimeControl'] = f"{base:g}+{increment:g}" if increment else f"{base:g}"
+    history = record_history(record)
+    write_game(out, history, game_headers(history, record['result'], **tags))
+
+def first_engine_score(record):
+    """1, 0.5 or 0 for the first engine"""
+    if record['result'] == '1/2-1/2':
+        return 0.5
+    return 1.0 if (record['result'] == '1-0') == record['first_is_white'] else 0.0
+
+def elo_difference(scores):
+    """(Elo difference, 95% error margin) from a list of game scores, or None if it can't be told"""
+    games = len(scores)
+    mean = sum(scores) / games
+    if not 0 < mean < 1:
+        return None
+    deviation = math.sqrt(sum((score - mean) ** 2 for score in scores) / games / games)
+
+    def elo(fraction):
+        fraction = min(max(fraction, 1e-6), 1 - 1e-6)
+        return -400 * math.log10(1 / fraction - 1)
+    return elo(mean) + 0.0, (elo(mean + 1.96 * deviation) - elo(mean - 1.96 * deviation)) / 2
+
+
+def chunk_size(games, jobs):
+    """Games per chunk: GAMES_PER_CHUNK, or fewer so that each worker gets about two chunks"""
+    return max(1, min(GAMES_PER_CHUNK, math.ceil(games / (max(jobs, 1) * 2))))
+
+def run_match(settings, specs, jobs, out=None, json_lines=False, progress=None):
+    """Plays the games, writing each record to out as it is finished, and calls progress with all the
+    records so far and the new ones after each chunk. Returns (records, worker stats list)."""
+    size = chunk_size(len(specs), jobs)
+    chunks = [specs[start:start + size] for start in range(0, len(specs), size)]
+    records = []
+    worker_stats = []
+    for job, (chunk_records, stats) in map_in_order(play_chunk, ((chunk, settings) for chunk in chunks), jobs):
+        for record in chunk_records:
+            if out is not None:
+                write_record(out, record, settings, json_lines)
+        if out is not None:
+            out.flush()
+        records.extend(chunk_records)
+        worker_stats.append(stats)
+        if progress is not None:
+            progress(records, chunk_records)
+    return records, worker_stats
+
+def report_lines(records, worker_stats, wall, jobs):
+    scores = [first_engine_score(record) for record in records]
+    wins, draws = scores.count(1.0), scores.count(0.5)
+    losses = len(scores) - wins - draws
+    first = next((record['white'] if record['first_is_white'] else record['black'] for record in records), '?')
+    second = next((record['black'] if record['first_is_white'] else record['white'] for record in records), '?')
+    lines = [f"Score of {first} vs {second}: {wins} - {losses} - {draws}  [{sum(scores) / len(scores):.3f}] "
+             f"{len(scores)} games"]
+    elo = elo_difference(scores)
+    if elo is not None:
+        lines.append(f"Elo difference: {elo[0]:+.1f} +/- {elo[1]:.1f}")
+    reasons = collections.Counter(record['reason'] for record in records)
+    lines.append("Endings: " + ', '.join(f"{reason} {count}" for reason, count in reasons.most_common()))
+    cpu = sum(stats['referee_cpu'] + stats['engine_cpu'] for stats in worker_stats)
+    cores = os.cpu_count() or 1
+    lines.append(f"{len(records) / wall:.2f} games/s, {wall:.1f}s with {jobs} worker{'s' if jobs != 1 else ''}; "
+                 f"CPU {cpu:.1f}s = {100 * cpu / (wall * cores):.0f}% of {cores} core{'s' if cores != 1 else ''} "
+                 f"(referee {sum(stats['referee_cpu'] for stats in worker_stats):.1f}s)")
+    lines.append(f"{'worker':>8} {'games':>6} {'busy s':>8} {'stall s':>8} {'stall %':>8} {'starts s':>8} {'max stall':>9}")
+    by_worker = collections.defaultdict(list)
+    for stats in worker_stats:
+        by_worker[stats['pid']].append(stats)
+    for pid, chunks in sorted(by_worker.items()):
+        busy = sum(stats['wall'] for stats in chunks)
+        stall = busy - sum(stats['thinking'] for stats in chunks)
+        lines.append(f"{pid:>8} {sum(stats['games'] for stats in chunks):>6} {busy:>8.1f} {stall:>8.2f} "
+                     f"{100 * stall / busy if busy else 0:>7.1f}% {sum(stats['engine_starts'] for stats in chunks):>8.2f} "
+                     f"{max(stats['max_stall'] for stats in chunks):>9.2f}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m chesscore.match', description="Play a match between two UCI engines")
+    parser.add_argument('engines', nargs=2, metavar='ENGINE', help="an engine command line, or 'builtin'")
+    parser.add_argument('-n', '--games', type=int, help="games to play (default two per book position, or 2)")
+    parser.add_argument('--book', help="file of starting FENs, one per line")
+    limits = parser.add_mutually_exclusive_group()
+    limits.add_argument('--tc', default=DEFAULT_TIME_CONTROL, help="seconds per game + increment (default %(default)s)")
+    limits.add_argument('--movetime', type=int, help="milliseconds per move instead of a clock")
+    limits.add_argument('--depth', type=int, help="search depth per move instead of a clock")
+    limits.add_argument('--nodes', type=int, help="nodes per move instead of a clock")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('-o', '--output', help="file to write the games to, PGN or .jsonl records")
+    parser.add_argument('--event', default='Engine match')
+    parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE', help="UCI option for both engines")
+    parser.add_argument('--max-plies', type=int, default=0, help="adjudicate a draw after this many plies")
+    parser.add_argument('--resign-score', type=int, help="adjudicate a win when both engines agree by this many centipawns")
+    parser.add_argument('--resign-moves', type=int, default=3)
+    parser.add_argument('--draw-score', type=int, help="adjudicate a draw when both engines stay within this many centipawns")
+    parser.add_argument('--draw-moves', type=int, default=8)
+    parser.add_argument('--draw-from-move', type=int, default=40)
+    parser.add_argument('--bitbases', help="directory of endgame bitbases to adjudicate with")
+    args = parser.parse_args(argv)
+
+    try:
+        fens = read_book(args.book) if args.book else [STARTING_FEN]
+        time_control = None if args.movetime or args.depth or args.nodes else parse_time_control(args.tc)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    if not fens:
+        parser.error(f"no positions in {args.book}")
+    options = []
+    for option in args.option:
+        name, equals, value = option.partition('=')
+        if not equals:
+            parser.error(f"--option {option!r} isn't NAME=VALUE")
+        options.append((name, value))
+    settings = {'engines': [engine_command(engine) for engine in args.engines], 'options': options,
+                'time_control': time_control, 'movetime': args.movetime, 'depth': args.depth, 'nodes': args.nodes,
+                'max_plies': args.max_plies, 'resign_score': args.resign_score, 'resign_moves': args.resign_moves,
+                'draw_score': args.draw_score, 'draw_moves': args.draw_moves, 'draw_from_move': args.draw_from_move,
+                'bitbases': args.bitbases, 'event': args.event}
+    specs = game_specs(fens, args.games if args.games is not None else 2 * len(fens))
+    if not specs:
+        parser.error("no games to play")
+
+    def progress(records, new_records):
+        score = sum(first_engine_score(record) for record in records)
+        print(f"{len(records)}/{len(specs)} games, {score:g} - {len(records) - score:g}, "
+              f"{len(records) / (time.perf_counter() - start_time):.2f} games/s", file=sys.stderr)
+        for record in new_records:
+            if record['error']:
+                print(f"round {record['round']}: {record['error']}", file=sys.stderr)
+
+    out = None
+    if args.output:
+        out = open(args.output, 'w')
+    start_time = time.perf_counter()
+    try:
+        records, worker_stats = run_match(settings, specs, args.jobs, out,
+                                          bool(args.output) and args.output.endswith('.jsonl'), progress)
+    finally:
+        if out is not None:
+            out.close()
+    for line in report_lines(records, worker_stats, time.perf_counter() - start_time, args.jobs):
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""Pseudo-legal and legal move generation on a GameBoard, with make/unmake and perft.
+
+A move is an int: the from square in the low six bits, the to square in the next six, and
+the piece type promoted to (or 0) above that. Squares are coords_to_index indices."""
+
+from chesscore.board import *
+
+PROMOTION_PIECES = (QUEEN, ROOK, BISHOP, KNIGHT)
+KNIGHT_STEPS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+KING_STEPS = [(1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1)]
+BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, -1), (-1, 1)]
+ROOK_DIRECTIONS = [(1, 0), (0, -1), (-1, 0), (0, 1)]
+
+
+def _step_targets(steps):
+    """For every square, the squares reached by one of the steps"""
+    return [[(y + dy) * 8 + x + dx for dx, dy in steps if 0 <= x + dx < 8 and 0 <= y + dy < 8]
+            for y in range(8) for x in range(8)]
+
+def _rays(directions):
+    """For every square, the squares along each direction in order of distance, skipping empty rays"""
+    all_rays = []
+    for y in range(8):
+        for x in range(8):
+            square_rays = []
+            for dx, dy in directions:
+                ray = []
+                ray_x, ray_y = x + dx, y + dy
+                while 0 <= ray_x < 8 and 0 <= ray_y < 8:
+                    ray.append(ray_y * 8 + ray_x)
+                    ray_x, ray_y = ray_x + dx, ray_y + dy
+                if ray:
+                    square_rays.append(ray)
+            all_rays.append(square_rays)
+    return all_rays
+
+
+KNIGHT_TARGETS = _step_targets(KNIGHT_STEPS)
+KING_TARGETS = _step_targets(KING_STEPS)
+PAWN_CAPTURES = [_step_targets([(-1, 1), (1, 1)]), _step_targets([(-1, -1), (1, -1)])]  # Indexed by colour >> 3
+BISHOP_RAYS = _rays(BISHOP_DIRECTIONS)
+ROOK_RAYS = _rays(ROOK_DIRECTIONS)
+SLIDER_RAYS = {BISHOP: BISHOP_RAYS, ROOK: ROOK_RAYS,
+               QUEEN: [BISHOP_RAYS[square] + ROOK_RAYS[square] for square in range(64)]}
+CLAIMABLE_DRAWS = ('repetition', '50 move rule')  # game_outcome reasons a player has to claim
+# Castling option -> (king from, king to, rook from, rook to, squares that must be empty, squares not attacked)
+CASTLING_MOVES = {'wk': (4, 6, 7, 5, (5, 6), (4, 5)), 'wq': (4, 2, 0, 3, (1, 2, 3), (4, 3)),
+                  'bk': (60, 62, 63, 61, (61, 62), (60, 61)), 'bq': (60, 58, 56, 59, (57, 58, 59), (60, 59))}
+
+
+def encode_move(from_sq, to_sq, promotion=0):
+    return from_sq | to_sq << 6 | promotion << 12
+
+def move_from(move):
+    return move & 63
+
+def move_to(move):
+    return move >> 6 & 63
+
+def move_promotion(move):
+    return move >> 12
+
+def move_to_uci(move):
+    """Writes a move in coordinate notation, such as 'e2e4' or 'e7e8q'"""
+    uci = coords_to_square(index_to_coords(move & 63)) + coords_to_square(index_to_coords(move >> 6 & 63))
+    if move >> 12:
+        uci += CODE_TO_FEN[BLACK | move >> 12]
+    return uci
+
+def side_to_move(board):
+    return BLACK if board.flags['next_move'] == 'b' else 0
+
+
+def is_attacked(squares, square, attacker):
+    """Whether any piece of the attacking colour (0 or BLACK) attacks the square"""
+    pawn = attacker | PAWN
+    for origin in PAWN_CAPTURES[(attacker ^ BLACK) >> 3][square]:
+        if squares[origin] == pawn:
+            return True
+    knight = attacker | KNIGHT
+    for origin in KNIGHT_TARGETS[square]:
+        if squares[origin] == knight:
+            return True
+    king = attacker | KING
+    for origin in KING_TARGETS[square]:
+        if squares[origin] == king:
+            return True
+    for sliders, rays in (((attacker | BISHOP, attacker | QUEEN), BISHOP_RAYS[square]),
+                          ((attacker | ROOK, attacker | QUEEN), ROOK_RAYS[square])):
+        for ray in rays:
+            for origin in ray:
+                piece = squares[origin]
+                if piece:
+                    if piece in sliders:
+                        return True
+                    break
+    return False
+
+def is_in_check(board):
+    side = side_to_move(board)
+    king_square = board.squares.find(side | KING)
+    return king_square != -1 and is_attacked(board.squares, king_square, side ^ BLACK)
+
+
+def _add_pawn_moves(moves, from_sq, to_sq):
+    if to_sq < 8 or to_sq >= 56:
+        for promotion in PROMOTION_PIECES:
+            moves.append(from_sq | to_sq << 6 | promotion << 12)
+    else:
+        moves.append(from_sq | to_sq << 6)
+
+def pseudo_legal_moves(board):
+    """Every move that follows the piece movement rules, including ones that leave the king in check"""
+    squares = board.squares
+    side = side_to_move(board)
+    ep_target = board.flags.get('ep_target')
+    ep_square = coords_to_index(ep_target) if ep_target else -1
+    forward, start_rank = (-8, 6) if side else (8, 1)
+    moves = []
+    for from_sq in range(64):
+        piece = squares[from_sq]
+        if not piece or piece & BLACK != side:
+            continue
+        kind = piece & 7
+        if kind == PAWN:
+            to_sq = from_sq + forward
+            if 0 <= to_sq < 64 and not squares[to_sq]:
+                _add_pawn_moves(moves, from_sq, to_sq)
+                if from_sq >> 3 == start_rank and not squares[to_sq + forward]:
+                    moves.append(from_sq | (to_sq + forward) << 6)
+            for to_sq in PAWN_CAPTURES[side >> 3][from_sq]:
+                target = squares[to_sq]
+                if target:
+                    if target & BLACK != side:
+                        _add_pawn_moves(moves, from_sq, to_sq)
+                elif to_sq == ep_square:
+                    moves.append(from_sq | to_sq << 6)
+        elif kind == KNIGHT or kind == KING:
+            for to_sq in (KNIGHT_TARGETS if kind == KNIGHT else KING_TARGETS)[from_sq]:
+                target = squares[to_sq]
+                if not target or target & BLACK != side:
+                    moves.append(from_sq | to_sq << 6)
+        else:
+            for ray in SLIDER_RAYS[kind][from_sq]:
+                for to_sq in ray:
+                    target = squares[to_sq]
+                    if target:
+                        if target & BLACK != side:
+                            moves.append(from_sq | to_sq << 6)
+                        break
+                    moves.append(from_sq | to_sq << 6)
+    colour = 'b' if side else 'w'
+    for side_option in 'kq':
+        option = colour + side_option
+        if board.can_castle(option):
+            king_from, king_to, rook_from, rook_to, between, safe = CASTLING_MOVES[option]
+            if squares[king_from] == side | KING and squares[rook_from] == side | ROOK \
+                    and not any(squares[square] for square in between) \
+                    and not any(is_attacked(squares, square, side ^ BLACK) for square in safe):
+                moves.append(king_from | king_to << 6)
+    return moves
+
+def is_legal(board, move):
+    """Whether a pseudo-legal move leaves the mover's king out of check"""
+    side = side_to_move(board)
+    undo = apply_move(board, move)
+    king_square = board.squares.find(side | KING)
+    legal = king_square == -1 or not is_attacked(board.squares, king_square, side ^ BLACK)
+    undo_move(board, move, undo)
+    return legal
+
+def legal_moves(board):
+    """Every move that doesn't leave the mover's king in check"""
+    squares = board.squares
+    side = side_to_move(board)
+    if squares.find(side | KING) == -1:
+        return pseudo_legal_moves(board)
+    moves = []
+    for move in pseudo_legal_moves(board):
+        undo = apply_move(board, move)
+        if not is_attacked(squares, squares.find(side | KING), side ^ BLACK):
+            moves.append(move)
+        undo_move(board, move, undo)
+    return moves
+
+def game_outcome(board, moves=None):
+    """How the game stands: (result, reason), like ('1-0', 'checkmate') or ('1/2-1/2', 'stalemate'),
+    or None if it goes on. Draws with a reason in CLAIMABLE_DRAWS only end the game if a player
+    claims them. moves are the legal moves, if already known. repetition_ct must be up to date."""
+    if moves is None:
+        moves = legal_moves(board)
+    if not moves:
+        if is_in_check(board):
+            return ('0-1' if board.flags['next_move'] == 'w' else '1-0'), 'checkmate'
+        return '1/2-1/2', 'stalemate'
+    if board.has_insufficient_material():
+        return '1/2-1/2', 'insufficient material'
+    repetitions = board.flags.get('repetition_ct', 0)
+    halfmove_clock = board.flags['halfmove_clock']
+    if repetitions >= 5:
+        return '1/2-1/2', 'fivefold repetition'
+    if halfmove_clock >= 150:
+        return '1/2-1/2', '75 move rule'
+    if repetitions >= 3:
+        return '1/2-1/2', 'repetition'
+    if halfmove_clock >= 100:
+        return '1/2-1/2', '50 move rule'
+    return None
+
+
+def apply_move(board, move):
+    """Plays a move on the board, including the flags and zobrist key, and returns what undo_move
+    needs to take it back"""
+    squares = board.squares
+    from_sq = move & 63
+    to_sq = move >> 6 & 63
+    piece = squares[from_sq]
+    captured = squares[to_sq]
+    undo = (captured, dict(board.flags), board.zobrist_key, board.material)
+    kind = piece & 7
+    if captured or kind == PAWN:
+        board.flags['halfmove_clock'] = 0
+    else:
+        board.flags['halfmove_clock'] += 1
+    board.move_piece(from_sq, to_sq)
+    if kind == PAWN:
+        if move >> 12:
+            board.set_piece(to_sq, (piece & BLACK) | move >> 12)
+        elif not captured and (to_sq - from_sq) & 7:
+            board.set_piece(to_sq + 8 if piece & BLACK else to_sq - 8, EMPTY)  # En passant
+    elif kind == KING and abs(to_sq - from_sq) == 2:
+        if to_sq > from_sq:
+            board.move_piece(to_sq + 1, to_sq - 1)
+        else:
+            board.move_piece(to_sq - 2, to_sq + 1)
+    board.update_move_counters()
+    return undo
+
+def undo_move(board, move, undo):
+    """Takes back a move played with apply_move"""
+    squares = board.squares
+    from_sq = move & 63
+    to_sq = move >> 6 & 63
+    captured, flags, zobrist_key, material = undo
+    piece = squares[to_sq]
+    if move >> 12:
+        piece = (piece & BLACK) | PAWN
+    squares[from_sq] = piece
+    squares[to_sq] = captured
+    kind = piece & 7
+    if kind == PAWN:
+        if not captured and (to_sq - from_sq) & 7:
+            squares[to_sq + 8 if piece & BLACK else to_sq - 8] = (piece & BLACK) ^ BLACK | PAWN
+    elif kind == KING and abs(to_sq - from_sq) == 2:
+        if to_sq > from_sq:
+            squares[to_sq + 1] = squares[to_sq - 1]
+            squares[to_sq - 1] = EMPTY
+        else:
+            squares[to_sq - 2] = squares[to_sq + 1]
+            squares[to_sq + 1] = EMPTY
+    board.flags = flags
+    board.zobrist_key = zobrist_key
+    board.material = material
+
+
+def perft(board, depth):
+    """Counts the leaf nodes of the legal move tree to the given depth"""
+    moves = legal_moves(board)
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        undo = apply_move(board, move)
+        nodes += perft(board, depth - 1)
+        undo_move(board, move, undo)
+    return nodes
@@ -0,0 +1,36 @@
+"""Running a function over a long stream of work in a pool of processes"""
+
+import collections
+import concurrent.futures
+import itertools
+
+IN_FLIGHT_PER_JOB = 4  # Items submitted per process ahead of the one being waited on
+
+
+def map_in_order(function, items, jobs, in_flight_per_job=IN_FLIGHT_PER_JOB):
+    """Yields (item, function(item)) for each item, in the order of items. With jobs > 1 the calls
+    run in a pool of that many processes, and only a few items per process are read ahead, so a
+    stream too big for memory can be fed through. jobs=1 runs everything in this process."""
+    if jobs <= 1:
+        for item in items:
+            yield item, function(item)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append((item, pool.submit(function, item)))
+            if len(pending) >= jobs * in_flight_per_job:
+                oldest_item, oldest_future = pending.popleft()
+                yield oldest_item, oldest_future.result()
+        while pending:
+            oldest_item, oldest_future = pending.popleft()
+            yield oldest_item, oldest_future.result()
+
+def chunked(items, chunk_size):
+    """Lists of up to chunk_size items at a time"""
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
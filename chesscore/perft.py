@@ -0,0 +1,54 @@
+"""Perft benchmark suite: counts the move tree of standard positions against their known node
+counts and reports nodes/second.
+
+Run with "python -m chesscore.perft [max depth]" from the top of the repository."""
+
+import sys
+import time
+
+from chesscore.board import fen_to_gameboard
+from chesscore.movegen import perft
+
+# (name, FEN, node counts at depth 1, 2, 3...)
+PERFT_POSITIONS = [
+    ('start', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1', [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603]),
+    ('endgame', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238, 674624]),
+    ('promotions', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', [6, 264, 9467, 422333]),
+    ('talkchess', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', [44, 1486, 62379, 2103487]),
+    ('middlegame', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def run_suite(max_depth=3):
+    """Runs every position up to max_depth, printing a line per position. Returns whether all
+    node counts matched."""
+    all_correct = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected_counts in PERFT_POSITIONS:
+        depth = min(max_depth, len(expected_counts))
+        board = fen_to_gameboard(fen)
+        start_time = time.perf_counter()
+        nodes = perft(board, depth)
+        elapsed = time.perf_counter() - start_time
+        correct = nodes == expected_counts[depth - 1]
+        all_correct = all_correct and correct
+        total_nodes += nodes
+        total_time += elapsed
+        print(f"{name:<12} depth {depth}  {nodes:>9} nodes  {elapsed:7.2f}s  {nodes / elapsed:>9.0f} nodes/s  "
+              f"{'ok' if correct else 'EXPECTED ' + str(expected_counts[depth - 1])}")
+    print(f"{'total':<12}          {total_nodes:>9} nodes  {total_time:7.2f}s  {total_nodes / total_time:>9.0f} nodes/s")
+    return all_correct
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    max_depth = int(argv[0]) if argv else 3
+    return 0 if run_suite(max_depth) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
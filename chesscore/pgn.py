@@ -0,0 +1,180 @@
+"""Reading and writing games in PGN.
+
+read_games is a generator: it goes through the file a line at a time, through a memory map when
+it is given a path, and yields each game as soon as its last line is read, so a database of
+millions of games is never held in memory. A PgnGame only keeps the tags and the move text; the
+moves are checked and the GameHistory built when history() is called.
+
+write_game streams the SAN of a GameHistory out a line at a time."""
+
+import mmap
+import re
+import time
+
+from chesscore.board import *
+from chesscore.history import GameHistory
+from chesscore.movegen import legal_moves, apply_move
+from chesscore.san import move_to_san, parse_move, san_to_move
+
+SEVEN_TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+PGN_LINE_LENGTH = 79
+TAG_PATTERN = re.compile(rb'^\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TOKEN_PATTERN = re.compile(r'\{[^}]*\}?|;[^\n]*|\(|\)|\$\d+|\d+\.+|[^\s(){};$]+')
+
+
+class PgnError(ValueError):
+    """Raised when a game's moves can't be played out"""
+
+
+class PgnGame:
+    """One game read from a PGN file: its tags, its move text, and the byte offset it starts at"""
+    __slots__ = ('headers', 'movetext', 'offset')
+
+    def __init__(self, headers, movetext='', offset=0):
+        self.headers = headers
+        self.movetext = movetext
+        self.offset = offset
+
+    def __repr__(self):
+        return f"PgnGame({self.headers.get('White', '?')} - {self.headers.get('Black', '?')}, " \
+               f"{self.headers.get('Result', '*')})"
+
+    @property
+    def result(self):
+        return self.headers.get('Result', '*')
+
+    def starting_board(self):
+        return fen_to_gameboard(self.headers.get('FEN', STARTING_FEN))
+
+    def sans(self):
+        """The moves of the main line as they are written, leaving out comments, variations,
+        move numbers and annotations"""
+        depth = 0
+        for token in TOKEN_PATTERN.findall(self.movetext):
+            first = token[0]
+            if first == '(':
+                depth += 1
+            elif first == ')':
+                depth = max(depth - 1, 0)
+            elif depth or first in '{;$' or token[-1] == '.':
+                continue
+            elif token in RESULTS:
+                return
+            else:
+                yield token
+
+    def history(self):
+        """Plays out the moves into a new GameHistory. Raises PgnError at the first one that
+        isn't legal."""
+        game_state = self.starting_board()
+        history = GameHistory(game_state)
+        for ply, san in enumerate(self.sans()):
+            try:
+                move = san_to_move(game_state, san)
+            except ValueError as error:
+                raise PgnError(f"Move {ply // 2 + 1}{'.' if ply % 2 == 0 else '...'} {san}: {error}") from None
+            history.play(game_state, move)
+        return history
+
+
+def _lines(source):
+    """(offset, line) for every line of a binary file or memory map, starting where it is now"""
+    offset = source.tell()
+    for line in iter(source.readline, b''):
+        yield offset, line
+        offset += len(line)
+
+def _read_games_from(source, headers_only):
+    headers = {}
+    movetext = []
+    offset = None
+    in_movetext = False
+    for line_offset, line in _lines(source):
+        if line.startswith(b'['):
+            if in_movetext:
+                yield PgnGame(headers, ''.join(movetext), offset)
+                headers, movetext, offset, in_movetext = {}, [], None, False
+            if offset is None:
+                offset = line_offset
+            match = TAG_PATTERN.match(line)
+            if match:
+                value = match.group(2).decode('utf-8', 'replace')
+                headers[match.group(1).decode('ascii')] = value.replace('\\"', '"').replace('\\\\', '\\')
+        elif line.strip() and not line.startswith(b'%'):
+            if offset is None:
+                offset = line_offset
+            in_movetext = True
+            if not headers_only:
+                movetext.append(line.decode('utf-8', 'replace'))
+    if offset is not None:
+        yield PgnGame(headers, ''.join(movetext), offset)
+
+def read_games(source, headers_only=False):
+    """Yields every game in a PGN file as a PgnGame. source is a path, or a binary file that is
+    read from its current position. headers_only skips keeping the move text, for scanning."""
+    if not isinstance(source, (str, bytes)) and not hasattr(source, '__fspath__'):
+        yield from _read_games_from(source, headers_only)
+        return
+    with open(source, 'rb') as pgn_file:
+        try:
+            mapped = mmap.mmap(pgn_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):  # Empty files and pipes can't be mapped
+            yield from _read_games_from(pgn_file, headers_only)
+            return
+        with mapped:
+            yield from _read_games_from(mapped, headers_only)
+
+def read_game_at(path, offset):
+    """The game starting at a byte offset found by read_games, or None past the last game"""
+    with open(path, 'rb') as pgn_file:
+        pgn_file.seek(offset)
+        return next(_read_games_from(pgn_file, False), None)
+
+
+def history_sans(history):
+    """The SAN of each move in a GameHistory, replayed from its starting position"""
+    game_state = fen_to_gameboard(history.starting_fen)
+    for move_text in history.moves_made:
+        moves = legal_moves(game_state)
+        move = parse_move(game_state, move_text, moves)
+        yield move_to_san(game_state, move, moves)
+        apply_move(game_state, move)
+
+def game_headers(history, result='*', **tags):
+    """The tags for saving a game: the seven tag roster, then SetUp and FEN if the game didn't
+    start from the usual position, then anything passed in"""
+    headers = {'Event': '?', 'Site': '?', 'Date': time.strftime('%Y.%m.%d'), 'Round': '?',
+               'White': '?', 'Black': '?', 'Result': result}
+    if history.starting_fen != STARTING_FEN:
+        headers['SetUp'] = '1'
+        headers['FEN'] = history.starting_fen
+    headers.update(tags)
+    return headers
+
+def write_game(out, history, headers=None, result='*'):
+    """Writes a GameHistory as PGN to a text file, wrapping the move text at PGN_LINE_LENGTH"""
+    headers = game_headers(history, result) if headers is None else headers
+    result = headers.get('Result', result)
+    for tag, value in headers.items():
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        out.write(f'[{tag} "{escaped}"]\n')
+    out.write('\n')
+    starting_board = fen_to_gameboard(history.starting_fen)
+    move_number = starting_board.flags['move_number']
+    white_to_move = starting_board.whose_move() == 'w'
+    line = '' if white_to_move else f"{move_number}..."
+    for san in history_sans(history):
+        token = f"{move_number}. {san}" if white_to_move else san
+        if not white_to_move:
+            move_number += 1
+        white_to_move = not white_to_move
+        if line and len(line) + 1 + len(token) > PGN_LINE_LENGTH:
+            out.write(line + '\n')
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    if line and len(line) + 1 + len(result) > PGN_LINE_LENGTH:
+        out.write(line + '\n')
+        line = ''
+    out.write(f"{line} {result}\n\n" if line else f"{result}\n\n")
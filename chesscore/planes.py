@@ -0,0 +1,227 @@
+"""Encoding positions as NumPy planes, in batches, for exporting to training and statistics jobs.
+
+Each position becomes a PLANE_COUNT x 8 x 8 array of uint8, indexed [plane, rank, file] with
+rank 0 being the first rank:
+  0-11  one plane per piece, in the order of PIECE_PLANE_ORDER, with 1 where that piece stands
+  12    all 1s if White is to move
+  13-16 all 1s if White can castle kingside, White queenside, Black kingside, Black queenside
+  17    1 on the en passant square, if there is one
+
+encode_fens works on the whole batch at once: the piece placements are expanded with a string
+translation, joined into one buffer and mapped to planes with NumPy indexing, rather than being
+read into GameBoards square by square.
+
+"python -m chesscore.planes -o DIR [files...]" writes FENs (one per line, or standard input) to
+shards of up to SHARD_SIZE positions, as .npy files that can be opened memory-mapped with
+load_shard, or as compressed .npz files. Lines that fen_to_gameboard couldn't read are left out
+and counted, as fenbatch does, and --show-errors lists them by line number."""
+
+import argparse
+import collections
+import os
+import sys
+import time
+
+import numpy as np
+
+from chesscore.board import EXPAND_FEN_DIGITS, FenError, PIECE_TO_CODE, check_fen_fields
+from chesscore.fenbatch import read_numbered_lines
+from chesscore.parallel import chunked, map_in_order
+
+PIECE_PLANE_ORDER = 'PNBRQKpnbrqk'
+SIDE_TO_MOVE_PLANE = 12
+CASTLING_PLANES = (('K', 13), ('Q', 14), ('k', 15), ('q', 16))
+EN_PASSANT_PLANE = 17
+PLANE_COUNT = 18
+SHARD_SIZE = 100000  # Positions per shard file
+ENCODE_BATCH = 8192  # Positions encoded at a time while filling a memory-mapped shard
+
+EMPTY_PLANE = PLANE_COUNT  # Marks an empty square in the plane index arrays
+INVALID_PLANE = 255
+_FEN_BYTE_PLANES = np.full(256, INVALID_PLANE, dtype=np.uint8)  # FEN character -> piece plane
+_FEN_BYTE_PLANES[ord('1')] = EMPTY_PLANE
+_CODE_PLANES = np.full(16, EMPTY_PLANE, dtype=np.uint8)  # Board piece code -> piece plane
+for _plane, _fen_char in enumerate(PIECE_PLANE_ORDER):
+    _FEN_BYTE_PLANES[ord(_fen_char)] = _plane
+    _CODE_PLANES[PIECE_TO_CODE[('w' if _fen_char.isupper() else 'b') + _fen_char.upper()]] = _plane
+_SQUARE_COLUMNS = np.array([column for column in range(71) if column % 9 != 8])  # Leaves out the '/'s
+_SLASH_COLUMNS = np.arange(8, 71, 9)
+
+
+def _piece_planes(plane_indices):
+    """Planes for an (N, 64) array of piece plane indices, in coords_to_index order"""
+    count = len(plane_indices)
+    planes = np.zeros((count, PLANE_COUNT, 64), dtype=np.uint8)
+    positions, squares = np.nonzero(plane_indices < EMPTY_PLANE)
+    planes[positions, plane_indices[positions, squares], squares] = 1
+    return planes.reshape(count, PLANE_COUNT, 8, 8)
+
+def _fixed_width_field(fields, field, width):
+    """One field of every FEN, cut or padded with '-' to width characters, as an (N, width) array"""
+    joined = ''.join(fen_fields[field][:width].ljust(width, '-') for fen_fields in fields)
+    return np.frombuffer(joined.encode('ascii', 'replace'), dtype=np.uint8).reshape(len(fields), width)
+
+def _read_fens(fens):
+    """The fields of each FEN, an (N, 64) array of piece plane indices, and (index, FenError) for
+    each FEN fen_to_gameboard would reject, in order. The placements are checked all at once, then
+    the other fields one FEN at a time with check_fen_fields."""
+    count = len(fens)
+    fields = [fen.split() for fen in fens]
+    problems = {}
+    for index, fen_fields in enumerate(fields):
+        if len(fen_fields) not in (4, 6):
+            problems[index] = FenError('fields', f"expected 6 fields, found {len(fen_fields)}")
+
+    expanded = [fen_fields[0].translate(EXPAND_FEN_DIGITS) if fen_fields else '' for fen_fields in fields]
+    lengths = np.fromiter(map(len, expanded), dtype=np.int64, count=count)
+    for index in np.flatnonzero(lengths != 71):
+        problems.setdefault(int(index), FenError('placement', "ranks don't add up to 8 x 8 squares"))
+    expanded = [placement if len(placement) == 71 else '1' * 71 for placement in expanded]
+    characters = np.frombuffer(''.join(expanded).encode('ascii', 'replace'), dtype=np.uint8).reshape(count, 71)
+    for index in np.flatnonzero((characters[:, _SLASH_COLUMNS] != ord('/')).any(axis=1)):
+        problems.setdefault(int(index), FenError('placement', "ranks don't add up to 8 squares each"))
+    # FEN lists the eighth rank first, the planes start from the first
+    squares = characters[:, _SQUARE_COLUMNS].reshape(count, 8, 8)[:, ::-1, :].reshape(count, 64)
+    plane_indices = _FEN_BYTE_PLANES[squares]
+    for index in np.flatnonzero((plane_indices == INVALID_PLANE).any(axis=1)):
+        problems.setdefault(int(index), FenError('placement', "unexpected character"))
+
+    for index, fen_fields in enumerate(fields):
+        if index not in problems:
+            try:
+                check_fen_fields(fen_fields)
+            except FenError as error:
+                problems[index] = error
+    return fields, plane_indices, sorted(problems.items())
+
+def fen_problems(fens):
+    """(index, FenError) for each FEN of a sequence that can't be encoded, which are the ones
+    fen_to_gameboard can't read"""
+    return _read_fens(fens)[2]
+
+def encode_fens(fens):
+    """An (N, PLANE_COUNT, 8, 8) uint8 array for a sequence of FEN strings. Raises FenError
+    naming the first FEN that can't be read."""
+    if len(fens) == 0:
+        return np.zeros((0, PLANE_COUNT, 8, 8), dtype=np.uint8)
+    fields, plane_indices, problems = _read_fens(fens)
+    if problems:
+        index, error = problems[0]
+        raise FenError(error.kind, f"FEN {index}: {error.message}")
+    planes = _piece_planes(plane_indices)
+
+    sides = _fixed_width_field(fields, 1, 1)[:, 0]
+    planes[:, SIDE_TO_MOVE_PLANE] = (sides == ord('w'))[:, None, None]
+
+    castling = _fixed_width_field(fields, 2, 4)
+    for castling_char, plane in CASTLING_PLANES:
+        planes[:, plane] = (castling == ord(castling_char)).any(axis=1)[:, None, None]
+
+    en_passant = _fixed_width_field(fields, 3, 2)
+    positions = np.flatnonzero(en_passant[:, 0] != ord('-'))
+    files = en_passant[positions, 0].astype(np.int64) - ord('a')
+    ranks = en_passant[positions, 1].astype(np.int64) - ord('1')
+    planes[positions, EN_PASSANT_PLANE, ranks, files] = 1
+    return planes
+
+def encode_boards(boards):
+    """An (N, PLANE_COUNT, 8, 8) uint8 array for a sequence of GameBoards"""
+    count = len(boards)
+    if count == 0:
+        return np.zeros((0, PLANE_COUNT, 8, 8), dtype=np.uint8)
+    squares = np.frombuffer(b''.join(board.squares for board in boards), dtype=np.uint8).reshape(count, 64)
+    planes = _piece_planes(_CODE_PLANES[squares])
+    planes[:, SIDE_TO_MOVE_PLANE] = np.fromiter((board.flags['next_move'] == 'w' for board in boards),
+                                                dtype=bool, count=count)[:, None, None]
+    for castling_char, plane in CASTLING_PLANES:
+        option = ('w' if castling_char.isupper() else 'b') + castling_char.lower()
+        planes[:, plane] = np.fromiter((bool(board.can_castle(option)) for board in boards),
+                                       dtype=bool, count=count)[:, None, None]
+    for position, board in enumerate(boards):
+        ep_target = board.flags.get('ep_target')
+        if ep_target:
+            planes[position, EN_PASSANT_PLANE, ep_target[1], ep_target[0]] = 1
+    return planes
+
+
+def write_shard(path, fens, shard_format='npy'):
+    """Encodes FENs into one shard file. An .npy shard is filled through a memory map a batch at a
+    time; an .npz shard is encoded whole and compressed. Either is written under a temporary name
+    and renamed when complete, so a failure never leaves part of a shard behind. Returns the
+    number of positions."""
+    root, extension = os.path.splitext(path)
+    temporary_path = root + '.tmp' + extension
+    try:
+        if shard_format == 'npz':
+            np.savez_compressed(temporary_path, planes=encode_fens(fens))
+        else:
+            shard = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=np.uint8,
+                                              shape=(len(fens), PLANE_COUNT, 8, 8))
+            for start in range(0, len(fens), ENCODE_BATCH):
+                shard[start:start + ENCODE_BATCH] = encode_fens(fens[start:start + ENCODE_BATCH])
+            shard.flush()
+            del shard
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    os.replace(temporary_path, path)
+    return len(fens)
+
+def export_shard(job):
+    """Writes the FENs of a chunk of (line number, line) pairs that can be read to a shard, leaving
+    out the rest. Returns the number written and (line number, error kind, message) for each line
+    left out. A chunk with no good lines writes no shard."""
+    path, numbered_lines, shard_format = job
+    fens = []
+    problems = []
+    for start in range(0, len(numbered_lines), ENCODE_BATCH):
+        batch = numbered_lines[start:start + ENCODE_BATCH]
+        bad = dict(fen_problems([line for number, line in batch]))
+        for index, (number, line) in enumerate(batch):
+            if index in bad:
+                problems.append((number, bad[index].kind, f"{bad[index]}: {line}"))
+            else:
+                fens.append(line)
+    return (write_shard(path, fens, shard_format) if fens else 0), problems
+
+def load_shard(path):
+    """The planes in a shard. .npy shards are memory-mapped rather than read in."""
+    if path.endswith('.npz'):
+        with np.load(path) as shard:
+            return shard['planes']
+    return np.load(path, mmap_mode='r')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m chesscore.planes', description="Export FENs as NumPy plane shards")
+    parser.add_argument('files', nargs='*', help="FEN files, one position per line (default: standard input)")
+    parser.add_argument('-o', '--output', required=True, help="directory to write the shards to")
+    parser.add_argument('--format', choices=('npy', 'npz'), default='npy')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="shards written at once")
+    parser.add_argument('--show-errors', action='store_true', help="write each rejected line to standard error")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    jobs = ((os.path.join(args.output, f"shard-{number:05d}.{args.format}"), numbered_lines, args.format)
+            for number, numbered_lines in enumerate(chunked(read_numbered_lines(args.files), args.shard_size)))
+    start_time = time.perf_counter()
+    error_counts = collections.Counter()
+    total = shards = 0
+    for job, (written, problems) in map_in_order(export_shard, jobs, args.jobs, in_flight_per_job=2):
+        total += written
+        shards += written > 0
+        for number, kind, message in problems:
+            error_counts[kind] += 1
+            if args.show_errors:
+                print(f"line {number}: {message}", file=sys.stderr)
+    elapsed = time.perf_counter() - start_time
+    print(f"{total} positions in {shards} shards, {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} positions/s), "
+          f"{sum(error_counts.values())} rejected", file=sys.stderr)
+    for kind, count in error_counts.most_common():
+        print(f"  {kind:<14} {count}", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""Standard algebraic notation (SAN) for movegen moves, such as 'Nbd7', 'exd5', 'e8=Q+' and 'O-O'"""
+
+import re
+
+from chesscore.board import *
+from chesscore.movegen import CASTLING_MOVES, apply_move, undo_move, legal_moves, pseudo_legal_moves, is_legal, \
+    is_in_check, encode_move, move_from, move_to, move_promotion, move_to_uci
+
+PIECE_LETTERS = {KNIGHT: 'N', BISHOP: 'B', ROOK: 'R', QUEEN: 'Q', KING: 'K'}
+LETTER_PIECES = {letter: kind for kind, letter in PIECE_LETTERS.items()}
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+UCI_PATTERN = re.compile(r'^[a-h][1-8][a-h][1-8][nbrq]?$')
+
+
+def square_name(index):
+    return coords_to_square(index_to_coords(index))
+
+def move_to_san(board, move, moves=None):
+    """Writes a legal move in SAN. moves can be passed in when the legal moves are already known."""
+    moves = legal_moves(board) if moves is None else moves
+    squares = board.squares
+    from_sq = move_from(move)
+    to_sq = move_to(move)
+    kind = squares[from_sq] & 7
+    if kind == KING and abs(to_sq - from_sq) == 2:
+        san = 'O-O' if to_sq > from_sq else 'O-O-O'
+    else:
+        capture = bool(squares[to_sq]) or (kind == PAWN and (to_sq - from_sq) & 7 != 0)
+        if kind == PAWN:
+            san = (square_name(from_sq)[0] + 'x' if capture else '') + square_name(to_sq)
+            if move_promotion(move):
+                san += '=' + PIECE_LETTERS[move_promotion(move)]
+        else:
+            rivals = [other for other in moves if move_to(other) == to_sq and other != move
+                      and squares[move_from(other)] & 7 == kind]
+            disambiguation = ''
+            if rivals:
+                from_name = square_name(from_sq)
+                if all(move_from(other) & 7 != from_sq & 7 for other in rivals):
+                    disambiguation = from_name[0]
+                elif all(move_from(other) >> 3 != from_sq >> 3 for other in rivals):
+                    disambiguation = from_name[1]
+                else:
+                    disambiguation = from_name
+            san = PIECE_LETTERS[kind] + disambiguation + ('x' if capture else '') + square_name(to_sq)
+    undo = apply_move(board, move)
+    if is_in_check(board):
+        san += '#' if not legal_moves(board) else '+'
+    undo_move(board, move, undo)
+    return san
+
+def san_to_move(board, san, moves=None):
+    """Finds the legal move a SAN string describes. Raises ValueError if there isn't exactly one.
+    Without the legal moves passed in, only the pseudo-legal moves matching the SAN are checked
+    for legality, which is much quicker than generating every legal move."""
+    check_legality = moves is None
+    moves = pseudo_legal_moves(board) if moves is None else moves
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        option = ('b' if board.whose_move() == 'b' else 'w') + ('k' if len(text) == 3 else 'q')
+        king_from, king_to = CASTLING_MOVES[option][:2]
+        castling_move = encode_move(king_from, king_to)
+        if castling_move in moves and (not check_legality or is_legal(board, castling_move)):
+            return castling_move
+        raise ValueError(f"Illegal move {san}")
+    match = SAN_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"Can't read move {san}")
+    piece_letter, from_file, from_rank, destination, promotion_letter = match.groups()
+    kind = LETTER_PIECES[piece_letter] if piece_letter else PAWN
+    to_sq = coords_to_index(square_to_coords(destination))
+    promotion = LETTER_PIECES[promotion_letter] if promotion_letter else 0
+    squares = board.squares
+    candidates = []
+    for move in moves:
+        from_sq = move_from(move)
+        if move_to(move) != to_sq or squares[from_sq] & 7 != kind or move_promotion(move) != promotion:
+            continue
+        if from_file and FILES.index(from_file) != from_sq & 7:
+            continue
+        if from_rank and RANKS.index(from_rank) != from_sq >> 3:
+            continue
+        if check_legality and not is_legal(board, move):
+            continue
+        candidates.append(move)
+    if len(candidates) != 1:
+        raise ValueError(f"{'Ambiguous' if candidates else 'Illegal'} move {san}")
+    return candidates[0]
+
+def parse_move(board, text, moves=None):
+    """Reads a move in either coordinate notation (as stored in GameHistory.moves_made) or SAN"""
+    moves = legal_moves(board) if moves is None else moves
+    if UCI_PATTERN.match(text):
+        for move in moves:
+            if move_to_uci(move) == text:
+                return move
+        raise ValueError(f"Illegal move {text}")
+    return san_to_move(board, text, moves)
+
+def variation_text(board, move_texts, max_moves=None):
+    """Writes a line of moves from the position on board as numbered SAN, like '12... e5 13. Nf3'.
+    Stops at the first move that isn't legal. The board is left as it was."""
+    game_state = board.copy()
+    move_number = game_state.flags['move_number']
+    words = []
+    for move_text in move_texts[:max_moves]:
+        moves = legal_moves(game_state)
+        try:
+            move = parse_move(game_state, move_text, moves)
+        except ValueError:
+            break
+        if game_state.whose_move() == 'w':
+            words.append(f"{move_number}.")
+        elif not words:
+            words.append(f"{move_number}...")
+        words.append(move_to_san(game_state, move, moves))
+        if game_state.whose_move() == 'b':
+            move_number += 1
+        apply_move(game_state, move)
+    return ' '.join(words)
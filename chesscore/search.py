@@ -0,0 +1,473 @@
+"""The built-in engine: iterative deepening alpha-beta search on a GameBoard.
+
+The search uses principal variation search with a transposition table keyed by zobrist key,
+orders moves by the table's move, then MVV-LVA for captures, then killer moves and the history
+heuristic, and finishes every line with a quiescence search of captures. It stops at a depth,
+node or time limit, or when a threading.Event is set, and reports each finished depth through
+on_info in the same form as chesscore.uci.parse_info.
+
+"python -m chesscore.search" runs the engine as a UCI engine on standard input and output, which
+is how the GUI uses it, in a process of its own. "python -m chesscore.search bench [depth]"
+searches a fixed set of positions and reports time to each depth and nodes/second."""
+
+import sys
+import threading
+import time
+
+from chesscore.board import *
+from chesscore.movegen import apply_move, undo_move, pseudo_legal_moves, legal_moves, is_attacked, \
+    is_in_check, side_to_move, move_to_uci
+from chesscore.san import parse_move
+
+ENGINE_NAME = 'M Chess'
+MAX_DEPTH = 64
+MAX_PLY = 128
+INFINITY = 1000000
+MATE_SCORE = 100000
+MATE_BOUND = MATE_SCORE - MAX_PLY  # Scores beyond this are mates
+TT_EXACT, TT_LOWER, TT_UPPER = range(3)
+DEFAULT_TT_ENTRIES = 1 << 20  # The table is cleared when it grows past this
+LIMIT_CHECK_NODES = 1023  # Node count mask for checking the clock and the stop event
+BENCH_DEPTH = 4
+
+PIECE_VALUES = [0, 100, 320, 330, 500, 900, 20000]  # Indexed by piece type
+# Piece-square tables from White's side, a1 first, as in coords_to_index
+PAWN_TABLE = [0, 0, 0, 0, 0, 0, 0, 0,
+              5, 10, 10, -20, -20, 10, 10, 5,
+              5, -5, -10, 0, 0, -10, -5, 5,
+              0, 0, 0, 20, 20, 0, 0, 0,
+              5, 5, 10, 25, 25, 10, 5, 5,
+              10, 10, 20, 30, 30, 20, 10, 10,
+              50, 50, 50, 50, 50, 50, 50, 50,
+              0, 0, 0, 0, 0, 0, 0, 0]
+KNIGHT_TABLE = [-50, -40, -30, -30, -30, -30, -40, -50,
+                -40, -20, 0, 5, 5, 0, -20, -40,
+                -30, 5, 10, 15, 15, 10, 5, -30,
+                -30, 0, 15, 20, 20, 15, 0, -30,
+                -30, 5, 15, 20, 20, 15, 5, -30,
+                -30, 0, 10, 15, 15, 10, 0, -30,
+                -40, -20, 0, 0, 0, 0, -20, -40,
+                -50, -40, -30, -30, -30, -30, -40, -50]
+BISHOP_TABLE = [-20, -10, -10, -10, -10, -10, -10, -20,
+                -10, 5, 0, 0, 0, 0, 5, -10,
+                -10, 10, 10, 10, 10, 10, 10, -10,
+                -10, 0, 10, 10, 10, 10, 0, -10,
+                -10, 5, 5, 10, 10, 5, 5, -10,
+                -10, 0, 5, 10, 10, 5, 0, -10,
+                -10, 0, 0, 0, 0, 0, 0, -10,
+                -20, -10, -10, -10, -10, -10, -10, -20]
+ROOK_TABLE = [0, 0, 0, 5, 5, 0, 0, 0,
+              -5, 0, 0, 0, 0, 0, 0, -5,
+              -5, 0, 0, 0, 0, 0, 0, -5,
+              -5, 0, 0, 0, 0, 0, 0, -5,
+              -5, 0, 0, 0, 0, 0, 0, -5,
+              -5, 0, 0, 0, 0, 0, 0, -5,
+              5, 10, 10, 10, 10, 10, 10, 5,
+              0, 0, 0, 0, 0, 0, 0, 0]
+QUEEN_TABLE = [-20, -10, -10, -5, -5, -10, -10, -20,
+               -10, 0, 5, 0, 0, 0, 0, -10,
+               -10, 5, 5, 5, 5, 5, 0, -10,
+               0, 0, 5, 5, 5, 5, 0, -5,
+               -5, 0, 5, 5, 5, 5, 0, -5,
+               -10, 0, 5, 5, 5, 5, 0, -10,
+               -10, 0, 0, 0, 0, 0, 0, -10,
+               -20, -10, -10, -5, -5, -10, -10, -20]
+KING_TABLE = [20, 30, 10, 0, 0, 10, 30, 20,
+              20, 20, 0, 0, 0, 0, 20, 20,
+              -10, -20, -20, -20, -20, -20, -20, -10,
+              -20, -30, -30, -40, -40, -30, -30, -20,
+              -30, -40, -40, -50, -50, -40, -40, -30,
+              -30, -40, -40, -50, -50, -40, -40, -30,
+              -30, -40, -40, -50, -50, -40, -40, -30,
+              -30, -40, -40, -50, -50, -40, -40, -30]
+KING_ENDGAME_TABLE = [-50, -30, -30, -30, -30, -30, -30, -50,
+                      -30, -30, 0, 0, 0, 0, -30, -30,
+                      -30, -10, 20, 30, 30, 20, -10, -30,
+                      -30, -10, 30, 40, 40, 30, -10, -30,
+                      -30, -10, 30, 40, 40, 30, -10, -30,
+                      -30, -10, 20, 30, 30, 20, -10, -30,
+                      -30, -20, -10, 0, 0, -10, -20, -30,
+                      -50, -40, -30, -20, -20, -30, -40, -50]
+PIECE_TABLES = {PAWN: PAWN_TABLE, KNIGHT: KNIGHT_TABLE, BISHOP: BISHOP_TABLE, ROOK: ROOK_TABLE,
+                QUEEN: QUEEN_TABLE, KING: KING_TABLE}
+ENDGAME_MATERIAL = 1300  # Non-pawn material per side below which the king heads for the centre
+
+
+def _signed_tables(king_table):
+    """Piece code -> value of that piece on each square from White's side, material included"""
+    tables = [[0] * 64 for piece_code in range(16)]
+    for kind, table in PIECE_TABLES.items():
+        if kind == KING:
+            table = king_table
+        for square in range(64):
+            tables[kind][square] = PIECE_VALUES[kind] + table[square]
+            tables[BLACK | kind][square] = -(PIECE_VALUES[kind] + table[square ^ 56])
+    return tables
+
+SQUARE_VALUES = _signed_tables(KING_TABLE)
+ENDGAME_KING_VALUES = _signed_tables(KING_ENDGAME_TABLE)
+
+
+def evaluate(board):
+    """Material and piece placement, in centipawns for the side to move"""
+    squares = board.squares
+    score = 0
+    non_pawn_material = 0
+    for square, piece in enumerate(squares):
+        if piece:
+            score += SQUARE_VALUES[piece][square]
+            kind = piece & 7
+            if kind != PAWN and kind != KING:
+                non_pawn_material += PIECE_VALUES[kind]
+    if non_pawn_material < 2 * ENDGAME_MATERIAL:
+        for king in (KING, BLACK | KING):
+            square = squares.find(king)
+            if square != -1:
+                score += ENDGAME_KING_VALUES[king][square] - SQUARE_VALUES[king][square]
+    return -score if board.flags['next_move'] == 'b' else score
+
+def uci_score(score):
+    """A search score as ('cp', n) or ('mate', moves)"""
+    if score > MATE_BOUND:
+        return ('mate', (MATE_SCORE - score + 1) // 2)
+    if score < -MATE_BOUND:
+        return ('mate', -((MATE_SCORE + score + 1) // 2))
+    return ('cp', score)
+
+
+class SearchStopped(Exception):
+    """Raised inside the search when a limit is reached or it is told to stop"""
+
+
+class Searcher:
+    """Searches positions, keeping its transposition table, killers and history between searches
+    of the same game"""
+    def __init__(self, tt_entries=DEFAULT_TT_ENTRIES):
+        self.tt = {}  # Zobrist key -> (depth, score, bound, best move)
+        self.tt_entries = tt_entries
+        self.history = [0] * 4096  # Indexed by from and to square, move & 4095
+        self.killers = [[0, 0] for ply in range(MAX_PLY)]
+        self.pv = [[] for ply in range(MAX_PLY + 1)]
+        self.nodes = 0
+
+    def clear(self):
+        self.tt.clear()
+        self.history = [0] * 4096
+        self.killers = [[0, 0] for ply in range(MAX_PLY)]
+
+    def search(self, board, depth=None, nodes=None, movetime=None, stop_event=None, on_info=None, game_keys=()):
+        """Returns (best move, score) for the position. depth, nodes and movetime (seconds) limit
+        the search; with none of them it doesn't return until stop_event is set, even once it is
+        done, as UCI wants for 'go infinite'. game_keys are the zobrist keys of the positions
+        before this one in the game, for spotting repetitions. on_info gets a dict with depth,
+        score, nodes, nps, time and pv after each depth."""
+        self.board = board.copy()
+        self.path_keys = list(game_keys)
+        self.nodes = 0
+        self.node_limit = nodes
+        self.stop_event = stop_event
+        self.start_time = time.perf_counter()
+        self.deadline = self.start_time + movetime if movetime else None
+        self.killers = [[0, 0] for ply in range(MAX_PLY)]
+        self.history = [value // 8 for value in self.history]
+        if len(self.tt) > self.tt_entries:
+            self.tt.clear()
+
+        unlimited = depth is None and nodes is None and not movetime and stop_event is not None
+        root_moves = legal_moves(self.board)
+        if not root_moves:
+            if unlimited:
+                stop_event.wait()
+            return None, (-MATE_SCORE if is_in_check(self.board) else 0)
+        best_move, best_score = root_moves[0], 0
+        for current_depth in range(1, min(depth or MAX_DEPTH, MAX_DEPTH) + 1):
+            try:
+                score = self.negamax(current_depth, -INFINITY, INFINITY, 0)
+            except SearchStopped:
+                break
+            if self.pv[0]:
+                best_move, best_score = self.pv[0][0], score
+            elapsed = time.perf_counter() - self.start_time
+            if on_info is not None:
+                on_info({'depth': current_depth, 'score': uci_score(score), 'nodes': self.nodes,
+                         'nps': int(self.nodes / elapsed) if elapsed else 0, 'time': int(elapsed * 1000),
+                         'pv': [move_to_uci(move) for move in self.pv[0]]})
+            if abs(score) > MATE_BOUND and current_depth >= MATE_SCORE - abs(score):
+                break  # A forced mate has been seen to its end
+            if self.deadline is not None and time.perf_counter() > self.start_time + (self.deadline - self.start_time) / 2:
+                break  # Another depth wouldn't finish in time
+        if unlimited:
+            stop_event.wait()
+        return best_move, best_score
+
+    def check_limits(self):
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchStopped
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchStopped
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchStopped
+
+    def order_moves(self, moves, tt_move, ply):
+        squares = self.board.squares
+        killers = self.killers[ply]
+        history = self.history
+        scored = []
+        for move in moves:
+            if move == tt_move:
+                order = 10000000
+            else:
+                captured = squares[move >> 6 & 63]
+                if captured:
+                    order = 1000000 + 10 * (captured & 7) - (squares[move & 63] & 7)  # MVV-LVA
+                elif move >> 12:
+                    order = 900000 + (move >> 12)
+                elif move == killers[0] or move == killers[1]:
+                    order = 800000
+                else:
+                    order = history[move & 4095]
+            scored.append((order, move))
+        scored.sort(reverse=True)
+        return [move for order, move in scored]
+
+    def negamax(self, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & LIMIT_CHECK_NODES == 0:
+            self.check_limits()
+        self.pv[ply] = []
+        board = self.board
+        key = board.zobrist_key
+        if ply:
+            halfmove_clock = board.flags['halfmove_clock']
+            if halfmove_clock >= 100 or key in self.path_keys[max(0, len(self.path_keys) - halfmove_clock):]:
+                return 0
+        in_check = is_in_check(board)
+        if in_check:
+            depth += 1
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self.quiesce(alpha, beta, ply)
+
+        tt_move = 0
+        entry = self.tt.get(key)
+        if entry is not None:
+            tt_depth, tt_score, tt_bound, tt_move = entry
+            if ply and tt_depth >= depth and beta - alpha == 1:  # Not in PV nodes, so the PV stays whole
+                if tt_score > MATE_BOUND:
+                    tt_score -= ply
+                elif tt_score < -MATE_BOUND:
+                    tt_score += ply
+                if tt_bound == TT_EXACT or (tt_bound == TT_LOWER and tt_score >= beta) \
+                        or (tt_bound == TT_UPPER and tt_score <= alpha):
+                    return tt_score
+
+        side = side_to_move(board)
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        legal_count = 0
+        self.path_keys.append(key)
+        for move in self.order_moves(pseudo_legal_moves(board), tt_move, ply):
+            quiet = not board.squares[move >> 6 & 63] and not move >> 12
+            undo = apply_move(board, move)
+            king_square = board.squares.find(side | KING)
+            if king_square != -1 and is_attacked(board.squares, king_square, side ^ BLACK):
+                undo_move(board, move, undo)
+                continue
+            legal_count += 1
+            if legal_count == 1:
+                score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            else:
+                score = -self.negamax(depth - 1, -alpha - 1, -alpha, ply + 1)
+                if alpha < score < beta:
+                    score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            undo_move(board, move, undo)
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if alpha >= beta:
+                        if quiet:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[move & 4095] = min(self.history[move & 4095] + depth * depth, 700000)
+                        break
+        self.path_keys.pop()
+
+        if legal_count == 0:
+            return -MATE_SCORE + ply if in_check else 0
+        bound = TT_LOWER if best_score >= beta else TT_EXACT if best_score > original_alpha else TT_UPPER
+        stored_score = best_score
+        if stored_score > MATE_BOUND:
+            stored_score += ply
+        elif stored_score < -MATE_BOUND:
+            stored_score -= ply
+        self.tt[key] = (depth, stored_score, bound, best_move)
+        return best_score
+
+    def quiesce(self, alpha, beta, ply):
+        """Searches captures and promotions only, until the position is quiet"""
+        self.nodes += 1
+        if self.nodes & LIMIT_CHECK_NODES == 0:
+            self.check_limits()
+        self.pv[ply] = []
+        board = self.board
+        stand_pat = evaluate(board)
+        if stand_pat >= beta or ply >= MAX_PLY - 1:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        squares = board.squares
+        side = side_to_move(board)
+        captures = [move for move in pseudo_legal_moves(board) if squares[move >> 6 & 63] or move >> 12]
+        for move in self.order_moves(captures, 0, ply):
+            undo = apply_move(board, move)
+            king_square = squares.find(side | KING)
+            if king_square != -1 and is_attacked(squares, king_square, side ^ BLACK):
+                undo_move(board, move, undo)
+                continue
+            score = -self.quiesce(-beta, -alpha, ply + 1)
+            undo_move(board, move, undo)
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+        return alpha
+
+
+def parse_position(words):
+    """The board and earlier zobrist keys for the words after 'position' in a UCI command"""
+    if words and words[0] == 'fen':
+        fen_words = []
+        for word in words[1:]:
+            if word == 'moves':
+                break
+            fen_words.append(word)
+        board = fen_to_gameboard(' '.join(fen_words))
+    else:
+        board = fen_to_gameboard(STARTING_FEN)
+    game_keys = []
+    if 'moves' in words:
+        for move_text in words[words.index('moves') + 1:]:
+            game_keys.append(board.zobrist_key)
+            apply_move(board, parse_move(board, move_text))
+    return board, game_keys
+
+def search_limits(words, white_to_move):
+    """Searcher.search keyword arguments for the words after 'go' in a UCI command"""
+    values = {}
+    for name, value in zip(words, words[1:]):
+        if name in ('depth', 'nodes', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo'):
+            try:
+                values[name] = int(value)
+            except ValueError:
+                pass
+    limits = {'depth': values.get('depth'), 'nodes': values.get('nodes')}
+    if 'movetime' in values:
+        limits['movetime'] = values['movetime'] / 1000
+    elif ('wtime' if white_to_move else 'btime') in values:
+        time_left = values['wtime' if white_to_move else 'btime']
+        increment = values.get('winc' if white_to_move else 'binc', 0)
+        budget = time_left / values.get('movestogo', 30) + increment * 0.8
+        limits['movetime'] = max(min(budget, time_left / 2), 10) / 1000
+    return limits
+
+def format_info(info):
+    kind, value = info['score']
+    return f"info depth {info['depth']} score {kind} {value} nodes {info['nodes']} nps {info['nps']} " \
+           f"time {info['time']} pv {' '.join(info['pv'])}"
+
+
+def uci_loop(input_stream, output):
+    """Answers UCI commands until 'quit' or the end of input. Searches run in a thread so that
+    'stop' is read while they go on."""
+    write_lock = threading.Lock()
+
+    def send(line):
+        with write_lock:
+            output.write(line + '\n')
+            output.flush()
+
+    searcher = Searcher()
+    board, game_keys = fen_to_gameboard(STARTING_FEN), []
+    stop_event = threading.Event()
+    search_thread = None
+
+    def run_search(search_board, limits, keys):
+        best_move, score = searcher.search(search_board, stop_event=stop_event, game_keys=keys,
+                                           on_info=lambda info: send(format_info(info)), **limits)
+        send(f"bestmove {move_to_uci(best_move) if best_move is not None else '(none)'}")
+
+    def finish_search():
+        if search_thread is not None:
+            stop_event.set()
+            search_thread.join()
+
+    for line in input_stream:
+        words = line.split()
+        if not words:
+            continue
+        command = words[0]
+        if command == 'uci':
+            send(f"id name {ENGINE_NAME}")
+            send('uciok')
+        elif command == 'isready':
+            send('readyok')
+        elif command == 'ucinewgame':
+            finish_search()
+            searcher.clear()
+        elif command == 'position':
+            finish_search()
+            try:
+                board, game_keys = parse_position(words[1:])
+            except ValueError as error:
+                send(f"info string bad position: {error}")
+        elif command == 'go':
+            finish_search()
+            stop_event.clear()
+            limits = search_limits(words[1:], board.whose_move() == 'w')
+            search_thread = threading.Thread(target=run_search, args=(board.copy(), limits, list(game_keys)),
+                                             daemon=True)
+            search_thread.start()
+        elif command == 'stop':
+            finish_search()
+        elif command == 'quit':
+            break
+    finish_search()
+
+
+def bench(depth=BENCH_DEPTH):
+    """Searches the perft positions to a fixed depth with a fresh Searcher each, printing the time
+    to reach each depth. Returns (total nodes, total seconds)."""
+    from chesscore.perft import PERFT_POSITIONS
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected_counts in PERFT_POSITIONS:
+        searcher = Searcher()
+        depth_times = []
+        start_time = time.perf_counter()
+        best_move, score = searcher.search(fen_to_gameboard(fen), depth=depth,
+                                           on_info=lambda info: depth_times.append(info['time'] / 1000))
+        elapsed = time.perf_counter() - start_time
+        total_nodes += searcher.nodes
+        total_time += elapsed
+        print(f"{name:<12} {move_to_uci(best_move):<6} {searcher.nodes:>8} nodes  {searcher.nodes / elapsed:>7.0f} nodes/s  "
+              + '  '.join(f"d{reached} {seconds:.2f}s" for reached, seconds in enumerate(depth_times, 1)))
+    print(f"{'total':<19} {total_nodes:>8} nodes  {total_nodes / total_time:>7.0f} nodes/s  {total_time:.2f}s")
+    return total_nodes, total_time
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'bench':
+        bench(int(argv[1]) if len(argv) > 1 else BENCH_DEPTH)
+        return 0
+    uci_loop(sys.stdin, sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
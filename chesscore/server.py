@@ -0,0 +1,506 @@
+"""A game server: many independent games on one asyncio event loop, played over TCP.
+
+A session is a GameHistory and the ply being looked at, like a HistoryBoard with no board to draw.
+Clients send one JSON object per line and get one back per line:
+  {"op": "new", "fen": FEN}                   starts a session (fen is optional)
+  {"op": "move", "session": ID, "move": M}     plays a move, in coordinate notation or SAN, from the
+                                              ply being looked at, dropping any moves after it
+  {"op": "fen" | "start" | "back" | "next" | "latest", "session": ID}
+  {"op": "go", "session": ID, "ply": N}
+  {"op": "legal", "session": ID}              the legal moves from the ply being looked at
+  {"op": "moves", "session": ID}              the moves of the game, in coordinate notation
+  {"op": "close", "session": ID}              forgets a session
+  {"op": "stats"}
+Replies have "ok": true and the session's "session", "fen", "ply" (being looked at) and "plies"
+(in the game), plus "outcome" ([result, reason] or null) after a move; or "ok": false and an
+"error". A request's "id", if it has one, is sent back with the reply.
+
+Sessions untouched for idle_seconds, and the least recently used past max_resident, are written to
+the store directory as their starting FEN, moves and ply, then read back and replayed when next
+asked for.
+
+"python -m chesscore.server serve" runs a server. "python -m chesscore.server load" plays random
+games in many sessions at once against one, and prints what the server reports: sessions held,
+memory per session and move latency. With no port given it starts its own server for the timed
+run, and measures memory with a shorter run against a second one tracing allocations, so the
+latencies aren't taken under tracemalloc."""
+
+import argparse
+import array
+import asyncio
+import collections
+import json
+import os
+import random
+import secrets
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+
+from chesscore.board import *
+from chesscore.history import GameHistory
+from chesscore.movegen import CLAIMABLE_DRAWS, game_outcome, legal_moves, move_to_uci
+from chesscore.san import parse_move
+from chesscore.timing import Histogram
+
+DEFAULT_PORT = 8765
+DEFAULT_IDLE_SECONDS = 300.0
+EVICT_INTERVAL = 5.0  # Seconds between looks for idle sessions
+LOAD_SESSIONS = 2000
+LOAD_CONNECTIONS = 50
+LOAD_MOVES = 20  # Moves played in each session by the load generator
+LOAD_SEED = 1
+LOAD_MEMORY_SESSIONS = 100  # Sessions played against a server tracing memory, after the timed run
+
+
+class RequestError(ValueError):
+    """Raised for a request that can't be carried out. Its message goes back to the client."""
+
+
+class Session:
+    """One game on the server. known_moves keeps the legal moves found for a ply, since a client
+    usually asks for them and then plays one."""
+    __slots__ = ('session_id', 'history', 'ply', 'last_used', 'known_moves')
+
+    def __init__(self, session_id, history, ply=None):
+        self.session_id = session_id
+        self.history = history
+        self.ply = len(history) - 1 if ply is None else ply
+        self.last_used = time.monotonic()
+        self.known_moves = None  # (ply, array of moves), replaced whenever a move is played
+
+    def legal_moves(self, game_state=None):
+        """The legal moves from the ply being looked at"""
+        if self.known_moves is None or self.known_moves[0] != self.ply:
+            if game_state is None:
+                game_state = self.history.position(self.ply)
+            self.known_moves = (self.ply, array.array('H', legal_moves(game_state)))
+        return self.known_moves[1]
+
+    def go(self, ply):
+        self.ply = min(max(ply, 0), len(self.history) - 1)
+
+    def play(self, move_text):
+        """Plays a move from the ply being looked at, dropping the moves after it. Returns the
+        position after it, and the outcome as game_outcome gives it."""
+        game_state = self.history.position(self.ply)
+        moves = self.legal_moves(game_state)
+        outcome = game_outcome(game_state, moves)
+        if outcome is not None and outcome[1] not in CLAIMABLE_DRAWS:
+            raise RequestError(f"the game is over: {outcome[0]} by {outcome[1]}")
+        try:
+            move = parse_move(game_state, move_text, moves)
+        except ValueError as error:
+            raise RequestError(str(error)) from None
+        if self.ply < len(self.history) - 1:
+            self.history.truncate(self.ply + 1)
+        self.history.play(game_state, move)
+        self.ply += 1
+        return game_state, game_outcome(game_state, self.legal_moves(game_state))
+
+    def reply(self, game_state=None):
+        """The reply to a request, with game_state as the position being looked at if it is at hand"""
+        if game_state is None:
+            game_state = self.history.position(self.ply)
+        return {'ok': True, 'session': self.session_id, 'fen': game_state.make_fen(), 'ply': self.ply,
+                'plies': len(self.history) - 1}
+
+    def to_json(self):
+        return {'fen': self.history.starting_fen, 'moves': self.history.moves_made, 'ply': self.ply}
+
+    @classmethod
+    def from_json(cls, session_id, saved):
+        """Replays a session written by to_json. Raises RequestError if saved isn't one."""
+        try:
+            game_state = fen_to_gameboard(saved['fen'])
+            history = GameHistory(game_state)
+            for move_text in saved['moves']:
+                history.play(game_state, parse_move(game_state, move_text))
+            ply = saved['ply']
+            if not isinstance(ply, int):
+                raise TypeError("ply isn't a number")
+        except (KeyError, TypeError, AttributeError, ValueError) as error:
+            raise RequestError(f"stored session {session_id} can't be read back: {error}") from None
+        session = cls(session_id, history)
+        session.go(ply)
+        return session
+
+
+class GameServer:
+    """The sessions and the requests made of them. Resident sessions are kept least recently used
+    first, so the ones to evict are at the front."""
+    def __init__(self, store_dir, idle_seconds=DEFAULT_IDLE_SECONDS, max_resident=None):
+        self.store_dir = store_dir
+        self.idle_seconds = idle_seconds
+        self.max_resident = max_resident
+        self.sessions = collections.OrderedDict()  # Session id -> Session
+        os.makedirs(store_dir, exist_ok=True)
+        self.stored = {name[:-5] for name in os.listdir(store_dir) if name.endswith('.json')}
+        self.move_latency = Histogram()
+        self.requests = 0
+        self.evictions = 0
+        self.restores = 0
+        self.connections = 0
+
+    def store_path(self, session_id):
+        return os.path.join(self.store_dir, f"{session_id}.json")
+
+    def evict(self, session):
+        """Writes a session to the store and lets it go"""
+        path = self.store_path(session.session_id)
+        with open(path + '.tmp', 'w') as session_file:
+            json.dump(session.to_json(), session_file)
+        os.replace(path + '.tmp', path)
+        del self.sessions[session.session_id]
+        self.stored.add(session.session_id)
+        self.evictions += 1
+
+    def evict_idle(self):
+        """Evicts sessions idle for idle_seconds, and the least recently used past max_resident"""
+        cutoff = time.monotonic() - self.idle_seconds
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            over_limit = self.max_resident is not None and len(self.sessions) > self.max_resident
+            if session.last_used > cutoff and not over_limit:
+                break
+            self.evict(session)
+
+    def make_room(self):
+        if self.max_resident is not None and len(self.sessions) > self.max_resident:
+            self.evict_idle()
+
+    def session(self, session_id):
+        """A session, read back from the store if it was evicted"""
+        if not isinstance(session_id, str):
+            raise RequestError("no session given")
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+        elif session_id in self.stored:
+            path = self.store_path(session_id)
+            with open(path) as session_file:
+                try:
+                    saved = json.load(session_file)
+                except ValueError as error:
+                    raise RequestError(f"stored session {session_id} can't be read back: {error}") from None
+            session = Session.from_json(session_id, saved)
+            os.remove(path)
+            self.stored.discard(session_id)
+            self.sessions[session_id] = session
+            self.restores += 1
+            self.make_room()
+        else:
+            raise RequestError(f"no session {session_id!r}")
+        session.last_used = time.monotonic()
+        return session
+
+    def add_session(self, fen):
+        if not isinstance(fen, str):
+            raise RequestError("fen must be a string")
+        try:
+            game_state = fen_to_gameboard(fen)
+        except FenError as error:
+            raise RequestError(str(error)) from None
+        session_id = secrets.token_hex(8)
+        session = self.sessions[session_id] = Session(session_id, GameHistory(game_state))
+        self.make_room()
+        return session
+
+    def close_session(self, session_id):
+        if not isinstance(session_id, str):
+            raise RequestError("no session given")
+        if self.sessions.pop(session_id, None) is None:
+            if session_id not in self.stored:
+                raise RequestError(f"no session {session_id!r}")
+            os.remove(self.store_path(session_id))
+            self.stored.discard(session_id)
+
+    def handle(self, request):
+        """The reply to one request"""
+        if not isinstance(request, dict):
+            raise RequestError("a request must be a JSON object")
+        self.requests += 1
+        op = request.get('op')
+        if op == 'new':
+            return self.add_session(request.get('fen') or STARTING_FEN).reply()
+        if op == 'stats':
+            return self.stats()
+        if op == 'close':
+            self.close_session(request.get('session'))
+            return {'ok': True}
+        session = self.session(request.get('session'))
+        if op == 'move':
+            if not isinstance(request.get('move'), str):
+                raise RequestError("move needs a move")
+            game_state, outcome = session.play(request['move'])
+            reply = session.reply(game_state)
+            reply['outcome'] = list(outcome) if outcome is not None else None
+            return reply
+        if op == 'legal':
+            game_state = session.history.position(session.ply)
+            reply = session.reply(game_state)
+            reply['moves'] = [move_to_uci(move) for move in session.legal_moves(game_state)]
+            return reply
+        if op == 'moves':
+            reply = session.reply()
+            reply['moves'] = session.history.moves_made
+            return reply
+        if op == 'start':
+            session.go(0)
+        elif op == 'back':
+            session.go(session.ply - 1)
+        elif op == 'next':
+            session.go(session.ply + 1)
+        elif op == 'latest':
+            session.go(len(session.history) - 1)
+        elif op == 'go':
+            if not isinstance(request.get('ply'), int):
+                raise RequestError("go needs a ply")
+            session.go(request['ply'])
+        elif op != 'fen':
+            raise RequestError(f"unknown op {op!r}")
+        return session.reply()
+
+    def stats(self):
+        traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        return {'ok': True, 'resident': len(self.sessions), 'stored': len(self.stored),
+                'connections': self.connections, 'requests': self.requests, 'evictions': self.evictions,
+                'restores': self.restores, 'traced_bytes': traced,
+                'bytes_per_session': traced / len(self.sessions) if traced is not None and self.sessions else None,
+                'moves': self.move_latency.count, 'move_latency': self.move_latency.summary()}
+
+    async def serve_client(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                start = time.perf_counter()
+                request = None
+                try:
+                    request = json.loads(line)
+                    reply = self.handle(request)
+                except (RequestError, ValueError) as error:  # ValueError covers bad JSON
+                    reply = {'ok': False, 'error': str(error)}
+                except OSError as error:
+                    reply = {'ok': False, 'error': f"session store: {error}"}
+                except Exception as error:  # A bad request mustn't take the connection down with it
+                    traceback.print_exc()
+                    reply = {'ok': False, 'error': f"internal error: {error!r}"}
+                if isinstance(request, dict) and 'id' in request:
+                    reply['id'] = request['id']
+                writer.write(json.dumps(reply).encode() + b'\n')
+                if isinstance(request, dict) and request.get('op') == 'move':
+                    self.move_latency.add(time.perf_counter() - start)
+                await writer.drain()
+        except (ConnectionError, ValueError):  # ValueError is a line over the stream limit
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def evict_forever(self):
+        while True:
+            await asyncio.sleep(EVICT_INTERVAL)
+            try:
+                self.evict_idle()
+            except OSError as error:
+                print(f"can't evict sessions: {error}", file=sys.stderr)
+
+    async def serve(self, host, port, on_listening=None):
+        server = await asyncio.start_server(self.serve_client, host, port)
+        evicter = asyncio.create_task(self.evict_forever())
+        if on_listening is not None:
+            on_listening(server.sockets[0].getsockname())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            evicter.cancel()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+async def run_load(host, port, sessions=LOAD_SESSIONS, connections=LOAD_CONNECTIONS, moves=LOAD_MOVES,
+                   seed=LOAD_SEED):
+    """Opens connections, starts sessions spread over them, and plays random moves in every session
+    in turn, looking back through each game now and then. Returns the move round trip times in
+    seconds, and the server's stats afterwards."""
+    round_trips = []
+
+    async def client(number, session_count):
+        rng = random.Random(seed * 1000 + number)
+        reader, writer = await asyncio.open_connection(host, port)
+
+        async def ask(request):
+            writer.write(json.dumps(request).encode() + b'\n')
+            await writer.drain()
+            reply = json.loads(await reader.readline())
+            if not reply['ok']:
+                raise RuntimeError(f"{request}: {reply['error']}")
+            return reply
+
+        try:
+            session_ids = [(await ask({'op': 'new'}))['session'] for _ in range(session_count)]
+            for move_number in range(moves):
+                for session_id in session_ids:
+                    legal = (await ask({'op': 'legal', 'session': session_id}))['moves']
+                    if not legal:
+                        continue
+                    start = time.perf_counter()
+                    await ask({'op': 'move', 'session': session_id, 'move': rng.choice(legal)})
+                    round_trips.append(time.perf_counter() - start)
+                    if rng.random() < 0.1:
+                        await ask({'op': rng.choice(('start', 'back', 'fen')), 'session': session_id})
+                        await ask({'op': 'latest', 'session': session_id})
+        finally:
+            writer.close()
+
+    per_connection = [sessions // connections + (number < sessions % connections) for number in range(connections)]
+    await asyncio.gather(*(client(number, count) for number, count in enumerate(per_connection) if count))
+    return round_trips, await fetch_stats(host, port)
+
+async def fetch_stats(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"op": "stats"}\n')
+    await writer.drain()
+    stats = json.loads(await reader.readline())
+    writer.close()
+    return stats
+
+async def measure_session_memory(host, port, sessions, connections, moves, seed):
+    """Bytes per session that a load adds to a server tracing memory, or None if it isn't"""
+    before = (await fetch_stats(host, port))['traced_bytes']
+    round_trips, stats = await run_load(host, port, sessions, connections, moves, seed)
+    if before is None or not stats['resident']:
+        return None
+    return (stats['traced_bytes'] - before) / stats['resident']
+
+async def start_server(host, store, max_resident=None, trace_memory=False):
+    """A server subprocess listening on a free port, and the port"""
+    command = [sys.executable, '-m', 'chesscore.server', 'serve', '--host', host, '--port', '0', '--store', store]
+    if max_resident is not None:
+        command += ['--max-resident', str(max_resident)]
+    if trace_memory:
+        command.append('--trace-memory')
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+    line = (await process.stdout.readline()).decode()
+    if not line.startswith('listening on '):
+        process.kill()
+        await process.wait()
+        raise OSError("the server didn't start")
+    return process, int(line.rsplit(':', 1)[1])
+
+def load_report_lines(round_trips, stats, elapsed, bytes_per_session=None):
+    """The load generator's report. bytes_per_session, if not given, is what the server reports,
+    which includes everything it has allocated since it started tracing."""
+    round_trips = sorted(round_trips)
+    latency = stats['move_latency']
+    if bytes_per_session is None:
+        bytes_per_session = stats['bytes_per_session']
+    return [
+        f"{len(round_trips)} moves in {elapsed:.1f}s ({len(round_trips) / elapsed if elapsed else 0:.0f} moves/s "
+        f"with a legal-moves request before each)",
+        f"sessions: {stats['resident']} resident, {stats['stored']} stored; {stats['evictions']} evictions, "
+        f"{stats['restores']} restores",
+        f"memory per resident session: "
+        + (f"{bytes_per_session / 1024:.1f} KiB" if bytes_per_session is not None else "not traced"),
+        f"server move latency: p50 {latency['p50_ms']:.3f}ms p99 {latency['p99_ms']:.3f}ms "
+        f"max {latency['max_ms']:.3f}ms (power-of-two buckets)",
+        f"client round trip:   p50 {percentile(round_trips, 0.5) * 1e3:.3f}ms "
+        f"p99 {percentile(round_trips, 0.99) * 1e3:.3f}ms max {(round_trips[-1] if round_trips else 0) * 1e3:.3f}ms",
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m chesscore.server', description="Host many games over TCP")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="run a game server")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT, help="0 picks a free port")
+    serve.add_argument('--store', default=os.path.join(tempfile.gettempdir(), 'mchess-sessions'),
+                       help="directory idle sessions are written to")
+    serve.add_argument('--idle', type=float, default=DEFAULT_IDLE_SECONDS,
+                       help="seconds before an untouched session is written to the store")
+    serve.add_argument('--max-resident', type=int, help="sessions kept in memory at most")
+    serve.add_argument('--trace-memory', action='store_true',
+                       help="trace allocations, so stats can give the memory per session (slower)")
+    load = commands.add_parser('load', help="play random games in many sessions against a server")
+    load.add_argument('--host', default='127.0.0.1')
+    load.add_argument('--port', type=int,
+                      help="server to load (default: start one to time, then a short run against one tracing memory)")
+    load.add_argument('--sessions', type=int, default=LOAD_SESSIONS)
+    load.add_argument('--connections', type=int, default=LOAD_CONNECTIONS)
+    load.add_argument('--moves', type=int, default=LOAD_MOVES, help="moves played in each session")
+    load.add_argument('--max-resident', type=int, help="for the server started: sessions kept in memory at most")
+    load.add_argument('--seed', type=int, default=LOAD_SEED)
+    load.add_argument('--memory-sessions', type=int, default=LOAD_MEMORY_SESSIONS,
+                      help="sessions in the run measuring memory, when starting the servers (0 to skip it)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        server = GameServer(args.store, args.idle, args.max_resident)
+        if args.trace_memory:
+            tracemalloc.start()
+
+        def listening(address):
+            print(f"listening on {address[0]}:{address[1]}", flush=True)
+
+        try:
+            asyncio.run(server.serve(args.host, args.port, listening))
+        except KeyboardInterrupt:
+            pass
+        except OSError as error:
+            print(error, file=sys.stderr)
+            return 1
+        return 0
+
+    async def run():
+        if args.port is not None:
+            start_time = time.perf_counter()
+            round_trips, stats = await run_load(args.host, args.port, args.sessions, args.connections, args.moves,
+                                                args.seed)
+            return round_trips, stats, time.perf_counter() - start_time, None
+        # Tracing allocations slows the server down several times over, so the timed run is against
+        # a server that doesn't, and memory is measured by a shorter run against one that does
+        with tempfile.TemporaryDirectory() as store:
+            process, port = await start_server(args.host, store, args.max_resident)
+            try:
+                start_time = time.perf_counter()
+                round_trips, stats = await run_load(args.host, port, args.sessions, args.connections, args.moves,
+                                                    args.seed)
+                elapsed = time.perf_counter() - start_time
+            finally:
+                process.terminate()
+                await process.wait()
+        bytes_per_session = None
+        if args.memory_sessions > 0:
+            with tempfile.TemporaryDirectory() as store:
+                process, port = await start_server(args.host, store, trace_memory=True)
+                try:
+                    bytes_per_session = await measure_session_memory(
+                        args.host, port, args.memory_sessions, min(args.connections, args.memory_sessions),
+                        args.moves, args.seed)
+                finally:
+                    process.terminate()
+                    await process.wait()
+        return round_trips, stats, elapsed, bytes_per_session
+
+    try:
+        round_trips, stats, elapsed, bytes_per_session = asyncio.run(run())
+    except (OSError, RuntimeError) as error:
+        print(error, file=sys.stderr)
+        return 1
+    for line in load_report_lines(round_trips, stats, elapsed, bytes_per_session):
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Optional timing of the GUI's hot paths, to see where the milliseconds of a move go.
+
+Functions wrapped with timed(name) and blocks inside TIMINGS.stage(name) are timed while
+TIMINGS.enabled is set, and cost a single check otherwise. Stages nest, and each keeps its own
+inclusive time: drag_drop includes move, which includes render and config_image. Every timing
+goes into its stage's histogram, with power-of-two buckets of microseconds, and into a trace of
+the last TRACE_LENGTH timings, which can be dumped as JSON (histograms and trace) or CSV (trace).
+
+Setting the MCHESS_TIMINGS environment variable turns timing on from the start, so startup is
+timed too."""
+
+import collections
+import csv
+import functools
+import json
+import os
+import time
+
+BUCKET_COUNT = 26  # Bucket i holds timings under 2**i microseconds, the last one everything longer
+TRACE_LENGTH = 100000
+
+
+class Histogram:
+    """Timings of one stage"""
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+        self.buckets = [0] * BUCKET_COUNT
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.minimum is None or seconds < self.minimum:
+            self.minimum = seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKET_COUNT - 1)] += 1
+
+    def percentile(self, fraction):
+        """The upper edge, in seconds, of the bucket holding that fraction of the timings"""
+        wanted = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= wanted and bucket_count:
+                return min((1 << index) / 1e6, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        """The histogram as a dict of milliseconds, for JSON"""
+        return {'count': self.count, 'total_ms': self.total * 1000,
+                'mean_ms': self.total * 1000 / self.count if self.count else 0,
+                'min_ms': (self.minimum or 0) * 1000, 'max_ms': self.maximum * 1000,
+                'p50_ms': self.percentile(0.5) * 1000, 'p90_ms': self.percentile(0.9) * 1000,
+                'p99_ms': self.percentile(0.99) * 1000,
+                'buckets_us': {f"<{1 << index}": bucket_count for index, bucket_count in enumerate(self.buckets)
+                               if bucket_count}}
+
+
+class Timings:
+    """Histograms and a trace of timed stages"""
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}  # Stage name -> Histogram
+        self.trace = collections.deque(maxlen=TRACE_LENGTH)  # (stage, start, seconds), start from self.origin
+        self.origin = time.perf_counter()
+
+    def clear(self):
+        self.histograms.clear()
+        self.trace.clear()
+        self.origin = time.perf_counter()
+
+    def record(self, name, start, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(seconds)
+        self.trace.append((name, start - self.origin, seconds))
+
+    def stage(self, name):
+        """A context manager timing the block inside it"""
+        return _Stage(self, name) if self.enabled else _NOT_TIMED
+
+    def summary_lines(self):
+        """A line per stage, slowest in total first"""
+        lines = [f"{'stage':<22} {'count':>6} {'mean':>8} {'p90':>8} {'max':>8}  ms"]
+        for name, histogram in sorted(self.histograms.items(), key=lambda item: item[1].total, reverse=True):
+            lines.append(f"{name:<22} {histogram.count:>6} {histogram.total * 1000 / histogram.count:>8.3f} "
+                         f"{histogram.percentile(0.9) * 1000:>8.3f} {histogram.maximum * 1000:>8.3f}")
+        return lines
+
+    def dump(self, path):
+        """Writes the timings to path: the trace as CSV if it ends in .csv, otherwise histograms
+        and trace as JSON"""
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', newline='') as trace_file:
+                writer = csv.writer(trace_file)
+                writer.writerow(['stage', 'start_ms', 'duration_ms'])
+                for name, start, seconds in self.trace:
+                    writer.writerow([name, f"{start * 1000:.3f}", f"{seconds * 1000:.3f}"])
+        else:
+            with open(path, 'w') as trace_file:
+                json.dump({'stages': {name: histogram.summary() for name, histogram in self.histograms.items()},
+                           'trace': [[name, round(start * 1000, 3), round(seconds * 1000, 3)]
+                                     for name, start, seconds in self.trace]}, trace_file, indent=1)
+
+
+class _Stage:
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.name, self.start, time.perf_counter() - self.start)
+
+
+class _NotTimed:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NOT_TIMED = _NotTimed()
+
+TIMINGS = Timings(enabled=bool(os.environ.get('MCHESS_TIMINGS')))
+
+
+def timed(name, timings=TIMINGS):
+    """Decorator timing each call of a function as the stage name"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not timings.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.record(name, start, time.perf_counter() - start)
+        return wrapper
+    return decorate
@@ -0,0 +1,307 @@
+"""Talking to a chess engine over UCI.
+
+UciEngine drives the engine subprocess through asyncio pipes. BackgroundEngine runs one on an
+event loop in its own thread for the GUI: its methods can be called from Tk, and what the engine
+says comes back on a queue, which the GUI empties with root.after so mainloop never waits on it.
+
+The engine command is just a list of arguments, so any program speaking UCI on standard input
+and output will do, including a short script standing in for a real engine.
+
+"python -m chesscore.uci [--depth N] [--fen FEN] engine [args...]" analyses one position and
+prints what the engine says."""
+
+import argparse
+import asyncio
+import queue
+import sys
+import threading
+
+from chesscore.board import STARTING_FEN
+from chesscore.movegen import CASTLING_MOVES, encode_move, move_to_uci
+from chesscore.san import variation_text
+
+INFO_INT_FIELDS = ('depth', 'seldepth', 'multipv', 'nodes', 'nps', 'time', 'hashfull', 'tbhits',
+                   'currmovenumber')
+GO_LIMITS = ('depth', 'nodes', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo', 'mate')
+ENGINE_START_TIMEOUT = 10.0  # Seconds to wait for uciok and readyok
+
+
+class EngineError(Exception):
+    """Raised when the engine exits, can't be started or doesn't answer"""
+
+
+def parse_info(line):
+    """Reads an 'info ...' line into a dict. The score is kept as ('cp', n) or ('mate', n) from the
+    side to move's point of view, and the pv as a list of coordinate moves."""
+    tokens = line.split()[1:]
+    info = {}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in INFO_INT_FIELDS and i + 1 < len(tokens):
+            try:
+                info[token] = int(tokens[i + 1])
+            except ValueError:
+                pass
+            i += 2
+        elif token == 'score' and i + 2 < len(tokens):
+            try:
+                info['score'] = (tokens[i + 1], int(tokens[i + 2]))
+            except ValueError:
+                pass
+            i += 3
+            if i < len(tokens) and tokens[i] in ('lowerbound', 'upperbound'):
+                info['bound'] = tokens[i]
+                i += 1
+        elif token == 'currmove' and i + 1 < len(tokens):
+            info['currmove'] = tokens[i + 1]
+            i += 2
+        elif token == 'pv':
+            info['pv'] = tokens[i + 1:]
+            break
+        elif token == 'string':
+            info['string'] = ' '.join(tokens[i + 1:])
+            break
+        else:
+            i += 1
+    return info
+
+def format_score(score, white_to_move):
+    """A score as text from White's point of view, such as '+0.34' or '#-3'"""
+    kind, value = score
+    if not white_to_move:
+        value = -value
+    if kind == 'mate':
+        return f"#{value}"
+    return f"{value / 100:+.2f}"
+
+def uci_moves(history):
+    """moves_made of a GameHistory in coordinate notation, with 'O-O' and 'O-O-O' written out"""
+    white_to_move = history.starting_fen.split()[1] == 'w'
+    moves = []
+    for move_text in history.moves_made:
+        if move_text in ('O-O', 'O-O-O'):
+            option = ('w' if white_to_move else 'b') + ('k' if move_text == 'O-O' else 'q')
+            move_text = move_to_uci(encode_move(*CASTLING_MOVES[option][:2]))
+        moves.append(move_text)
+        white_to_move = not white_to_move
+    return moves
+
+def position_command(history, index=None):
+    """The UCI position command for the position after index plies of a GameHistory (by default
+    the last), as the starting position plus the moves played from it"""
+    moves = uci_moves(history)[:index]
+    base = 'startpos' if history.starting_fen == STARTING_FEN else 'fen ' + history.starting_fen
+    return f"position {base} moves {' '.join(moves)}" if moves else f"position {base}"
+
+def fen_position_command(game_state):
+    return 'position fen ' + game_state.make_fen()
+
+def go_command(**limits):
+    """'go' with the given limits, such as depth=20 or movetime=1000. No limits searches until
+    stopped."""
+    arguments = [f"{name} {limits[name]}" for name in GO_LIMITS if limits.get(name) is not None]
+    return 'go ' + (' '.join(arguments) if arguments else 'infinite')
+
+
+class UciEngine:
+    """A UCI engine subprocess. start() must be awaited before anything else."""
+    def __init__(self, command):
+        self.command = [command] if isinstance(command, str) else list(command)
+        self.process = None
+        self.name = None
+        self.options = {}  # Option name -> rest of its 'option' line
+
+    async def start(self):
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *self.command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+        except OSError as error:
+            raise EngineError(f"Can't start {self.command[0]}: {error}") from None
+        self.send('uci')
+        try:
+            await asyncio.wait_for(self._read_identity(), ENGINE_START_TIMEOUT)
+            await asyncio.wait_for(self.ready(), ENGINE_START_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise EngineError(f"{self.command[0]} didn't answer uci") from None
+
+    async def _read_identity(self):
+        while True:
+            line = await self.read_line()
+            if line == 'uciok':
+                return
+            if line.startswith('id name '):
+                self.name = line[8:]
+            elif line.startswith('option name '):
+                name, space, details = line[12:].partition(' type ')
+                self.options[name] = details
+
+    def send(self, command):
+        if self.process is None or self.process.stdin.is_closing():
+            raise EngineError("Engine isn't running")
+        self.process.stdin.write(command.encode() + b'\n')
+
+    async def read_line(self):
+        line = await self.process.stdout.readline()
+        if not line:
+            raise EngineError("Engine exited")
+        return line.decode(errors='replace').strip()
+
+    async def ready(self):
+        """Waits until the engine has dealt with everything sent so far"""
+        self.send('isready')
+        while await self.read_line() != 'readyok':
+            pass
+
+    async def set_option(self, name, value):
+        self.send(f"setoption name {name} value {value}")
+        await self.ready()
+
+    async def new_game(self):
+        self.send('ucinewgame')
+        await self.ready()
+
+    async def analyse(self, position, on_info=None, **limits):
+        """Searches the position (a position command) and returns (best move, ponder move or None).
+        on_info is called with parse_info's dict for every info line, as it arrives."""
+        self.send(position)
+        self.send(go_command(**limits))
+        while True:
+            line = await self.read_line()
+            if line.startswith('info '):
+                if on_info is not None:
+                    on_info(parse_info(line))
+            elif line.startswith('bestmove'):
+                words = line.split()
+                best_move = words[1] if len(words) > 1 and words[1] != '(none)' else None
+                ponder = words[3] if len(words) > 3 and words[2] == 'ponder' else None
+                return best_move, ponder
+
+    def stop(self):
+        """Asks the engine to finish the current search. analyse then returns its best move."""
+        self.send('stop')
+
+    async def quit(self):
+        if self.process is None:
+            return
+        if self.process.returncode is None:
+            try:
+                self.send('quit')
+                await asyncio.wait_for(self.process.wait(), 2.0)
+            except (EngineError, ConnectionError, asyncio.TimeoutError):
+                self.process.kill()
+                await self.process.wait()
+
+
+class BackgroundEngine:
+    """A UciEngine running on an asyncio event loop in a daemon thread. The methods are meant to
+    be called from the Tk thread, and return straight away. Everything the engine reports is put
+    on the events queue as ('ready', name), ('info', info dict), ('bestmove', (search id, move,
+    ponder)) or ('error', message), and each info is tagged with the search it belongs to so stale
+    ones can be told apart."""
+    def __init__(self, command):
+        self.events = queue.Queue()
+        self.engine = UciEngine(command)
+        self.search = None  # Task of the search running on the loop
+        self.search_id = 0
+        self.loop = asyncio.new_event_loop()
+        self.lock = asyncio.Lock()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self._submit(self._start())
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def _start(self):
+        try:
+            await self.engine.start()
+        except EngineError as error:
+            self.events.put(('error', str(error)))
+            return
+        self.events.put(('ready', self.engine.name or self.engine.command[0]))
+
+    async def _stop_search(self):
+        if self.search is not None and not self.search.done():
+            try:
+                self.engine.stop()
+            except EngineError:
+                pass
+            await asyncio.wait([self.search])
+        self.search = None
+
+    async def _analyse(self, position, search_id, limits):
+        async with self.lock:
+            await self._stop_search()
+            self.search = asyncio.ensure_future(self._search(position, search_id, limits))
+
+    async def _search(self, position, search_id, limits):
+        try:
+            best_move, ponder = await self.engine.analyse(
+                position, lambda info: self.events.put(('info', dict(info, search_id=search_id))), **limits)
+        except EngineError as error:
+            self.events.put(('error', str(error)))
+            return
+        self.events.put(('bestmove', (search_id, best_move, ponder)))
+
+    def analyse(self, position, **limits):
+        """Stops any search going on and starts searching position, a position command. Returns
+        the id its info events will carry."""
+        self.search_id += 1
+        self._submit(self._analyse(position, self.search_id, limits))
+        return self.search_id
+
+    def stop(self):
+        async def stop_with_lock():
+            async with self.lock:
+                await self._stop_search()
+        self._submit(stop_with_lock())
+
+    def close(self):
+        """Stops the engine and the thread running it, without waiting for either"""
+        async def shut_down():
+            async with self.lock:
+                await self._stop_search()
+                await self.engine.quit()
+            self.loop.stop()
+        self._submit(shut_down())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m chesscore.uci', description="Analyse a position with a UCI engine")
+    parser.add_argument('--fen', default=STARTING_FEN)
+    parser.add_argument('--depth', type=int, default=12)
+    parser.add_argument('engine', nargs=argparse.REMAINDER, help="the engine command and its arguments")
+    args = parser.parse_args(argv)
+    if not args.engine:
+        parser.error("no engine command given")
+
+    from chesscore.board import fen_to_gameboard
+    game_state = fen_to_gameboard(args.fen)
+    white_to_move = game_state.whose_move() == 'w'
+
+    def print_info(info):
+        if 'pv' in info and 'score' in info:
+            print(f"depth {info.get('depth', '?'):>3}  {format_score(info['score'], white_to_move):>7}  "
+                  f"{variation_text(game_state, info['pv'])}")
+
+    async def run():
+        engine = UciEngine(args.engine)
+        await engine.start()
+        print(f"{engine.name or args.engine[0]}")
+        try:
+            best_move, ponder = await engine.analyse(fen_position_command(game_state), print_info, depth=args.depth)
+        finally:
+            await engine.quit()
+        print(f"bestmove {best_move}")
+
+    try:
+        asyncio.run(run())
+    except EngineError as error:
+        print(error, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Board diagrams as PNG files, drawn with PIL from the sprites the board on screen uses, without Tk.
+
+Squares are the light and dark tiles and pieces the bare piece sprites, placed as the canvas board
+places them. Each square size's sprites are scaled once, through the atlas cache in sprites.py,
+and kept for the life of the process along with the empty board.
+
+"python diagram.py [options] [file ...]" reads positions a line at a time, as a FEN or EPD
+optionally followed by the last move in coordinate notation (like e2e4) to highlight, and writes
+one PNG per position. Worker processes each draw a chunk of positions and write them straight to
+disk. With no files, or "-", it reads standard input. Run it from the top of the repository."""
+
+import argparse
+import os
+import sys
+import time
+
+from PIL import Image
+
+from chesscore.board import *
+from chesscore.parallel import chunked, map_in_order
+from chesscore.san import UCI_PATTERN
+from sprites import load_atlas, SPRITE_NAMES
+
+DEFAULT_SIZE = 400  # Pixels along each side; rounded down to a multiple of 8
+MIN_SIZE = 64
+LAST_MOVE_COLOUR = (255, 224, 138, 140)  # CURRENT_MOVE_COLOUR from the GUI, laid over the squares
+CHUNK_SIZE = 50  # Positions drawn by a worker at a time
+PNG_COMPRESS_LEVEL = 3
+
+
+class DiagramSprites:
+    """The images for one square size: tiles, highlighted tiles, pieces and the empty board"""
+    def __init__(self, square_size):
+        self.square_size = square_size
+        tiles = load_atlas(square_size)
+        pieces = load_atlas(square_size - 2)
+        self.tiles = {}
+        for name in ('light', 'dark'):
+            tile = crop_sprite(tiles, name, square_size).convert('RGB')
+            self.tiles[name] = tile
+            highlight = Image.new('RGBA', tile.size, LAST_MOVE_COLOUR)
+            self.tiles[name + '-highlight'] = Image.alpha_composite(tile.convert('RGBA'), highlight).convert('RGB')
+        piece_size = pieces.size[1]
+        self.pieces = {piece: crop_sprite(pieces, name, piece_size) for piece, name in enumerate(CODE_TO_PIECE) if name}
+        self.piece_offset = (square_size - piece_size) // 2
+        self.empty_board = Image.new('RGB', (square_size * BOARD_DIMENSIONS,) * 2)
+        for coord in ALL_COORDS:  # The pattern is the same either way up, so one board serves both
+            self.empty_board.paste(self.tiles[tile_name(coord)], self.corner(coord))
+
+    def corner(self, screen_coord):
+        """Top left pixel of a square given in on-screen coordinates"""
+        x, y = screen_coord
+        return x * self.square_size, (7 - y) * self.square_size
+
+
+def crop_sprite(atlas, name, size):
+    left = SPRITE_NAMES.index(name) * size
+    return atlas.crop((left, 0, left + size, size))
+
+def tile_name(coord):
+    return 'light' if is_light(coord) else 'dark'
+
+
+_sprite_sets = {}
+
+def get_sprites(square_size):
+    """One DiagramSprites per square size for the life of the process"""
+    if square_size not in _sprite_sets:
+        _sprite_sets[square_size] = DiagramSprites(square_size)
+    return _sprite_sets[square_size]
+
+
+def draw_diagram(board, size=DEFAULT_SIZE, flipped=False, last_move=None):
+    """A PIL image of a GameBoard or FEN, size pixels across (rounded down to a multiple of 8, and
+    at least MIN_SIZE). flipped puts Black at the bottom, as flip_board does. last_move is a move
+    in coordinate notation, or a (from, to) pair of square indexes, whose squares are highlighted."""
+    if isinstance(board, str):
+        board = fen_to_gameboard(board)
+    sprites = get_sprites(max(size, MIN_SIZE) // BOARD_DIMENSIONS)
+    image = sprites.empty_board.copy()
+
+    def screen(coord):
+        return flip_coordinates(coord) if flipped else coord
+
+    if last_move is not None:
+        if isinstance(last_move, str):
+            last_move = (coords_to_index(square_to_coords(last_move[:2])),
+                         coords_to_index(square_to_coords(last_move[2:4])))
+        for index in last_move:
+            coord = index_to_coords(index)
+            image.paste(sprites.tiles[tile_name(coord) + '-highlight'], sprites.corner(screen(coord)))
+
+    offset = sprites.piece_offset
+    for index, piece in enumerate(board.squares):
+        if piece:
+            left, top = sprites.corner(screen(index_to_coords(index)))
+            sprite = sprites.pieces[piece]
+            image.paste(sprite, (left + offset, top + offset), sprite)
+    return image
+
+
+def parse_line(line):
+    """The FEN and last move (or None) on a line of input, or None for a blank line or comment"""
+    fields = line.split()
+    if not fields or fields[0].startswith('#'):
+        return None
+    fen_length = 6 if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit() else 4
+    last_move = fields[fen_length] if len(fields) > fen_length and UCI_PATTERN.match(fields[fen_length]) else None
+    return ' '.join(fields[:fen_length]), last_move
+
+def draw_chunk(job):
+    """Draws and saves a chunk of (number, line) pairs. Returns the number drawn, and the problems
+    as (number, message) pairs."""
+    lines, out_dir, size, orientation = job
+    drawn = 0
+    problems = []
+    for number, line in lines:
+        parsed = parse_line(line)
+        if parsed is None:
+            continue
+        fen, last_move = parsed
+        try:
+            board = fen_to_gameboard(fen)
+        except FenError as error:
+            problems.append((number, str(error)))
+            continue
+        flipped = orientation == 'black' or orientation == 'side' and board.whose_move() == 'b'
+        image = draw_diagram(board, size, flipped, last_move)
+        image.save(os.path.join(out_dir, f"{number:06d}.png"), compress_level=PNG_COMPRESS_LEVEL)
+        drawn += 1
+    return drawn, problems
+
+def input_lines(paths):
+    if not paths:
+        paths = ['-']
+    for path in paths:
+        if path == '-':
+            yield from sys.stdin
+        else:
+            with open(path) as input_file:
+                yield from input_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python diagram.py', description="Draw board diagrams as PNG files")
+    parser.add_argument('files', nargs='*', help="files of FENs or EPDs, one per line (default standard input)")
+    parser.add_argument('-o', '--output', default='diagrams', help="directory for the PNGs, named by line number")
+    parser.add_argument('-s', '--size', type=int, default=DEFAULT_SIZE, help="pixels along each side")
+    parser.add_argument('--orientation', choices=('white', 'black', 'side'), default='white',
+                        help="side at the bottom; 'side' puts the side to move at the bottom")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+    if args.size < MIN_SIZE:
+        parser.error(f"size must be at least {MIN_SIZE}")
+
+    os.makedirs(args.output, exist_ok=True)
+    get_sprites(args.size // BOARD_DIMENSIONS)  # Builds the atlases once, before the workers look for them
+    start_time = time.perf_counter()
+    numbered = enumerate(input_lines(args.files), 1)
+    jobs = ((lines, args.output, args.size, args.orientation) for lines in chunked(numbered, CHUNK_SIZE))
+    drawn = failed = 0
+    for job, (chunk_drawn, problems) in map_in_order(draw_chunk, jobs, args.jobs):
+        for number, message in problems:
+            print(f"line {number}: {message}", file=sys.stderr)
+        drawn += chunk_drawn
+        failed += len(problems)
+    elapsed = time.perf_counter() - start_time
+    print(f"{drawn} diagrams drawn in {elapsed:.2f}s ({drawn / elapsed if elapsed else 0:.0f}/s), "
+          f"{failed} positions rejected", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
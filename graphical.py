@@ -1,31 +1,48 @@
 """Sets up the graphical user interface"""
 
-import copy
+import os
+import queue
+import sqlite3
+import struct
+import sys
+import threading
 from tkinter import *
-from PIL import ImageTk, Image
+from tkinter import filedialog
+from PIL import Image
+
+from chesscore.board import *
+from chesscore.evalcache import AnalysisCache, position_key
+from chesscore.archive import Archive, ArchiveError, ArchiveWriter
+from chesscore.bitbase import Bitbases
+from chesscore.explorer import ExplorerIndex, stats_lines
+from chesscore.history import GameTree
+from chesscore.pgn import PgnError, game_headers, read_game_at, read_games, write_game
+from chesscore.san import variation_text
+from chesscore.timing import TIMINGS, timed
+from chesscore.uci import BackgroundEngine, format_score, position_command
+from chesscore.movegen import CASTLING_MOVES, CLAIMABLE_DRAWS, QUEEN, legal_moves, apply_move, encode_move, \
+    game_outcome, move_from, move_to, move_promotion, move_to_uci
+from sprites import get_atlas
 
 BOARD_SIZE = 512
-BOARD_DIMENSIONS = 8
 SQ_SIZE = BOARD_SIZE // BOARD_DIMENSIONS
-PIECE_CODES = ['bK', 'bQ', 'bR', 'bB', 'bN', 'bP', 'wK', 'wQ', 'wR', 'wB', 'wN', 'wP']
-STARTING_COORDS = {'wP': [(i,1) for i in range(8)], 'bP':[(i,6) for i in range(8)],
-                   'wK': [(4, 0)], 'wQ': [(3,0)], 'wR': [(0,0), (7,0)], 'wB': [(2,0),(5,0)], 'wN': [(1,0),(6,0)],
-                   'bK': [(4,7)], 'bQ': [(3,7)], 'bR': [(0,7), (7,7)], 'bB': [(2,7),(5,7)], 'bN': [(1,7),(6,7)],}
-
-STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
-STARTING_FLAGS = {'wk': True, 'wq': True, 'bk': True, 'bq': True, 'next_move':'w',
-                  'ep_target':None, 'repetition_ct':0, 'halfmove_clock': 0, 'move_number': 1}
-
-FILES = ['a','b','c', 'd','e','f','g','h']
-RANKS = ['1','2','3','4','5','6','7','8']
 IMAGE_CODES = ['dark', 'light', 'bK-dark', 'bQ-dark', 'bR-dark', 'bB-dark', 'bN-dark',
                'bP-dark', 'wK-dark', 'wQ-dark', 'wR-dark', 'wB-dark', 'wN-dark', 'wP-dark',
                'bK-light', 'bQ-light', 'bR-light', 'bB-light', 'bN-light',
                'bP-light', 'wK-light', 'wQ-light', 'wR-light', 'wB-light', 'wN-light', 'wP-light',]
-FEN_CORRESPONDENCES = {'p':'bP','k':'bK','q':'bQ','r':'bR','n':'bN','b':'bB',
-                       'P':'wP', 'K':'wK', 'Q':'wQ', 'R':'wR', 'N':'wN', 'B':'wB'}
-REVERSED_CORRESPONDENCES = {'bP':'p','bK':'k','bQ':'q','bR':'r','bN':'n','bB':'b',
-                       'wP':'P', 'wK':'K', 'wQ':'Q', 'wR':'R', 'wN':'N', 'wB':'B'}
+BOARD_BACKEND = 'canvas'  # 'canvas' draws the board on one Canvas, 'buttons' uses a Button per square
+NOT_SHOWN = b'\xff'  # Marks a square button that has no image yet, so the next render redraws it
+ENGINE_POLL_MS = 100  # How often the GUI picks up what the engine has said
+ANALYSIS_DEPTH = 22  # Positions analysed this deep are shown from the analysis cache without searching again
+ANALYSIS_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.mchess-analysis.sqlite')
+ENGINE_MOVE_TIME_MS = 2000  # Thinking time for a move the engine plays on the board
+BUILT_IN_ENGINE = [sys.executable, '-m', 'chesscore.search']
+TIMING_OVERLAY_MS = 500  # How often the timing overlay is redrawn while it is shown
+MOVE_LIST_ROWS = 28  # Full moves in view at once in the move list
+MOVE_LIST_ROW_HEIGHT = 18
+MOVE_LIST_COLUMNS = (6, 50, 150)  # x of the move number, White's move and Black's move
+MOVE_LIST_WIDTH = 250
+CURRENT_MOVE_COLOUR = '#FFE08A'
 
 #TODO: Two "Modes": Analysis mode and Game mode
 # Analysis mode = can move in previous positions and alter course of ongoing game
@@ -33,7 +50,6 @@ REVERSED_CORRESPONDENCES = {'bP':'p','bK':'k','bQ':'q','bR':'r','bN':'n','bB':'b
 #TODO: Create an AnalysisBoard class
 #TODO: Find a way to select between the two classes on starting a new game (Tricky part!!!)
 
-#TODO: Frame for storing moves made
 #TODO: Make this frame interact with the game history
 
 
@@ -44,62 +60,6 @@ def sequentially(*funcs):
     for funct in funcs:
         funct()
 
-def fen_to_gameboard(fen_string):
-    piece_configuration, space, extra_descriptors = fen_string.partition(' ')
-    coordinates = {}
-    row_idx = 7
-    col_idx = 0
-    for character in piece_configuration:
-        if character == '/':
-            row_idx -= 1
-            col_idx = 0
-            continue
-        if character.isnumeric():
-            for i in range(int(character)):
-                coordinates[(col_idx, row_idx)] = ''
-                col_idx += 1
-        else:
-            coordinates[(col_idx, row_idx)] = FEN_CORRESPONDENCES[character]
-            col_idx += 1
-
-    fields = extra_descriptors.split(' ')
-    flags = {'next_move': fields[0], 'halfmove_clock': int(fields[3]), 'move_number': int(fields[4]),
-             'repetition_ct': 0,
-             'ep_target': None if fields[2] == '-' else square_to_coords(fields[2])}
-    if fields[1] != '-':
-        if 'k' in fields[1]:
-            flags['bk'] = True
-        if 'q' in fields[1]:
-            flags['bq'] = True
-        if 'K' in fields[1]:
-            flags['wk'] = True
-        if 'Q' in fields[1]:
-            flags['wq'] = True
-
-    resultingGameboard = GameBoard({}, flags)
-    resultingGameboard.set_all_squares(coordinates)
-    return resultingGameboard
-
-def square_to_coords(square_string):
-    """Takes a square as a string, like 'A1', and returns in-board coordinates"""
-    x_coord = FILES.index(square_string[0])
-    y_coord = RANKS.index(square_string[1])
-    return (x_coord, y_coord)
-
-def coords_to_square(coord):
-    """Goes coordinates (W.r.t. 'A1' square) into a string representing the square"""
-    x_coord, y_coord = coord
-    return FILES[x_coord] + RANKS[y_coord]
-
-def is_light(coord):
-    x,y = coord
-    return ((x+y) % 2 == 1)
-
-def flip_coordinates(coord):
-    """Flips in-board coordinates between white and black representations"""
-    x,y = coord
-    return (7-x, 7-y)
-
 def convert_coords(board_coords):
     """Takes in-board coordinates WRT 'A1' square, and outputs coordinates to be used in
     images (With respect to origin at top left corner"""
@@ -109,78 +69,6 @@ def convert_coords(board_coords):
     return (x_image, y_image)
 
 
-class GameBoard:
-    def __init__(self, piece_positions, flags):
-        piece_coordinates = {}
-        for piece_code in piece_positions:
-            for coordinate in piece_positions[piece_code]:
-                piece_coordinates[coordinate] = piece_code
-        self.all_squares = {(x,y): piece_coordinates.get((x,y), "")
-                             for x in range(BOARD_DIMENSIONS) for y in range(BOARD_DIMENSIONS)}
-        self.flags = copy.deepcopy(flags)
-        """flags should be a dictionary, with (potential) keys of each side castling kingside or queenside,
-         threefold repetition counter, whose move it is, halfmove clock (for 50 move rule) and turn counter"""
-
-    def can_castle(self, option):
-        """Takes colour (w or b) and side (k or q) and returns whether castling that way is permitted"""
-        return self.flags.get(option, False)
-
-    def whose_move(self):
-        return self.flags["next_move"]
-
-    def update_move_counters(self):
-        if self.flags["next_move"] == 'b':
-            self.flags["next_move"] = 'w'
-            self.flags['move_number'] += 1
-        else:
-            self.flags["next_move"] = 'b'
-
-    def update_halfmove_clock(self, from_coord, to_coord):
-        if self.all_squares[to_coord] or self.all_squares[from_coord][1] == 'P':
-            self.flags['halfmove_clock'] = 0
-        else:
-            self.flags['halfmove_clock'] = self.flags['halfmove_clock'] + 1
-
-    def make_move(self, from_coord, to_coord):
-        self.all_squares[to_coord] = self.all_squares[from_coord]
-        self.all_squares[from_coord] = ''
-
-    def set_all_squares(self, new_square_set):
-        self.all_squares = new_square_set
-
-    def make_fen(self):
-        ep_square = coords_to_square(self.flags['ep_target']) if self.flags['ep_target'] else '-'
-        if any({self.can_castle(option) for option in ['wk','wq','bk','bq']}):
-            castling_string = ''.join([(op[1].upper() if op[0]=='w' else op[1]) if self.can_castle(op)
-                                       else '' for op in ['wk','wq','bk','bq']])
-        else:
-            castling_string = '-'
-        extra_descriptors = ' '.join([self.flags['next_move'], castling_string, ep_square,
-                                      str(self.flags['halfmove_clock']), str(self.flags['move_number'])])
-
-        piece_chars = []
-        empty_counter = 0
-        for row in range(7,-1,-1):
-            for col in range(8):
-                piece = self.all_squares[(col, row)]
-                if piece:
-                    if empty_counter == 0:
-                        piece_chars.append(REVERSED_CORRESPONDENCES[piece])
-                    else:
-                        piece_chars.append(str(empty_counter))
-                        piece_chars.append(REVERSED_CORRESPONDENCES[piece])
-                        empty_counter = 0
-                else:
-                    empty_counter += 1
-            if empty_counter != 0:
-                piece_chars.append(str(empty_counter))
-            empty_counter = 0
-            piece_chars.append('/')
-        piece_string = ''.join(piece_chars[:-1])
-
-        return piece_string + ' ' + extra_descriptors
-
-
 class CanvasFrame(Frame):
     def __init__(self, parent, width, height):
         super(CanvasFrame, self).__init__(parent, borderwidth=0, highlightthickness=0)
@@ -199,64 +87,99 @@ class DisplayBoard(CanvasFrame):
     def __init__(self, parent, board_state, images):
         super(DisplayBoard, self).__init__(parent, BOARD_SIZE, BOARD_SIZE)
         self.parent_frame = parent
-        self.board_state = board_state  # Dictionary of coordinates -> pieces, changed when flipped
-        self.square_buttons = {}
+        self.board_state = bytearray(board_state)  # Piece codes by coords_to_index, unchanged when flipped
+        self.square_buttons = {}  # Keyed by where the button sits on screen, as if white is at the bottom
+        self.shown_pieces = bytearray(NOT_SHOWN * BOARD_DIMENSIONS * BOARD_DIMENSIONS)  # Piece on each button
         self.IMAGES = images
         self.is_flipped = False
-        for coord in self.board_state:
-            theButton = Button(root, width = SQ_SIZE - 2, height = SQ_SIZE - 2, bd = 1)
+        self.on_flip = None  # Called after the board is flipped
+        self.render_count = 0
+        self.squares_touched = 0  # Buttons reconfigured by the most recent render
+        self.total_squares_touched = 0
+        self.create_squares()
+
+    def create_squares(self):
+        """Creates a Button for each square and embeds it in the canvas"""
+        for coord in ALL_COORDS:
+            theButton = Button(self.winfo_toplevel(), width = SQ_SIZE - 2, height = SQ_SIZE - 2, bd = 1)
             self.square_buttons[coord] = theButton
             x_board, y_board = convert_coords(coord)
             self.add(self.square_buttons[coord], x_board, y_board)
 
+    def bind_squares(self, callback):
+        """Makes clicking a square call callback with the on-screen coordinates of that square"""
+        for coord in self.square_buttons:
+            self.square_buttons[coord].config(command = delayed(callback, coord))
+
+    def set_squares_state(self, state_to_config):
+        for coord in self.square_buttons:
+            self.square_buttons[coord].config(state=state_to_config)
+
     def filename(self, coordinate):
-        """Examines coordinates in the square_state dictionary and returns appropriate filename
+        """Examines coordinates in the board_state array and returns appropriate filename
         which will access the image relating to that square"""
         light_or_dark = ('light' if is_light(coordinate) else 'dark')
-        square_contents = self.board_state[coordinate]
+        square_contents = self.board_state[coords_to_index(coordinate)]
         if square_contents:
-            return square_contents + '-' + light_or_dark
+            return CODE_TO_PIECE[square_contents] + '-' + light_or_dark
         else:
             return light_or_dark
 
+    @timed('config_image')
     def config_image(self, coord):
-        """Puts the required image into the button at the required coordinate"""
+        """Puts the required image into the button showing the square at the required coordinate"""
         image_code = self.filename(coord)
-        self.square_buttons[coord].config(image=self.IMAGES[image_code])
-
+        screen_coord = self.get_flipped_coordinates(coord)
+        self.square_buttons[screen_coord].config(image=self.IMAGES[image_code])
+        self.shown_pieces[coords_to_index(screen_coord)] = self.board_state[coords_to_index(coord)]
+
+    @timed('render')
+    def render(self):
+        """Brings the buttons up to date with board_state, only reconfiguring buttons whose piece changed"""
+        board_state = self.board_state
+        shown_pieces = self.shown_pieces
+        touched = 0
+        for index in range(BOARD_DIMENSIONS * BOARD_DIMENSIONS):
+            if shown_pieces[63 - index if self.is_flipped else index] != board_state[index]:
+                self.config_image(index_to_coords(index))
+                touched += 1
+        self.render_count += 1
+        self.squares_touched = touched
+        self.total_squares_touched += touched
+
+    @timed('load_all_images')
     def load_all_images(self):
         """Loads all images"""
-        for coord in self.board_state:
-            self.config_image(coord)
+        self.shown_pieces = bytearray(NOT_SHOWN * BOARD_DIMENSIONS * BOARD_DIMENSIONS)
+        self.render()
 
+    @timed('flip_board')
     def flip_board(self):
-        self.board_state = {flip_coordinates(coord): self.board_state[coord] for coord in self.board_state}
-        self.load_all_images()
         self.is_flipped = not self.is_flipped
-        flip_resign()
+        self.render()
+        if self.on_flip:
+            self.on_flip()
 
     def get_flipped_coordinates(self, coord):
         """Takes in 'True' coordinates within the board (Such as (0,0) for 'A1' square)
-        , and returns coordinates to be used on the
-        board state to account for flipping"""
+        , and returns the on-screen coordinates of that square to account for flipping.
+        Flipping is its own inverse, so this also turns on-screen coordinates into true ones"""
         return flip_coordinates(coord) if self.is_flipped else coord
 
     def load_new_base(self, state_to_load):
-        """Loads in a state to the .board_state attribute and reconfigures the images."""
-        self.board_state = copy.deepcopy(state_to_load)
-        self.load_all_images()
+        """Loads in a state to the .board_state attribute and reconfigures the images that changed."""
+        self.board_state = bytearray(state_to_load)
+        self.render()
 
 
 class InteractiveBoard(DisplayBoard):
     """Board that can be interacted with via piece movements"""
     def __init__(self, parent, game_state, images):
-        super(InteractiveBoard, self).__init__(parent,
-                                               copy.deepcopy(game_state.all_squares), images)
+        super(InteractiveBoard, self).__init__(parent, game_state.squares, images)
         self.game_state = game_state # A GameBoard object, unchanged when we flip
+        self.legal_moves = legal_moves(game_state)
 
-        for coord in self.square_buttons:
-            self.square_buttons[coord].config(
-                command = delayed(self.drag_drop, coord)) # The buttons link to their squares
+        self.bind_squares(self.drag_drop) # The squares link to their coordinates
 
         self.selected_square = None
         self.move_made = ''
@@ -268,87 +191,127 @@ class InteractiveBoard(DisplayBoard):
             'bk' : Button(parent, text="O-O", bg = "#000000", fg="#ffffff"),
             'bq' : Button(parent, text="O-O-O", bg = "#000000", fg="#ffffff")
         }
-        self.can_claim_draw = False # Currently no threefold repetition detection.
+        self.can_claim_draw = False
         self.Claim_Draw = Button(parent, command = self.draw_game)
+        self.outcome_label = None  # Label that shows how the game ended
+        self.auto_adjudicate = False  # End the game at claimable draws, and when adjudicate says so
+        self.adjudicate = None  # Called with the game state after each move, returns outcome text to end the game with or None
+
+    def show_outcome(self, outcome_text):
+        if self.outcome_label:
+            self.outcome_label.config(text = outcome_text)
 
     def draw_game(self):
         draw_text = "D" + self.Claim_Draw.cget('text')[7:]
-        GameOutcome.config(text = draw_text)
+        self.show_outcome(draw_text)
         self.activate_or_deactivate(DISABLED)
 
 
     def activate_or_deactivate(self, state_to_config):
-        for coord in self.square_buttons:
-            self.square_buttons[coord].config(state=state_to_config)
+        self.set_squares_state(state_to_config)
         for option in self.Castles_Buttons:
             self.Castles_Buttons[option].config(state=state_to_config)
 
-    def drag_drop(self, coord):
+    @timed('drag_drop')
+    def drag_drop(self, screen_coord):
+        coord = self.get_flipped_coordinates(screen_coord)
         if self.selected_square is None:
-            if self.board_state[coord]:
-                if self.board_state[coord][0] == self.game_state.whose_move():
+            piece = self.board_state[coords_to_index(coord)]
+            if piece:
+                if CODE_TO_PIECE[piece][0] == self.game_state.whose_move():
                     self.selected_square = coord
                     return
             self.selected_square = None
         else:
-            if not self.invalid_move(coord):
-                self.game_state.update_halfmove_clock(self.selected_square, coord)
-                self.move(self.selected_square, coord)
-                self.move_made = coords_to_square(self.get_flipped_coordinates(self.selected_square))\
-                                 + coords_to_square(self.get_flipped_coordinates(coord))
+            legal_move = self.find_legal_move(self.selected_square, coord)
+            if legal_move is not None:
+                self.move(legal_move)
+                self.move_made = move_to_uci(legal_move)
                 self.finish_turn()
             self.selected_square = None
 
-    def invalid_move(self, coord):
-        if self.selected_square == coord:
-            return True
-        else:
-            if self.board_state[coord]:
-                return self.board_state[coord][0] == self.board_state[self.selected_square][0]
-        return False
-
-    def move(self, from_coord, to_coord):
-        pc = self.board_state[from_coord]
-        self.board_state[to_coord] = pc
-        self.config_image(to_coord)
-        self.board_state[from_coord] = ''
-        self.config_image(from_coord)
-        self.game_state.make_move(from_coord, to_coord)
+    def find_legal_move(self, from_coord, to_coord):
+        """Returns the legal move between two squares, or None if there isn't one.
+        Pawns reaching the last rank are promoted to a queen."""
+        from_idx = coords_to_index(from_coord)
+        to_idx = coords_to_index(to_coord)
+        for legal_move in self.legal_moves:
+            if move_from(legal_move) == from_idx and move_to(legal_move) == to_idx \
+                    and move_promotion(legal_move) in (0, QUEEN):
+                return legal_move
+        return None
+
+    @timed('move')
+    def move(self, legal_move):
+        """Plays a legal move on the game state and redraws the squares it changed"""
+        apply_move(self.game_state, legal_move)
+        self.board_state = bytearray(self.game_state.squares)
+        self.render()
 
     def finish_turn(self):
         draw_last_turn = self.can_claim_draw
-        self.game_state.update_move_counters()
-        draw_next_turn = self.game_state.flags['repetition_ct'] > 2 or self.game_state.flags['halfmove_clock'] >= 100
+        with TIMINGS.stage('legal_moves'):
+            self.legal_moves = legal_moves(self.game_state)
+        self.game_state.flags['repetition_ct'] = self.count_repetitions()
+        outcome = game_outcome(self.game_state, self.legal_moves)
+        game_over = outcome is not None and (outcome[1] not in CLAIMABLE_DRAWS or self.auto_adjudicate)
+        draw_next_turn = outcome is not None and not game_over
         self.MoveWidget.config(bg = "#FFFFFF" if self.game_state.whose_move() == 'w' else "#000000")
         self.enable_castles_if_allowed()
-        if not draw_last_turn:
-            if draw_next_turn:
+        if draw_next_turn:
+            if not draw_last_turn:
                 self.Claim_Draw.grid(row=0, column=2)
-                self.Claim_Draw.config(text = f"Claim draw by {'repetition' if self.game_state.flags['repetition_ct'] > 2 else '50 move rule'}")
-        else:
-            if not draw_next_turn:
-                self.Claim_Draw.grid_forget()
+            self.Claim_Draw.config(text = f"Claim draw by {outcome[1]}")
+        elif draw_last_turn:
+            self.Claim_Draw.grid_forget()
         self.can_claim_draw = draw_next_turn
+        if game_over:
+            self.end_game(outcome)
+        elif self.adjudicate and self.auto_adjudicate:
+            outcome_text = self.adjudicate(self.game_state)
+            if outcome_text:
+                self.show_outcome(outcome_text)
+                self.activate_or_deactivate(DISABLED)
+
+    def end_game(self, outcome):
+        """Shows the result, a (result, reason) pair from game_outcome"""
+        result, reason = outcome
+        if result == '1/2-1/2':
+            self.show_outcome(f"Draw by {reason}")
+        else:
+            self.show_outcome(f"{'White' if result == '1-0' else 'Black'} wins by {reason}")
+        self.activate_or_deactivate(DISABLED)
 
+    def count_repetitions(self):
+        """How many times the position after the move has occurred, including now. A plain
+        InteractiveBoard keeps no history, so this leaves the counter as it is."""
+        return self.game_state.flags['repetition_ct']
+
+    def play_uci_move(self, move_text):
+        """Plays a move given in coordinate notation, as engines give them, if it is legal here.
+        Returns whether it was played."""
+        for legal_move in self.legal_moves:
+            if move_to_uci(legal_move) == move_text:
+                self.move(legal_move)
+                self.move_made = move_text
+                self.finish_turn()
+                return True
+        return False
+
+    @timed('castle')
     def castle(self, option):
         """Option should be a colour followed by a side. Performs the castling operation on the board"""
-        rank = 0 if option[0]=='w' else 7
-        rook_position, king_target, rook_target = (0, 2, 3) if option[1] == 'q' else (7, 6, 5)
-        king_from_coords = self.get_flipped_coordinates((4, rank))
-        rook_from_coords = self.get_flipped_coordinates((rook_position, rank))
-        king_to_coords = self.get_flipped_coordinates((king_target, rank))
-        rook_to_coords = self.get_flipped_coordinates((rook_target, rank))
-        self.move(king_from_coords, king_to_coords)
-        self.move(rook_from_coords, rook_to_coords)
-        for side in ['k','q']:
-            self.game_state.flags.pop(option[0] + side, None)
+        self.move(self.castling_move(option))
         self.move_made = 'O-O' if option[1] == 'k' else 'O-O-O'
         self.finish_turn()
-        self.game_state.flags['halfmove_clock'] += 1
+
+    def castling_move(self, option):
+        king_from, king_to = CASTLING_MOVES[option][:2]
+        return encode_move(king_from, king_to)
 
     def enable_castles_if_allowed(self):
         for option in self.Castles_Buttons:
-            if option[0] == self.game_state.whose_move() and self.game_state.can_castle(option):
+            if self.castling_move(option) in self.legal_moves:
                 self.Castles_Buttons[option].config(state=NORMAL)
             else:
                 self.Castles_Buttons[option].config(state=DISABLED)
@@ -361,22 +324,153 @@ class InteractiveBoard(DisplayBoard):
 
     def load_in(self, board_to_load):  # Make sure a new board is created when you pass it in to be loaded
         self.game_state = board_to_load
-        self.load_new_base(copy.deepcopy(board_to_load.all_squares))
-        self.selected_square = None
+        self.legal_moves = legal_moves(board_to_load)
         self.is_flipped = False
+        self.load_new_base(board_to_load.squares)
+        self.selected_square = None
         self.MoveWidget.config(bg="#FFFFFF" if self.game_state.whose_move() == 'w' else "#000000")
         self.enable_castles_if_allowed()
 
 
+class MoveList(Frame):
+    """The moves of the game, a full move to a row. Only the rows in view are drawn, on a fixed set of
+    canvas items, so adding a move, cutting the list short, scrolling and moving the highlight cost
+    the same however long the game is. The move leading to the position shown is highlighted, and
+    clicking a move calls on_select with the number of plies up to and including it."""
+    def __init__(self, parent, on_select=None):
+        super(MoveList, self).__init__(parent)
+        self.canvas = Canvas(self, width=MOVE_LIST_WIDTH, height=MOVE_LIST_ROWS * MOVE_LIST_ROW_HEIGHT,
+                             bg='#FFFFFF', highlightthickness=0)
+        self.scrollbar = Scrollbar(self, command=self.yview)
+        self.canvas.pack(side=LEFT)
+        self.scrollbar.pack(side=RIGHT, fill=Y)
+        self.on_select = on_select
+        self.moves = []  # Text of each ply
+        self.offset = 0  # 1 when Black moved first, leaving the first White cell empty
+        self.top_row = 0  # First row in view
+        self.current_ply = 0
+        self.highlight = self.canvas.create_rectangle(0, 0, 0, 0, fill=CURRENT_MOVE_COLOUR, outline='')
+        self.row_items = [tuple(self.canvas.create_text(x, slot * MOVE_LIST_ROW_HEIGHT + MOVE_LIST_ROW_HEIGHT // 2,
+                                                        anchor=W, text='') for x in MOVE_LIST_COLUMNS)
+                          for slot in range(MOVE_LIST_ROWS)]
+        self.canvas.bind('<Button-1>', self.click)
+        self.canvas.bind('<MouseWheel>', lambda event: self.yview('scroll', -1 if event.delta > 0 else 1, 'units'))
+        self.canvas.bind('<Button-4>', lambda event: self.yview('scroll', -1, 'units'))
+        self.canvas.bind('<Button-5>', lambda event: self.yview('scroll', 1, 'units'))
+
+    def row_count(self):
+        return (len(self.moves) + self.offset + 1) // 2
+
+    def last_top_row(self):
+        return max(0, self.row_count() - MOVE_LIST_ROWS)
+
+    def cell(self, ply):
+        """(row, column) of a ply, counting from 1, with White's moves in column 0"""
+        return divmod(ply - 1 + self.offset, 2)
+
+    def reset(self, white_first=True):
+        self.moves = []
+        self.offset = 0 if white_first else 1
+        self.top_row = 0
+        self.current_ply = 0
+        self.redraw()
+
+    def extend(self, move_texts):
+        """Adds many moves, redrawing once"""
+        self.moves.extend(move_texts)
+        self.top_row = self.last_top_row()
+        self.redraw()
+
+    def append(self, move_text):
+        following = self.top_row >= self.last_top_row()
+        self.moves.append(move_text)
+        row = self.cell(len(self.moves))[0]
+        if following and row >= self.top_row + MOVE_LIST_ROWS:
+            self.top_row = self.last_top_row()
+            self.redraw()
+        else:
+            if row < self.top_row + MOVE_LIST_ROWS:
+                self.draw_row(row)
+            self.update_scrollbar()
+
+    def truncate(self, length):
+        """Keeps only the first length plies"""
+        del self.moves[length:]
+        self.current_ply = min(self.current_ply, length)
+        self.top_row = min(self.top_row, self.last_top_row())
+        self.redraw()
+
+    def set_current(self, ply):
+        """Highlights the ply, scrolling to it if it is out of view. 0 highlights nothing."""
+        self.current_ply = ply
+        row = self.cell(ply)[0] if ply else 0
+        if not self.top_row <= row < self.top_row + MOVE_LIST_ROWS:
+            self.top_row = min(max(0, row - MOVE_LIST_ROWS // 2), self.last_top_row())
+            self.redraw()
+        else:
+            self.place_highlight()
+
+    def draw_row(self, row):
+        number_item, white_item, black_item = self.row_items[row - self.top_row]
+        in_list = row < self.row_count()
+        self.canvas.itemconfig(number_item, text=f"{row + 1}." if in_list else '')
+        for column, item in ((0, white_item), (1, black_item)):
+            ply = 2 * row + column - self.offset + 1
+            if 1 <= ply <= len(self.moves):
+                text = self.moves[ply - 1]
+            else:
+                text = '...' if ply == 0 and in_list else ''
+            self.canvas.itemconfig(item, text=text)
+
+    def redraw(self):
+        for row in range(self.top_row, self.top_row + MOVE_LIST_ROWS):
+            self.draw_row(row)
+        self.place_highlight()
+        self.update_scrollbar()
+
+    def place_highlight(self):
+        row, column = self.cell(self.current_ply)
+        slot = row - self.top_row
+        if self.current_ply and 0 <= slot < MOVE_LIST_ROWS:
+            x = MOVE_LIST_COLUMNS[column + 1] - 4
+            self.canvas.coords(self.highlight, x, slot * MOVE_LIST_ROW_HEIGHT, x + 96,
+                               (slot + 1) * MOVE_LIST_ROW_HEIGHT)
+        else:
+            self.canvas.coords(self.highlight, 0, 0, 0, 0)
+
+    def update_scrollbar(self):
+        rows = max(self.row_count(), 1)
+        self.scrollbar.set(self.top_row / rows, min(1.0, (self.top_row + MOVE_LIST_ROWS) / rows))
+
+    def yview(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units' or 'pages')"""
+        if args[0] == 'moveto':
+            top_row = int(float(args[1]) * self.row_count())
+        elif args[0] == 'scroll':
+            top_row = self.top_row + int(args[1]) * (MOVE_LIST_ROWS if args[2] == 'pages' else 1)
+        else:
+            return
+        top_row = min(max(top_row, 0), self.last_top_row())
+        if top_row != self.top_row:
+            self.top_row = top_row
+            self.redraw()
+
+    def click(self, event):
+        row = self.top_row + int(self.canvas.canvasy(event.y)) // MOVE_LIST_ROW_HEIGHT
+        x = self.canvas.canvasx(event.x)
+        if x < MOVE_LIST_COLUMNS[1]:
+            return
+        ply = 2 * row + (1 if x >= MOVE_LIST_COLUMNS[2] else 0) - self.offset + 1
+        if 1 <= ply <= len(self.moves) and self.on_select:
+            self.on_select(ply)
+
+
 class HistoryBoard(InteractiveBoard):
     """Board that allows you to scroll through moves already made"""
     def __init__(self, parent, game_state, images):
         super(HistoryBoard, self).__init__(parent, game_state, images)
         self.analysis_mode = False
-        self.starting_fen = self.game_state.make_fen()
-        self.starting_repetition_ct = self.game_state.flags['repetition_ct']
-        self.starting_halfmove_clk = self.game_state.flags['halfmove_clock']
-        self.board_history = [(copy.deepcopy(self.game_state.all_squares), copy.deepcopy(self.game_state.flags))] # This will store the piece positions that will be loaded
+        self.history = GameTree(self.game_state) # Every line played; the one shown is loaded from it
         self.current_idx = 0 # Index of the current_game
         self.Movement_Buttons = { 'start': Button(parent, text='<<', state=DISABLED, command=self.start),
                                   'back': Button(parent, text='<', state=DISABLED, command = self.backwards),
@@ -386,74 +480,60 @@ class HistoryBoard(InteractiveBoard):
         self.Movement_Buttons['back'].grid(row=1, column=5)
         self.Movement_Buttons['next'].grid(row=1, column=6)
         self.Movement_Buttons['latest'].grid(row=1, column=7)
+        self.Variation_Button = Button(parent, text='Line 1/1', state=DISABLED, command=self.next_variation)
+        self.Variation_Button.grid(row=1, column=8)
         self.starting_colour = self.game_state.flags['next_move']
-        self.moves_made = []
-        self.scrolly = Scrollbar(root)
-        self.scrolly.grid(row=1, column=3)
-        self.displayer = Text(root, yscrollcommand = self.scrolly.set, width = 40)
-        self.scrolly.config(command = self.displayer.yview)
-        self.displayer.grid(row=1, column = 2)
-        self.displayer.insert("end", "1." if self.starting_colour == 'w' else "1...")
-        self.gamestring = []
+        self.move_list = MoveList(self.winfo_toplevel(), on_select=self.go_to)
+        self.move_list.grid(row=1, column=2, columnspan=2)
+        self.move_list.reset(self.starting_colour == 'w')
+        self.on_position_change = None  # Called when the position shown changes
 
+    @timed('process_move_text')
     def process_move_text(self):
-        recent_move = self.moves_made[-1]
-        num_halfturns = len(self.moves_made)
-        next_colour = self.game_state.flags['next_move'] # Make sure do this after updating the flags
-        if next_colour == 'b':
-            self.gamestring.append(recent_move)
-            self.displayer.insert("end", ' ' + recent_move + ' ')
-        else:
-            turn_number = (num_halfturns + 3) // 2
-            display_text = recent_move + ' ' + str(turn_number) + '. '
-            self.gamestring.append(recent_move + ' ' + str(turn_number) + '.')
-            self.displayer.insert("end", display_text)
+        """Adds the latest move to the move list and highlights it"""
+        self.move_list.append(self.history.moves_made[-1])
+        self.move_list.set_current(self.current_idx)
 
     def reset_text(self):
-        self.displayer.delete('1.0', 'end')
-        self.displayer.insert("end", "1." if self.starting_colour == 'w' else "1...")
+        self.move_list.reset(self.starting_colour == 'w')
 
+    @timed('update_game_course')
     def update_game_course(self):
-        self.board_history = self.board_history[:self.current_idx]
-        self.moves_made = self.moves_made[:self.current_idx - 1]
-        self.gamestring = self.gamestring[:self.current_idx - 1]
-        self.displayer.delete('1.0', 'end')
-        self.displayer.insert("end", "1. " if self.starting_colour == 'w' else "1... ")
-        self.displayer.insert("end", ' '.join(self.gamestring))
+        """Ends the line shown at the current position, so the next move starts a variation. The old
+        continuation stays in the history, a click of the variation button away."""
+        self.history.cut(self.current_idx)
+        self.move_list.truncate(self.current_idx - 1)
+
+    @timed('count_repetitions')
+    def count_repetitions(self):
+        return self.history.count_repetitions(self.game_state)
 
+    @timed('finish_turn')
     def finish_turn(self):
-        current_piece_position = copy.deepcopy(self.game_state.all_squares)
-        self.game_state.flags['repetition_ct'] = self.board_history.count(current_piece_position)
-        super().finish_turn()
-        current_flags = copy.deepcopy(self.game_state.flags)
         self.current_idx += 1
-        if self.current_idx != len(self.board_history):
-            if current_piece_position != self.board_history[self.current_idx][0]:
-                self.update_game_course()
-        self.moves_made.append(self.move_made)
-        self.process_move_text()
-        self.board_history.append((current_piece_position, current_flags))
-        if len(self.board_history) == 2:
-            self.Movement_Buttons['start'].config(state=NORMAL)
-            self.Movement_Buttons['back'].config(state=NORMAL)
-
-
+        if self.current_idx != len(self.history):
+            self.update_game_course()  # Drop the old continuation before counting repetitions
+        super().finish_turn()
+        with TIMINGS.stage('history.append'):
+            plies_added = self.history.append(self.game_state, self.move_made)
+        if plies_added == 1:
+            self.process_move_text()
+        else:  # The move was tried before, and the line goes on the way it went then
+            self.move_list.extend(self.history.moves_made[self.current_idx - 1:])
+            self.move_list.set_current(self.current_idx)
+        self.update_movement_buttons(self.current_idx)
+        if self.on_position_change:
+            self.on_position_change()
+
+
+    @timed('load_in_position')
     def load_in_position(self, index):
         if self.analysis_mode:
-            if index == 0:
-                starting_board = fen_to_gameboard(self.starting_fen)
-                piece_state = starting_board.all_squares
-                flag_state = starting_board.flags
-                flag_state.update({'repetition_ct': self.starting_repetition_ct, 'halfmove_clock': self.starting_halfmove_clk})
-            else:
-                piece_state, flag_state = self.board_history[index]
-            self.game_state = GameBoard({}, flag_state)
-            self.game_state.set_all_squares(piece_state)
-            self.board_state = piece_state
+            self.game_state = self.history.position(index)
+            self.legal_moves = legal_moves(self.game_state)
+            self.board_state = bytearray(self.game_state.squares)
             self.selected_square = None
-            if self.is_flipped:
-                self.flip_board()
-            self.load_all_images()
+            self.render()
             self.enable_castles_if_allowed()
             if index % 2 == 0:
                 self.MoveWidget.config(bg="#FFFFFF" if self.starting_colour == 'w' else "#000000")
@@ -462,11 +542,9 @@ class HistoryBoard(InteractiveBoard):
 
             self.current_idx = index
         else:
-            self.board_state = self.board_history[index][0]
-            if self.is_flipped:
-                self.flip_board()
-            self.load_all_images()
-            if index != len(self.board_history) - 1:
+            self.board_state = bytearray(self.history.squares_at(index))
+            self.render()
+            if index != len(self.history) - 1:
                 self.activate_or_deactivate('disabled')
             else:
                 self.activate_or_deactivate(NORMAL)
@@ -477,6 +555,9 @@ class HistoryBoard(InteractiveBoard):
                 self.MoveWidget.config(bg="#000000" if self.starting_colour == 'w' else "#FFFFFF")
 
             self.current_idx = index
+        self.move_list.set_current(index)
+        if self.on_position_change:
+            self.on_position_change()
 
 
     def update_movement_buttons(self, index):
@@ -487,17 +568,31 @@ class HistoryBoard(InteractiveBoard):
                 else:
                     self.Movement_Buttons[option].config(state=NORMAL)
             else:
-                if index == len(self.board_history) - 1:
+                if index == len(self.history) - 1:
                     self.Movement_Buttons[option].config(state=DISABLED)
                 else:
                     self.Movement_Buttons[option].config(state=NORMAL)
+        moves, selected = self.history.variations(index)
+        if len(moves) > 1:
+            self.Variation_Button.config(state=NORMAL, text=f"Line {selected + 1}/{len(moves)}")
+        else:
+            self.Variation_Button.config(state=DISABLED, text='Line 1/1')
+
+    def next_variation(self):
+        """Switches the line shown after the current position to the next move tried from it"""
+        moves, selected = self.history.variations(self.current_idx)
+        self.history.select(self.current_idx, (selected + 1) % len(moves))
+        self.move_list.truncate(self.current_idx)
+        self.move_list.extend(self.history.moves_made[self.current_idx:])
+        self.move_list.set_current(self.current_idx)
+        self.update_movement_buttons(self.current_idx)
 
     def start(self):
         self.load_in_position(0)
         self.update_movement_buttons(0)
 
     def end(self):
-        last_idx = len(self.board_history) - 1
+        last_idx = len(self.history) - 1
         self.load_in_position(last_idx)
         self.update_movement_buttons(last_idx)
 
@@ -511,139 +606,714 @@ class HistoryBoard(InteractiveBoard):
         self.load_in_position(load_idx)
         self.update_movement_buttons(load_idx)
 
+    def go_to(self, index):
+        """Shows the position after index plies, as when a move in the move list is clicked"""
+        self.load_in_position(index)
+        self.update_movement_buttons(index)
+
     def load_in(self, board_to_load):
         super().load_in(board_to_load)
         self.starting_colour = self.game_state.flags['next_move']
-        self.board_history = [(copy.deepcopy(self.game_state.all_squares), copy.deepcopy(self.game_state.all_squares))]
+        self.history = GameTree(self.game_state)
         self.current_idx = 0
-        self.moves_made = []
-
-
-root = Tk()
-root.title("M Chess")
-
-PIECE_IMAGES = {pc : ImageTk.PhotoImage(Image.open(f"BoardImages/{pc}.png").resize((SQ_SIZE-2,SQ_SIZE-2)))
-                for pc in IMAGE_CODES}
-
-StartingGameboard = GameBoard(STARTING_COORDS, STARTING_FLAGS)
-
-GameOutcome = Label(root)
-GameOutcome.grid(row=0, column = 0)
-
-def reset_game():
-    GameOutcome.config(text='')
-    mainBoard.activate_or_deactivate(NORMAL)
-    mainBoard.reset_text()
-    flip_resign()
-
-BoardAndOptions = Frame(root)
-BoardAndOptions.grid(row=1)
-
-mainBoard = HistoryBoard(BoardAndOptions, StartingGameboard, PIECE_IMAGES)
-mainBoard.grid(row=2, column = 0, rowspan = 8, columnspan = 8)
-
-mainBoard.MoveWidget.grid(row=0, column = 8)
-
-def resign_game():
-    resign_text = f"{'White' if mainBoard.is_flipped else 'Black'} wins by resignation"
-    mainBoard.activate_or_deactivate(DISABLED)
-    GameOutcome.config(text = resign_text)
-
-def draw_gme(reason):
-    draw_text = "D" + reason[7:]
-    mainBoard.activate_or_deactivate(DISABLED)
-    GameOutcome.config(text = draw_text)
-
-ResignButton = Button(BoardAndOptions, text='Resign', command=resign_game, bg='#FFFFFF')
-ResignButton.grid(row=0, column=0)
-
-
-def flip_resign():
-    if mainBoard.is_flipped:
-        ResignButton.config(bg='#000000', fg='#FFFFFF')
-    else:
-        ResignButton.config(bg='#FFFFFF', fg='#000000')
-
-mainMenu = Menu(root)
-
-def new_game():
-    fenBoard = fen_to_gameboard(STARTING_FEN)
-    mainBoard.load_in(fenBoard)
-    reset_game()
-
-def save_position():
-    newWindow = Tk()
-    newWindow.geometry("600x100")
-    newWindow.title('Save Position')
-    fenLabel = Label(newWindow, text='FEN')
-    fenLabel.pack()
-    fen_text = mainBoard.game_state.make_fen()
-    fenReturn = StringVar(newWindow, value = fen_text)
-    fenContainer = Entry(newWindow, textvariable = fenReturn, width=75)
-    fenContainer.pack()
-    exitButton = Button(newWindow, text="Done", command=newWindow.destroy)
-    exitButton.pack()
-
-    newWindow.mainloop()
-
-def load_position():
-    newWindow = Tk()
-    newWindow.geometry("600x100")
-    newWindow.title('Load Position')
-    fenLabel = Label(newWindow, text='FEN')
-    fenLabel.pack()
-    fenContainer = Entry(newWindow, width=75)
-    fenContainer.pack()
-
-    def get_and_go():
-        fen_text = fenContainer.get()
-        fenBoard = fen_to_gameboard(fen_text)
-        reset_game()
-        mainBoard.load_in(fenBoard)
-        newWindow.destroy()
-
-    exitButton = Button(newWindow, text="Load", command=get_and_go)
-    exitButton.pack()
-
-    newWindow.mainloop()
-
-
-fileMenu = Menu(mainMenu, tearoff=0)
-
-fileMenu.add_command(label="New Game", command = new_game)
-fileMenu.add_separator()
-fileMenu.add_command(label="Load Position...", command=load_position)
-fileMenu.add_command(label = "Load Game...")
-fileMenu.add_separator()
-fileMenu.add_command(label = "Save Position...", command=save_position)
-fileMenu.add_command(label = "Save Game...")
-
-mainMenu.add_cascade(label="File", menu = fileMenu)
-
-def game_mode():
-    mainBoard.analysis_mode = False
-
-def analysis_mode():
-    mainBoard.analysis_mode = True
-
-modeMenu = Menu(mainMenu, tearoff=0)
-modeMenu.add_command(label="Analysis mode", command = analysis_mode)
-modeMenu.add_command(label="Game mode", command = game_mode)
-mainMenu.add_cascade(label = "Mode", menu=modeMenu)
-
-mainMenu.add_command(label="Flip", command=mainBoard.flip_board)
-
-mainMenu.add_command(label="Exit", command=root.destroy)
-
-root.config(menu=mainMenu)
-
-
-mainBoard.Castles_Buttons['wk'].grid(row = 10, column = 0)
-mainBoard.Castles_Buttons['wq'].grid(row = 10, column = 2)
-mainBoard.Castles_Buttons['bk'].grid(row = 10, column = 4)
-mainBoard.Castles_Buttons['bq'].grid(row = 10, column = 6)
-
-mainBoard.initialize()
-
-root.mainloop()
+        if self.on_position_change:
+            self.on_position_change()
+
+    @timed('load_history')
+    def load_history(self, history):
+        """Shows a recorded game (a GameHistory) at its last position, with all of its moves to go through"""
+        last_idx = len(history) - 1
+        self.load_in(history.position(last_idx))
+        self.history = GameTree.from_history(history)
+        self.starting_colour = history.position(0).flags['next_move']
+        self.reset_text()
+        self.move_list.extend(history.moves_made)
+        self.load_in_position(last_idx)
+        self.update_movement_buttons(last_idx)
 
+    @timed('load_tree')
+    def load_tree(self, tree, index):
+        """Shows a GameTree at the position after index plies. In analysis mode only the moves up to
+        there need to have been played onto the tree; game mode plays from the last position, so
+        that is played out too."""
+        self.load_in(tree.position(index if self.analysis_mode else len(tree) - 1))
+        self.history = tree
+        self.starting_colour = tree.position(0).flags['next_move']
+        self.reset_text()
+        self.move_list.extend(tree.moves_made)
+        self.load_in_position(index)
+        self.update_movement_buttons(index)
+
+
+class CanvasHistoryBoard(HistoryBoard):
+    """HistoryBoard drawn on its single Canvas. The squares are one background image and each piece
+    is a canvas image item, so there is no widget per square and clicks are found from SQ_SIZE."""
+    def create_squares(self):
+        self.canvas.create_image(0, 0, anchor=NW, image=self.IMAGES['board'])
+        self.piece_items = {}  # On-screen square index -> canvas image item of the piece drawn there
+        self.accepting_clicks = True
+
+    def bind_squares(self, callback):
+        def on_click(event):
+            if self.accepting_clicks:
+                x_board = int(self.canvas.canvasx(event.x)) // SQ_SIZE
+                y_board = 7 - int(self.canvas.canvasy(event.y)) // SQ_SIZE
+                if 0 <= x_board < BOARD_DIMENSIONS and 0 <= y_board < BOARD_DIMENSIONS:
+                    callback((x_board, y_board))
+        self.canvas.bind('<Button-1>', on_click)
+
+    def set_squares_state(self, state_to_config):
+        self.accepting_clicks = state_to_config != DISABLED
+
+    @timed('config_image')
+    def config_image(self, coord):
+        """Creates, changes or deletes the piece item on the square at the required coordinate"""
+        screen_coord = self.get_flipped_coordinates(coord)
+        screen_idx = coords_to_index(screen_coord)
+        piece = self.board_state[coords_to_index(coord)]
+        item = self.piece_items.pop(screen_idx, None)
+        if piece:
+            if item is None:
+                x_image, y_image = convert_coords(screen_coord)
+                item = self.canvas.create_image(x_image + SQ_SIZE // 2, y_image + SQ_SIZE // 2,
+                                                image=self.IMAGES[CODE_TO_PIECE[piece]])
+            else:
+                self.canvas.itemconfig(item, image=self.IMAGES[CODE_TO_PIECE[piece]])
+            self.piece_items[screen_idx] = item
+        elif item is not None:
+            self.canvas.delete(item)
+        self.shown_pieces[screen_idx] = piece
+
+
+@timed('load_images')
+def load_button_images():
+    """Images for the 'buttons' backend: a piece on each colour of square, plus the empty squares"""
+    return get_atlas(SQ_SIZE-2)
+
+@timed('load_images')
+def load_canvas_images():
+    """Images for the 'canvas' backend: the bare piece sprites, plus the whole board drawn once"""
+    images = get_atlas(SQ_SIZE-2)
+    tiles = get_atlas(SQ_SIZE)
+
+    def draw_board():
+        board_image = Image.new('RGB', (BOARD_SIZE, BOARD_SIZE))
+        for coord in ALL_COORDS:
+            board_image.paste(tiles.sprite('light' if is_light(coord) else 'dark'), convert_coords(coord))
+        return board_image
+
+    images.register('board', draw_board)
+    return images
+
+
+class ChessApp:
+    """The main window: the board, the buttons around it and the menus"""
+    @timed('startup')
+    def __init__(self):
+        self.root = Tk()
+        self.root.title("M Chess")
+
+        self.PIECE_IMAGES = load_canvas_images() if BOARD_BACKEND == 'canvas' else load_button_images()
+
+        StartingGameboard = GameBoard(STARTING_COORDS, STARTING_FLAGS)
+
+        self.GameOutcome = Label(self.root)
+        self.GameOutcome.grid(row=0, column = 0)
+
+        self.BoardAndOptions = Frame(self.root)
+        self.BoardAndOptions.grid(row=1)
+
+        board_class = CanvasHistoryBoard if BOARD_BACKEND == 'canvas' else HistoryBoard
+        self.mainBoard = board_class(self.BoardAndOptions, StartingGameboard, self.PIECE_IMAGES)
+        self.mainBoard.grid(row=2, column = 0, rowspan = 8, columnspan = 8)
+        self.mainBoard.outcome_label = self.GameOutcome
+        self.mainBoard.on_flip = self.flip_resign
+        self.mainBoard.on_position_change = self.position_changed
+        self.mainBoard.adjudicate = self.adjudicate
+
+        self.mainBoard.MoveWidget.grid(row=0, column = 8)
+
+        self.ResignButton = Button(self.BoardAndOptions, text='Resign', command=self.resign_game, bg='#FFFFFF')
+        self.ResignButton.grid(row=0, column=0)
+
+        self.EngineOutput = Label(self.root, anchor=W, justify=LEFT, width=40, wraplength=320)
+        self.EngineOutput.grid(row=2, column=2)
+        self.engine = None  # BackgroundEngine, once one is loaded
+        self.engine_name = ''
+        self.analysing = False
+        self.analysed_position = None  # (history, index, zobrist key) of the position being searched
+        self.analysed_board = None
+        self.analysed_key = None  # position_key of analysed_board
+        self.search_id = 0
+        self.move_search = None  # (search id, position) of a search for a move to play on the board
+        self.analysis_cache = AnalysisCache()  # Replaced by one kept on disk once an engine says its name
+
+        self.explorer = None  # ExplorerIndex, once one is opened
+        self.archive_windows = []  # (path, reopen function) of each archive window open
+        self.ExplorerText = Text(self.root, width=34, height=24)
+
+        self.bitbases = None  # Bitbases, once a directory of them is opened
+        self.adjudicate_games = False  # Whether games end at claimable draws and bitbase results, in each mode
+        self.adjudicate_analysis = False
+        self.EndgameOutcome = Label(self.root)
+
+        self.TimingOverlay = Label(self.root, anchor=NW, justify=LEFT, font=('Courier', 9), bg='#FFFFE0')
+        self.timing_overlay_shown = False
+        self.timing_from_start = TIMINGS.enabled
+
+        self.build_menus()
+
+        self.mainBoard.Castles_Buttons['wk'].grid(row = 10, column = 0)
+        self.mainBoard.Castles_Buttons['wq'].grid(row = 10, column = 2)
+        self.mainBoard.Castles_Buttons['bk'].grid(row = 10, column = 4)
+        self.mainBoard.Castles_Buttons['bq'].grid(row = 10, column = 6)
+
+        self.mainBoard.initialize()
+        self.root.protocol('WM_DELETE_WINDOW', self.exit)
+        self.root.after(ENGINE_POLL_MS, self.poll_engine)
+
+    def build_menus(self):
+        mainMenu = Menu(self.root)
+
+        fileMenu = Menu(mainMenu, tearoff=0)
+        fileMenu.add_command(label="New Game", command = self.new_game)
+        fileMenu.add_separator()
+        fileMenu.add_command(label="Load Position...", command=self.load_position)
+        fileMenu.add_command(label = "Load Game...", command=self.load_game)
+        fileMenu.add_command(label="Open Game Archive...", command=self.open_archive)
+        fileMenu.add_separator()
+        fileMenu.add_command(label = "Save Position...", command=self.save_position)
+        fileMenu.add_command(label = "Save Game...", command=self.save_game)
+        fileMenu.add_command(label="Save Game to Archive...", command=self.save_game_to_archive)
+        fileMenu.add_separator()
+        fileMenu.add_command(label="Open Explorer Index...", command=self.open_explorer)
+        fileMenu.add_command(label="Open Endgame Bitbases...", command=self.open_bitbases)
+        mainMenu.add_cascade(label="File", menu = fileMenu)
+
+        modeMenu = Menu(mainMenu, tearoff=0)
+        modeMenu.add_command(label="Analysis mode", command = self.analysis_mode)
+        modeMenu.add_command(label="Game mode", command = self.game_mode)
+        modeMenu.add_separator()
+        modeMenu.add_checkbutton(label="Adjudicate in Game Mode", command=self.toggle_game_adjudication)
+        modeMenu.add_checkbutton(label="Adjudicate in Analysis Mode", command=self.toggle_analysis_adjudication)
+        mainMenu.add_cascade(label = "Mode", menu=modeMenu)
+
+        engineMenu = Menu(mainMenu, tearoff=0)
+        engineMenu.add_command(label="Use Built-in Engine", command=delayed(self.start_engine, BUILT_IN_ENGINE))
+        engineMenu.add_command(label="Load Engine...", command=self.load_engine)
+        engineMenu.add_separator()
+        engineMenu.add_checkbutton(label="Analyse", command=self.toggle_analysis)
+        engineMenu.add_command(label="Play Engine Move", command=self.play_engine_move)
+        mainMenu.add_cascade(label="Engine", menu=engineMenu)
+
+        debugMenu = Menu(mainMenu, tearoff=0)
+        debugMenu.add_checkbutton(label="Timing Overlay", command=self.toggle_timing_overlay)
+        debugMenu.add_command(label="Clear Timings", command=TIMINGS.clear)
+        debugMenu.add_command(label="Save Timings...", command=self.save_timings)
+        mainMenu.add_cascade(label="Debug", menu=debugMenu)
+
+        mainMenu.add_command(label="Flip", command=self.mainBoard.flip_board)
+
+        mainMenu.add_command(label="Exit", command=self.exit)
+
+        self.root.config(menu=mainMenu)
+
+    def reset_game(self):
+        self.GameOutcome.config(text='')
+        self.mainBoard.activate_or_deactivate(NORMAL)
+        self.mainBoard.reset_text()
+        self.flip_resign()
+
+    def resign_game(self):
+        resign_text = f"{'White' if self.mainBoard.is_flipped else 'Black'} wins by resignation"
+        self.mainBoard.activate_or_deactivate(DISABLED)
+        self.GameOutcome.config(text = resign_text)
+
+    def draw_gme(self, reason):
+        draw_text = "D" + reason[7:]
+        self.mainBoard.activate_or_deactivate(DISABLED)
+        self.GameOutcome.config(text = draw_text)
+
+    def flip_resign(self):
+        if self.mainBoard.is_flipped:
+            self.ResignButton.config(bg='#000000', fg='#FFFFFF')
+        else:
+            self.ResignButton.config(bg='#FFFFFF', fg='#000000')
+
+    def new_game(self):
+        fenBoard = fen_to_gameboard(STARTING_FEN)
+        self.mainBoard.load_in(fenBoard)
+        self.reset_game()
+
+    def save_position(self):
+        newWindow = Toplevel(self.root)
+        newWindow.geometry("600x100")
+        newWindow.title('Save Position')
+        fenLabel = Label(newWindow, text='FEN')
+        fenLabel.pack()
+        fen_text = self.mainBoard.game_state.make_fen()
+        fenReturn = StringVar(newWindow, value = fen_text)
+        fenContainer = Entry(newWindow, textvariable = fenReturn, width=75)
+        fenContainer.pack()
+        exitButton = Button(newWindow, text="Done", command=newWindow.destroy)
+        exitButton.pack()
+
+    def load_position(self):
+        newWindow = Toplevel(self.root)
+        newWindow.geometry("600x100")
+        newWindow.title('Load Position')
+        fenLabel = Label(newWindow, text='FEN')
+        fenLabel.pack()
+        fenContainer = Entry(newWindow, width=75)
+        fenContainer.pack()
+
+        def get_and_go():
+            fen_text = fenContainer.get()
+            try:
+                fenBoard = fen_to_gameboard(fen_text)
+            except FenError as error:
+                fenLabel.config(text=f"FEN ({error})")
+                return
+            self.reset_game()
+            self.mainBoard.load_in(fenBoard)
+            newWindow.destroy()
+
+        exitButton = Button(newWindow, text="Load", command=get_and_go)
+        exitButton.pack()
+
+    def game_result(self):
+        """The PGN result of the game on the board, from the outcome shown above it"""
+        outcome_text = self.GameOutcome.cget('text')
+        if outcome_text.startswith('White wins'):
+            return '1-0'
+        if outcome_text.startswith('Black wins'):
+            return '0-1'
+        if outcome_text.startswith('Draw'):
+            return '1/2-1/2'
+        return '*'
+
+    def save_game(self):
+        filename = filedialog.asksaveasfilename(parent=self.root, title='Save Game', defaultextension='.pgn',
+                                                filetypes=[('PGN files', '*.pgn'), ('All files', '*')])
+        if filename:
+            history = self.mainBoard.history
+            with open(filename, 'w', encoding='utf-8') as pgn_file:
+                write_game(pgn_file, history, game_headers(history, self.game_result()))
+
+    def save_game_to_archive(self):
+        """Adds the game on the board to a game archive, creating the archive if it doesn't exist"""
+        filename = filedialog.asksaveasfilename(parent=self.root, title='Save Game to Archive',
+                                                defaultextension='.mca', confirmoverwrite=False,
+                                                filetypes=[('Game archives', '*.mca'), ('All files', '*')])
+        if filename:
+            history = self.mainBoard.history
+            result = self.game_result()
+            try:
+                with ArchiveWriter(filename) as writer:
+                    writer.add_history(history, result, game_headers(history, result).items())
+            except (OSError, ArchiveError) as error:
+                self.GameOutcome.config(text=f"Can't save game: {error}")
+                return
+            for path, reopen in list(self.archive_windows):
+                if path == os.path.abspath(filename):
+                    reopen()  # Its Archive still maps the file as it was before the save
+
+    def show_archived_game(self, game, ply):
+        """Loads a game from an archive onto the board at a ply, replaying only the moves up to it"""
+        try:
+            tree = game.tree(ply)
+            self.reset_game()
+            self.mainBoard.load_tree(tree, ply)
+        except ValueError as error:
+            self.GameOutcome.config(text=f"Can't load game: {error}")
+            return
+        headers = game.headers
+        self.GameOutcome.config(text=f"{headers.get('White', '?')} - {headers.get('Black', '?')}  {game.result}")
+
+    def open_archive(self):
+        """Shows the first game of a game archive, with a window to jump to any game and ply in it"""
+        filename = filedialog.askopenfilename(parent=self.root, title='Open Game Archive',
+                                              filetypes=[('Game archives', '*.mca'), ('All files', '*')])
+        if not filename:
+            return
+        try:
+            archive = Archive(filename)
+        except (OSError, ArchiveError) as error:
+            self.GameOutcome.config(text=f"Can't open archive: {error}")
+            return
+        if not len(archive):
+            archive.close()
+            self.GameOutcome.config(text="No games in that archive")
+            return
+        try:
+            first_game = archive.game(0)
+        except (struct.error, IndexError, ValueError) as error:
+            archive.close()
+            self.GameOutcome.config(text=f"Can't read archive: {error}")
+            return
+        self.show_archived_game(first_game, len(first_game))
+
+        newWindow = Toplevel(self.root)
+        newWindow.title('Game Archive')
+        countLabel = Label(newWindow, text=f"{len(archive)} games")
+        countLabel.grid(row=0, column=0, columnspan=2)
+        Label(newWindow, text='Game').grid(row=1, column=0)
+        gameEntry = Entry(newWindow, width=10)
+        gameEntry.insert(0, '1')
+        gameEntry.grid(row=1, column=1)
+        Label(newWindow, text='Ply (blank for the end)').grid(row=2, column=0)
+        plyEntry = Entry(newWindow, width=10)
+        plyEntry.grid(row=2, column=1)
+
+        def load_chosen():
+            try:
+                number = int(gameEntry.get())
+                ply = int(plyEntry.get()) if plyEntry.get().strip() else None
+            except ValueError:
+                countLabel.config(text=f"{len(archive)} games (enter numbers)")
+                return
+            if not 1 <= number <= len(archive):
+                countLabel.config(text=f"{len(archive)} games (no game {number})")
+                return
+            try:
+                game = archive.game(number - 1)
+            except (struct.error, IndexError, ValueError) as error:
+                countLabel.config(text=f"{len(archive)} games (can't read game {number}: {error})")
+                return
+            self.show_archived_game(game, len(game) if ply is None else min(max(ply, 0), len(game)))
+            countLabel.config(text=f"{len(archive)} games")
+
+        def reopen():
+            nonlocal archive
+            archive.close()
+            try:
+                archive = Archive(filename)
+            except (OSError, ArchiveError) as error:
+                self.GameOutcome.config(text=f"Can't reopen archive: {error}")
+                self.archive_windows.remove(window_entry)
+                newWindow.destroy()
+                return
+            countLabel.config(text=f"{len(archive)} games")
+
+        def close():
+            self.archive_windows.remove(window_entry)
+            newWindow.destroy()
+            archive.close()
+
+        window_entry = (os.path.abspath(filename), reopen)
+        self.archive_windows.append(window_entry)
+        Button(newWindow, text="Load", command=load_chosen).grid(row=3, column=0, columnspan=2)
+        newWindow.protocol('WM_DELETE_WINDOW', close)
+
+    def show_pgn_game(self, game):
+        """Loads a game read from a PGN file onto the board"""
+        try:
+            history = game.history()
+        except (PgnError, FenError) as error:
+            self.GameOutcome.config(text=f"Can't load game: {error}")
+            return
+        self.reset_game()
+        self.mainBoard.load_history(history)
+        self.GameOutcome.config(text=f"{game.headers.get('White', '?')} - {game.headers.get('Black', '?')}"
+                                     f"  {game.result}")
+
+    def load_game(self):
+        """Shows the first game of a PGN file straight away, and lists the games in it as they are
+        found by a background thread. Double clicking a game in the list loads it."""
+        filename = filedialog.askopenfilename(parent=self.root, title='Load Game',
+                                              filetypes=[('PGN files', '*.pgn'), ('All files', '*')])
+        if not filename:
+            return
+        first_game = next(read_games(filename), None)
+        if first_game is None:
+            self.GameOutcome.config(text="No games in that file")
+            return
+        self.show_pgn_game(first_game)
+
+        newWindow = Toplevel(self.root)
+        newWindow.title('Games')
+        countLabel = Label(newWindow, text='Scanning...')
+        countLabel.pack()
+        gameList = Listbox(newWindow, width=60, height=20)
+        gameList.pack(side=LEFT, fill=BOTH, expand=True)
+        listScroll = Scrollbar(newWindow, command=gameList.yview)
+        listScroll.pack(side=RIGHT, fill=Y)
+        gameList.config(yscrollcommand=listScroll.set)
+
+        offsets = []
+        found = queue.Queue()
+        stop_scanning = threading.Event()
+
+        def scan():
+            batch = []
+            for number, game in enumerate(read_games(filename, headers_only=True), 1):
+                if stop_scanning.is_set():
+                    return
+                batch.append((game.offset, f"{number}. {game.headers.get('White', '?')} - "
+                                           f"{game.headers.get('Black', '?')}  {game.result}"))
+                if len(batch) == 1000:
+                    found.put(batch)
+                    batch = []
+            found.put(batch)
+            found.put(None)
+
+        def show_found():
+            if stop_scanning.is_set():
+                return
+            while not found.empty():
+                batch = found.get()
+                if batch is None:
+                    countLabel.config(text=f"{len(offsets)} games")
+                    return
+                offsets.extend(offset for offset, description in batch)
+                gameList.insert(END, *(description for offset, description in batch))
+            countLabel.config(text=f"Scanning... {len(offsets)} games")
+            self.root.after(100, show_found)
+
+        def load_selected(event):
+            selection = gameList.curselection()
+            if selection:
+                self.show_pgn_game(read_game_at(filename, offsets[selection[0]]))
+
+        def close():
+            stop_scanning.set()
+            newWindow.destroy()
+
+        gameList.bind('<Double-Button-1>', load_selected)
+        newWindow.protocol('WM_DELETE_WINDOW', close)
+        threading.Thread(target=scan, daemon=True).start()
+        show_found()
+
+    def open_explorer(self):
+        directory = filedialog.askdirectory(parent=self.root, title='Open Explorer Index', mustexist=True)
+        if not directory:
+            return
+        if self.explorer is not None:
+            self.explorer.close()
+        try:
+            self.explorer = ExplorerIndex(directory)
+        except (OSError, ValueError) as error:
+            self.explorer = None
+            self.GameOutcome.config(text=f"Can't open explorer index: {error}")
+            return
+        self.ExplorerText.grid(row=1, column=4)
+        self.update_explorer()
+
+    def position_changed(self):
+        self.update_explorer()
+        self.update_endgame()
+
+    def update_explorer(self):
+        """Shows the moves played from the position on the board in the explorer index"""
+        if self.explorer is None:
+            return
+        history = self.mainBoard.history
+        index = self.mainBoard.current_idx
+        move_stats = self.explorer.lookup_key(history.key_history[index])
+        self.ExplorerText.delete('1.0', 'end')
+        if move_stats:
+            self.ExplorerText.insert('end', "Move       Games    +    =    -\n")
+            self.ExplorerText.insert('end', '\n'.join(stats_lines(history.position(index), move_stats)))
+        else:
+            self.ExplorerText.insert('end', "No games from this position")
+
+    def open_bitbases(self):
+        directory = filedialog.askdirectory(parent=self.root, title='Open Endgame Bitbases', mustexist=True)
+        if not directory:
+            return
+        if self.bitbases is not None:
+            self.bitbases.close()
+        try:
+            self.bitbases = Bitbases(directory)
+        except (OSError, ValueError) as error:
+            self.bitbases = None
+            self.GameOutcome.config(text=f"Can't open bitbases: {error}")
+            return
+        self.EndgameOutcome.grid(row=3, column=2)
+        self.update_endgame()
+
+    def endgame_outcome(self, game_state):
+        """'White wins', 'Black wins' or 'Draw' from the bitbases, or None if they don't cover the position"""
+        outcome = self.bitbases.probe(game_state) if self.bitbases is not None else None
+        if outcome is None or outcome == 'draw':
+            return outcome and 'Draw'
+        winner_to_move = outcome == 'win'
+        return f"{'White' if (game_state.whose_move() == 'w') == winner_to_move else 'Black'} wins"
+
+    def update_endgame(self):
+        """Shows the bitbase result of the position on the board"""
+        if self.bitbases is None:
+            return
+        outcome = self.endgame_outcome(self.mainBoard.history.position(self.mainBoard.current_idx))
+        self.EndgameOutcome.config(text=f"Endgame bitbase: {outcome}" if outcome else '')
+
+    def adjudicate(self, game_state):
+        """Ends the game once the bitbases know the result"""
+        outcome = self.endgame_outcome(game_state)
+        return f"{outcome} (endgame bitbase)" if outcome else None
+
+    def load_engine(self):
+        filename = filedialog.askopenfilename(parent=self.root, title='Load Engine')
+        if filename:
+            self.start_engine([filename])
+
+    def start_engine(self, command):
+        if self.engine is not None:
+            self.engine.close()
+        self.engine = BackgroundEngine(command)
+        self.analysed_position = None
+        self.move_search = None
+        self.EngineOutput.config(text='Starting engine...')
+
+    def shown_position(self):
+        """(history, index, zobrist key) of the position on the board"""
+        history = self.mainBoard.history
+        index = self.mainBoard.current_idx
+        return (history, index, history.key_history[index])
+
+    def play_engine_move(self):
+        """Asks the engine for a move from the position on the board. It is played when it comes
+        back, unless the position has changed by then."""
+        board = self.mainBoard
+        if self.engine is None or not board.legal_moves or self.GameOutcome.cget('text') \
+                or (not board.analysis_mode and board.current_idx != len(board.history) - 1):
+            return
+        position = self.shown_position()
+        search_id = self.engine.analyse(position_command(board.history, board.current_idx),
+                                        movetime=ENGINE_MOVE_TIME_MS)
+        self.move_search = (search_id, position)
+        self.EngineOutput.config(text=f"{self.engine_name} is thinking...")
+
+    def toggle_analysis(self):
+        self.analysing = not self.analysing
+        self.analysed_position = None
+        if not self.analysing and self.engine is not None:
+            self.engine.stop()
+
+    def poll_engine(self):
+        """Shows the latest thing the engine has said, and starts a new search when the position
+        on the board has changed. Runs every ENGINE_POLL_MS for as long as the window is open."""
+        if self.engine is not None:
+            latest_info = None
+            while not self.engine.events.empty():
+                kind, detail = self.engine.events.get()
+                if kind == 'info' and detail['search_id'] == self.search_id and 'pv' in detail \
+                        and 'score' in detail and 'bound' not in detail and detail.get('multipv', 1) == 1:
+                    # Only results at least as deep as the cached one are kept and shown
+                    if self.analysis_cache.store(self.analysed_key, detail.get('depth', 0), detail['score'],
+                                                 detail['pv'], detail.get('nodes', 0)):
+                        latest_info = detail
+                elif kind == 'bestmove' and self.move_search is not None and detail[0] == self.move_search[0]:
+                    search_id, best_move, ponder = detail
+                    self.move_search = None
+                    self.analysed_position = None
+                    if best_move is not None:
+                        self.mainBoard.play_uci_move(best_move)
+                elif kind == 'ready':
+                    self.engine_name = detail
+                    self.EngineOutput.config(text=detail)
+                    self.open_analysis_cache(detail)
+                elif kind == 'error':
+                    self.EngineOutput.config(text=detail)
+                    self.engine.close()
+                    self.engine = None
+                    break
+            if latest_info is not None:
+                self.show_analysis(latest_info.get('depth', 0), latest_info['score'], latest_info['pv'])
+        if self.engine is not None and self.move_search is not None:
+            if self.move_search[1] != self.shown_position():  # The user moved on, so the move is no use
+                self.engine.stop()
+                self.move_search = None
+                self.analysed_position = None
+        elif self.engine is not None and self.analysing:
+            position = self.shown_position()
+            if position != self.analysed_position:
+                history, index = position[:2]
+                self.analysed_position = position
+                self.analysed_board = history.position(index)
+                self.analysed_key = position_key(self.analysed_board)
+                cached = self.analysis_cache.get(self.analysed_key)
+                if cached is not None:
+                    self.show_analysis(cached.depth, cached.score, cached.pv)
+                if cached is None or cached.depth < ANALYSIS_DEPTH:
+                    self.search_id = self.engine.analyse(position_command(history, index), depth=ANALYSIS_DEPTH)
+                else:
+                    self.engine.stop()
+                    self.search_id = None
+        self.root.after(ENGINE_POLL_MS, self.poll_engine)
+
+    def open_analysis_cache(self, engine_name):
+        """Swaps to the on-disk analysis cache for an engine, keeping to memory if it can't be opened"""
+        self.analysis_cache.close()
+        try:
+            self.analysis_cache = AnalysisCache(path=ANALYSIS_CACHE_PATH, engine=engine_name)
+        except sqlite3.Error:
+            self.analysis_cache = AnalysisCache(engine=engine_name)
+        self.analysed_position = None
+
+    def show_analysis(self, depth, score, pv):
+        white_to_move = self.analysed_board.whose_move() == 'w'
+        self.EngineOutput.config(text=f"{self.engine_name}  depth {depth}  {format_score(score, white_to_move)}\n"
+                                      f"{variation_text(self.analysed_board, pv, 10)}")
+
+    def toggle_timing_overlay(self):
+        """Shows or hides the timing overlay. Timing is on while it is shown, and stays on if
+        MCHESS_TIMINGS turned it on at startup."""
+        self.timing_overlay_shown = not self.timing_overlay_shown
+        TIMINGS.enabled = self.timing_overlay_shown or self.timing_from_start
+        if self.timing_overlay_shown:
+            self.TimingOverlay.place(relx=1.0, rely=0.0, anchor=NE)
+            self.update_timing_overlay()
+        else:
+            self.TimingOverlay.place_forget()
+
+    def update_timing_overlay(self):
+        if self.timing_overlay_shown:
+            self.TimingOverlay.config(text='\n'.join(TIMINGS.summary_lines()))
+            self.TimingOverlay.lift()
+            self.root.after(TIMING_OVERLAY_MS, self.update_timing_overlay)
+
+    def save_timings(self):
+        filename = filedialog.asksaveasfilename(parent=self.root, title='Save Timings', defaultextension='.json',
+                                                filetypes=[('JSON', '*.json'), ('CSV trace', '*.csv')])
+        if filename:
+            TIMINGS.dump(filename)
+
+    def exit(self):
+        if self.engine is not None:
+            self.engine.close()
+        self.analysis_cache.close()
+        if self.explorer is not None:
+            self.explorer.close()
+        if self.bitbases is not None:
+            self.bitbases.close()
+        self.root.destroy()
+
+    def game_mode(self):
+        self.mainBoard.analysis_mode = False
+        self.update_adjudication()
+
+    def analysis_mode(self):
+        self.mainBoard.analysis_mode = True
+        self.update_adjudication()
+
+    def toggle_game_adjudication(self):
+        self.adjudicate_games = not self.adjudicate_games
+        self.update_adjudication()
+
+    def toggle_analysis_adjudication(self):
+        self.adjudicate_analysis = not self.adjudicate_analysis
+        self.update_adjudication()
+
+    def update_adjudication(self):
+        board = self.mainBoard
+        board.auto_adjudicate = self.adjudicate_analysis if board.analysis_mode else self.adjudicate_games
+
+
+def main():
+    app = ChessApp()
+    app.root.mainloop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Board images, resized once per square size and cached on disk as a single sprite atlas.
+
+The atlas for a size is a PNG with every sprite side by side, next to a JSON manifest holding the
+size and modification time of each source image. A changed source image rebuilds the atlas.
+Nothing is decoded until an image is first asked for, and Tk is only needed for PhotoImages.
+
+"python sprites.py 62 64" builds the atlases for those sizes ahead of time."""
+
+import json
+import os
+import sys
+import time
+
+from PIL import Image
+
+from chesscore.board import PIECE_CODES
+
+SOURCE_DIR = 'BoardImages'
+CACHE_DIR = os.path.join(SOURCE_DIR, 'cache')
+SPRITE_NAMES = ['dark', 'light'] + PIECE_CODES + [pc + '-dark' for pc in PIECE_CODES] \
+               + [pc + '-light' for pc in PIECE_CODES]
+
+
+def source_signature():
+    """Size and modification time of every source image, so edits to them invalidate the cache"""
+    signature = {}
+    for name in SPRITE_NAMES:
+        stat = os.stat(os.path.join(SOURCE_DIR, f"{name}.png"))
+        signature[name] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+def atlas_paths(size):
+    return (os.path.join(CACHE_DIR, f"atlas-{size}.png"), os.path.join(CACHE_DIR, f"atlas-{size}.json"))
+
+def build_atlas(size):
+    """Resizes every source image to size x size and saves them side by side"""
+    atlas = Image.new('RGBA', (size * len(SPRITE_NAMES), size))
+    for position, name in enumerate(SPRITE_NAMES):
+        with Image.open(os.path.join(SOURCE_DIR, f"{name}.png")) as source:
+            atlas.paste(source.convert('RGBA').resize((size, size)), (position * size, 0))
+    image_path, manifest_path = atlas_paths(size)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        atlas.save(image_path)
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump({'size': size, 'names': SPRITE_NAMES, 'sources': source_signature()}, manifest_file)
+    except OSError:
+        pass  # A read-only install still works, it just resizes on every launch
+    return atlas
+
+def load_atlas(size):
+    """Returns the atlas image for a size, from the cache if it is still up to date"""
+    image_path, manifest_path = atlas_paths(size)
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest == {'size': size, 'names': SPRITE_NAMES, 'sources': source_signature()}:
+            with Image.open(image_path) as atlas:
+                atlas.load()
+                return atlas
+    except (OSError, ValueError):
+        pass
+    return build_atlas(size)
+
+
+class SpriteAtlas:
+    """The images for one square size, looked up like a dictionary of PhotoImages. The atlas is
+    only read on the first lookup, and each PhotoImage is only made the first time it is needed."""
+    def __init__(self, size):
+        self.size = size
+        self.atlas = None
+        self.photo_images = {}
+        self.builders = {}  # Extra image name -> function returning a PIL image
+
+    def register(self, name, builder):
+        """Adds an image made from the sprites, such as a whole board, built the first time it is used"""
+        self.builders[name] = builder
+
+    def sprite(self, name):
+        """The PIL image of a sprite"""
+        if self.atlas is None:
+            self.atlas = load_atlas(self.size)
+        left = SPRITE_NAMES.index(name) * self.size
+        return self.atlas.crop((left, 0, left + self.size, self.size))
+
+    def __getitem__(self, name):
+        from PIL import ImageTk
+        photo_image = self.photo_images.get(name)
+        if photo_image is None:
+            image = self.builders[name]() if name in self.builders else self.sprite(name)
+            photo_image = self.photo_images[name] = ImageTk.PhotoImage(image)
+        return photo_image
+
+
+_atlases = {}
+
+def get_atlas(size):
+    """One SpriteAtlas per size for the life of the program, so going back to a size reuses its images"""
+    if size not in _atlases:
+        _atlases[size] = SpriteAtlas(size)
+    return _atlases[size]
+
+
+if __name__ == '__main__':
+    for size_argument in sys.argv[1:]:
+        start_time = time.perf_counter()
+        build_atlas(int(size_argument))
+        print(f"atlas-{size_argument}.png built in {time.perf_counter() - start_time:.3f}s")
@@ -0,0 +1,120 @@
+"""A stand-in UCI engine whose behaviour is set on its command line, for testing the UCI client and
+the match runner without a real engine.
+
+"python tests/scripted_engine.py MODE [PLIES]" plays the first legal move, reporting a score of 0,
+except in these modes, which start misbehaving on its PLIES'th search (default 1):
+  illegal     answers bestmove a1a1
+  crash       exits without answering
+  hang        never answers, and ignores stop
+  slow        sleeps half a second before answering
+  white-wins  reports 1000 centipawns for White, from the side to move's point of view
+  infinite    sends info lines until stop, then answers; isready is still answered meanwhile"""
+
+import os
+import select
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chesscore.board import STARTING_FEN, fen_to_gameboard
+from chesscore.movegen import apply_move, legal_moves, move_to_uci
+
+
+class LineReader:
+    """Lines from standard input, read unbuffered so select() knows when one is waiting"""
+    def __init__(self):
+        self.pending = b''
+
+    def read_line(self, timeout=None):
+        """The next line, '' at the end of input, or None if none comes within timeout seconds"""
+        while b'\n' not in self.pending:
+            ready, _, _ = select.select([sys.stdin.fileno()], [], [], timeout)
+            if not ready:
+                return None
+            data = os.read(sys.stdin.fileno(), 4096)
+            if not data:
+                line, self.pending = self.pending, b''
+                return line.decode()
+            self.pending += data
+        line, self.pending = self.pending.split(b'\n', 1)
+        return line.decode() + '\n'
+
+
+def send(line):
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+def read_position(words):
+    if words[1] == 'startpos':
+        board = fen_to_gameboard(STARTING_FEN)
+    else:
+        board = fen_to_gameboard(' '.join(words[2:8]))
+    if 'moves' in words:
+        for move_text in words[words.index('moves') + 1:]:
+            apply_move(board, next(move for move in legal_moves(board) if move_to_uci(move) == move_text))
+    return board
+
+def best_move(board):
+    moves = sorted(legal_moves(board), key=move_to_uci)
+    return move_to_uci(moves[0]) if moves else '(none)'
+
+def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'first'
+    misbehave_from = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    board = fen_to_gameboard(STARTING_FEN)
+    reader = LineReader()
+    searches = 0
+    searching = False
+    depth = 0
+    while True:
+        line = reader.read_line(0.02 if searching else None)
+        if line is None:  # Searching, with nothing to answer yet
+            depth += 1
+            send(f"info depth {depth} score cp 0 nodes {depth * 100} pv {best_move(board)}")
+            continue
+        if not line:
+            return
+        words = line.split()
+        if not words:
+            continue
+        command = words[0]
+        if command == 'uci':
+            send(f"id name Scripted {mode}")
+            send('option name Hash type spin default 1 min 1 max 16')
+            send('uciok')
+        elif command == 'isready':
+            send('readyok')
+        elif command == 'position':
+            board = read_position(words)
+        elif command == 'go':
+            searches += 1
+            misbehaving = searches >= misbehave_from
+            if misbehaving and mode == 'crash':
+                sys.exit(1)
+            if misbehaving and mode == 'hang':
+                while reader.read_line():
+                    pass
+                time.sleep(60)
+                return
+            if misbehaving and mode == 'infinite':
+                searching = True
+                depth = 0
+                continue
+            if misbehaving and mode == 'slow':
+                time.sleep(0.5)
+            score = 0
+            if mode == 'white-wins':
+                score = 1000 if board.whose_move() == 'w' else -1000
+            send(f"info depth 1 score cp {score} nodes 1 pv {best_move(board)}")
+            send(f"bestmove {'a1a1' if misbehaving and mode == 'illegal' else best_move(board)}")
+        elif command == 'stop':
+            if searching:
+                searching = False
+                send(f"bestmove {best_move(board)}")
+        elif command == 'quit':
+            return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Adding games to an archive while it is open, and when the writer never finishes"""
+
+import os
+
+import pytest
+
+from chesscore.archive import Archive, ArchiveError, ArchiveWriter
+from chesscore.board import STARTING_FEN
+
+GAMES = [(['e2e4', 'e7e5', 'g1f3'], '*', [('White', 'A'), ('Black', 'B')]),
+         (['d2d4', 'd7d5', 'c2c4', 'e7e6', 'b1c3', 'g8f6', 'c1g5', 'f8e7', 'e2e3', 'O-O'], '1-0',
+          [('White', 'C'), ('Black', 'A'), ('Event', 'Test')])]
+
+
+def write(path, games):
+    with ArchiveWriter(path) as writer:
+        for moves_made, result, tags in games:
+            writer.add(STARTING_FEN, moves_made, result, tags)
+
+def read_all(archive):
+    return [(game.moves_made(), game.result, game.tags) for game in archive]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'games.mca')
+    write(path, GAMES)
+    archive = Archive(path)
+    try:
+        assert read_all(archive) == GAMES
+    finally:
+        archive.close()
+
+def test_open_archive_survives_adding_games(tmp_path):
+    path = str(tmp_path / 'games.mca')
+    write(path, GAMES[:1])
+    archive = Archive(path)
+    try:
+        write(path, GAMES[1:])
+        assert read_all(archive) == GAMES[:1]  # What it had open, still readable
+    finally:
+        archive.close()
+    archive = Archive(path)
+    try:
+        assert read_all(archive) == GAMES
+    finally:
+        archive.close()
+    assert not os.path.exists(path + '.tmp')
+
+def test_unfinished_writer_leaves_the_archive(tmp_path):
+    path = str(tmp_path / 'games.mca')
+    write(path, GAMES[:1])
+    with open(path, 'rb') as archive_file:
+        before = archive_file.read()
+    writer = ArchiveWriter(path)
+    writer.add(STARTING_FEN, *GAMES[1])
+    writer.file.close()  # As if the process died before close()
+    with open(path, 'rb') as archive_file:
+        assert archive_file.read() == before
+
+def test_not_an_archive(tmp_path):
+    path = str(tmp_path / 'games.mca')
+    with open(path, 'wb') as archive_file:
+        archive_file.write(b'not an archive at all, just some bytes')
+    with pytest.raises(ArchiveError):
+        ArchiveWriter(path)
+    assert not os.path.exists(path + '.tmp')
@@ -0,0 +1,23 @@
+"""GameBoard copies"""
+
+from chesscore.board import fen_to_gameboard
+from chesscore.movegen import apply_move, legal_moves
+
+
+def test_copy_is_equal_and_independent():
+    board = fen_to_gameboard('r3k2r/pppq1ppp/2n5/3pP3/8/8/PPP2PPP/R3K2R w KQkq d6 0 12')
+    board_copy = board.copy()
+    assert type(board_copy) is type(board)
+    assert board_copy.make_fen() == board.make_fen()
+    assert (board_copy.zobrist_key, board_copy.material) == (board.zobrist_key, board.material)
+    assert board_copy.zobrist_key == board_copy.compute_zobrist_key()
+    assert board_copy.material == board_copy.compute_material()
+
+    fen = board.make_fen()
+    for move in legal_moves(board_copy):
+        played = board_copy.copy()
+        apply_move(played, move)
+        assert played.zobrist_key == played.compute_zobrist_key()
+    apply_move(board_copy, legal_moves(board_copy)[0])
+    assert board.make_fen() == fen
+    assert board.squares is not board_copy.squares and board.flags is not board_copy.flags
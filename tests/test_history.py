@@ -0,0 +1,110 @@
+"""GameTree with moves left unplayed, checked against a GameHistory of the same game"""
+
+import random
+
+from chesscore.board import STARTING_FEN, fen_to_gameboard
+from chesscore.history import GameHistory, GameTree
+from chesscore.movegen import legal_moves, move_to_uci
+
+PLIES = 80
+
+
+def random_game(seed, plies=PLIES):
+    """A GameHistory of plies random legal moves from the starting position"""
+    rng = random.Random(seed)
+    game_state = fen_to_gameboard(STARTING_FEN)
+    history = GameHistory(game_state)
+    for ply in range(plies):
+        moves = sorted(legal_moves(game_state))
+        if not moves:
+            break
+        history.play(game_state, rng.choice(moves))
+    return history
+
+def lazy_tree(history):
+    tree = GameTree(history.position(0))
+    tree.add_unplayed(history.moves_made)
+    return tree
+
+def other_move(history, index):
+    """A move from the position after index plies other than the one the game played"""
+    return next(move for move in sorted(legal_moves(history.position(index)))
+                if move_to_uci(move) != history.moves_made[index])
+
+def set_flags(game_state):
+    return {flag: value for flag, value in game_state.flags.items() if value is not None}
+
+def assert_same_line(tree, history):
+    assert len(tree) == len(history)
+    assert tree.moves_made == history.moves_made
+    for index in range(len(history)):
+        assert tree.squares_at(index) == history.squares_at(index)
+        assert set_flags(tree.position(index)) == set_flags(history.position(index))
+    assert tree.key_history == history.key_history
+
+
+def test_unplayed_moves_count_before_being_played():
+    history = random_game(1)
+    tree = lazy_tree(history)
+    assert len(tree) == len(history)
+    assert tree.moves_made == history.moves_made
+    assert tree.node_count == 1
+    assert tree.squares_at(10) == history.squares_at(10)
+    assert tree.node_count == 11
+    assert_same_line(tree, history)
+
+def test_cut_plays_only_up_to_the_cut():
+    history = random_game(2)
+    tree = lazy_tree(history)
+    tree.cut(10)
+    assert tree.node_count == 11  # The cut point and the first move of the variation after it
+    assert len(tree) == 10
+    assert tree.moves_made == history.moves_made[:9]
+    game_state = tree.position(9)
+    tree.play(game_state, other_move(history, 9))
+    assert tree.node_count == 12
+    assert len(tree) == 11
+
+    moves, selected = tree.variations(9)
+    assert moves == [history.moves_made[9], tree.moves_made[9]]
+    assert selected == 1
+    tree.select(9, 0)
+    assert tree.node_count == 12  # The old continuation comes back still unplayed
+    assert_same_line(tree, history)
+
+def test_replaying_the_cut_move_brings_back_the_rest_unplayed():
+    history = random_game(3)
+    tree = lazy_tree(history)
+    tree.cut(20)
+    game_state = tree.position(19)
+    move = next(move for move in legal_moves(game_state) if move_to_uci(move) == history.moves_made[19])
+    tree.play(game_state, move)
+    assert tree.node_count == 21
+    assert tree.moves_made == history.moves_made
+    assert_same_line(tree, history)
+
+def test_cut_before_the_unplayed_moves():
+    history = random_game(4)
+    tree = lazy_tree(history)
+    tree.seek(30)
+    tree.cut(10)
+    assert tree.node_count == 31
+    assert len(tree) == 10
+    tree.select(9, 0)
+    assert tree.node_count == 31
+    assert_same_line(tree, history)
+
+def test_unplayed_moves_after_a_branching_position():
+    history = random_game(5)
+    tree = lazy_tree(history)
+    tree.cut(40)
+    tree.cut(10)
+    tree.add_unplayed(history.moves_made[9:])  # Follows the old line, which already has nodes
+    assert tree.node_count == 41
+    assert_same_line(tree, history)
+    moves, selected = tree.variations(39)
+    assert moves == [history.moves_made[39]] and selected == 0
+
+def test_from_history_matches():
+    history = random_game(6)
+    assert_same_line(GameTree.from_history(history), history)
@@ -0,0 +1,92 @@
+"""Games refereed by chesscore.match against the scripted stand-in engine"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+from chesscore import match
+from chesscore.board import STARTING_FEN
+
+ENGINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripted_engine.py')
+
+
+def scripted(mode='first', plies=1):
+    return [sys.executable, ENGINE, mode, str(plies)]
+
+def match_settings(**overrides):
+    settings = {'engines': [scripted(), scripted()], 'options': [], 'time_control': None, 'movetime': None,
+                'depth': 1, 'nodes': None, 'max_plies': 20, 'resign_score': None, 'resign_moves': 3,
+                'draw_score': None, 'draw_moves': 8, 'draw_from_move': 40, 'bitbases': None, 'event': 'Test'}
+    settings.update(overrides)
+    return settings
+
+def play(settings, first_is_white=True):
+    async def run():
+        players = [match.Player(command, settings['options']) for command in settings['engines']]
+        try:
+            return await match.play_game(players, (1, STARTING_FEN, first_is_white), settings, None)
+        finally:
+            for player in players:
+                await player.close()
+    return asyncio.run(run())
+
+
+def test_move_limit():
+    record = play(match_settings(max_plies=6))
+    assert (record['result'], record['reason']) == ('1/2-1/2', 'move limit')
+    assert len(record['moves']) == 6
+    assert record['white'] == record['black'] == 'Scripted first'
+
+def test_illegal_move_loses():
+    record = play(match_settings(engines=[scripted(), scripted('illegal', 2)]))
+    assert (record['result'], record['reason']) == ('1-0', 'illegal move')
+    assert len(record['moves']) == 3
+    assert 'a1a1' in record['error']
+
+def test_illegal_move_by_white_loses():
+    record = play(match_settings(engines=[scripted(), scripted('illegal')]), first_is_white=False)
+    assert (record['result'], record['reason']) == ('0-1', 'illegal move')
+    assert record['moves'] == []
+
+def test_crash_loses():
+    record = play(match_settings(engines=[scripted('crash', 3), scripted()]))
+    assert (record['result'], record['reason']) == ('0-1', 'engine crashed')
+    assert len(record['moves']) == 4
+    assert record['error']
+
+def test_hang_loses(monkeypatch):
+    monkeypatch.setattr(match, 'MOVE_TIMEOUT_GRACE', 0.5)
+    record = play(match_settings(depth=None, movetime=50, engines=[scripted(), scripted('hang', 2)]))
+    assert (record['result'], record['reason']) == ('1-0', 'engine hung')
+    assert len(record['moves']) == 3
+
+def test_time_forfeit():
+    record = play(match_settings(depth=None, time_control=(0.3, 0.0), engines=[scripted('slow'), scripted()]))
+    assert (record['result'], record['reason']) == ('0-1', 'time forfeit')
+    assert record['moves'] == []
+
+def test_resignation_adjudication():
+    record = play(match_settings(max_plies=40, resign_score=500, resign_moves=2,
+                                 engines=[scripted('white-wins'), scripted('white-wins')]))
+    assert (record['result'], record['reason']) == ('1-0', 'resignation score')
+    assert len(record['moves']) == 4
+
+def test_draw_adjudication():
+    record = play(match_settings(max_plies=40, draw_score=10, draw_moves=2, draw_from_move=3))
+    assert (record['result'], record['reason']) == ('1/2-1/2', 'draw score')
+    assert len(record['moves']) == 6
+
+
+@pytest.mark.parametrize('games, jobs, expected', [(4, 2, 1), (1, 4, 1), (40, 2, 8), (100, 1, 8), (12, 2, 3)])
+def test_chunk_size_keeps_workers_busy(games, jobs, expected):
+    assert match.chunk_size(games, jobs) == expected
+
+def test_run_match_plays_every_game():
+    specs = match.game_specs([STARTING_FEN], 4)
+    records, worker_stats = match.run_match(match_settings(max_plies=4), specs, 2)
+    assert sorted(record['round'] for record in records) == [1, 2, 3, 4]
+    assert [record['first_is_white'] for record in records] == [True, False, True, False]
+    assert sum(stats['games'] for stats in worker_stats) == 4
+    assert len(worker_stats) == 4
@@ -0,0 +1,91 @@
+"""Plane encoding against fen_to_gameboard, and shard export with bad lines in the input"""
+
+import os
+
+import numpy as np
+import pytest
+
+from chesscore import planes
+from chesscore.board import STARTING_FEN, FenError, fen_to_gameboard
+
+GOOD_FENS = [
+    STARTING_FEN,
+    'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1',
+    'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w Kq f6 0 3',
+    '8/8/4k3/8/8/3K4/8/8 b - -',
+    'r3k2r/8/8/8/8/8/8/R3K2R w qkQK - 12 40',
+]
+BAD_FENS = [
+    '',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR white Kx e4 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR white KQkq - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w Kx - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkqK - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KK - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e4 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e3 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq i6 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e66 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - x 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 0',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1 extra',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBN w KQkq - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNRR w KQkq - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR/8 w KQkq - 0 1',
+    'rnbqkbnr/ppppxppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNé w KQkq - 0 1',
+]
+
+
+def rejected_by_board(fen):
+    try:
+        fen_to_gameboard(fen)
+    except FenError as error:
+        return error.kind
+    return None
+
+
+@pytest.mark.parametrize('fen', GOOD_FENS + BAD_FENS)
+def test_encode_fens_rejects_what_fen_to_gameboard_rejects(fen):
+    kind = rejected_by_board(fen)
+    if kind is None:
+        planes.encode_fens([fen])
+    else:
+        with pytest.raises(FenError) as error:
+            planes.encode_fens([fen])
+        assert error.value.kind == kind
+
+def test_fen_problems_finds_every_bad_fen():
+    fens = GOOD_FENS + BAD_FENS
+    problems = planes.fen_problems(fens)
+    assert [index for index, error in problems] == list(range(len(GOOD_FENS), len(fens)))
+    assert [error.kind for index, error in problems] == [rejected_by_board(fen) for fen in BAD_FENS]
+
+def test_encode_fens_matches_encode_boards():
+    assert np.array_equal(planes.encode_fens(GOOD_FENS),
+                          planes.encode_boards([fen_to_gameboard(fen) for fen in GOOD_FENS]))
+
+
+def test_export_skips_bad_lines(tmp_path, capsys):
+    lines = (GOOD_FENS * 3)[:12]
+    lines[2] = ''
+    lines[9] = BAD_FENS[1]
+    input_path = tmp_path / 'fens.txt'
+    input_path.write_text('\n'.join(lines) + '\n')
+    output = tmp_path / 'shards'
+    assert planes.main(['-o', str(output), '--shard-size', '4', '-j', '1', '--show-errors', str(input_path)]) == 0
+    assert 'line 10: side to move' in capsys.readouterr().err
+    assert sorted(os.listdir(output)) == ['shard-00000.npy', 'shard-00001.npy', 'shard-00002.npy']
+    shards = [planes.load_shard(str(output / name)) for name in sorted(os.listdir(output))]
+    assert [len(shard) for shard in shards] == [4, 4, 2]  # Chunks of non-blank lines, less the bad one
+    good = [line for line in lines if line and line != BAD_FENS[1]]
+    assert np.array_equal(np.concatenate(shards), planes.encode_fens(good))
+
+def test_failed_shard_leaves_no_file(tmp_path):
+    path = str(tmp_path / 'shard-00000.npy')
+    with pytest.raises(FenError):
+        planes.write_shard(path, GOOD_FENS + BAD_FENS[1:2])
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,123 @@
+"""The UCI client talking to the scripted stand-in engine"""
+
+import asyncio
+import os
+import queue
+import sys
+
+import pytest
+
+from chesscore.uci import BackgroundEngine, EngineError, UciEngine, go_command, parse_info
+
+ENGINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripted_engine.py')
+AFTER_E4 = 'position startpos moves e2e4'
+
+
+def scripted(mode='first', plies=1):
+    return [sys.executable, ENGINE, mode, str(plies)]
+
+def with_engine(mode, test, plies=1):
+    """Runs the coroutine function test with a started UciEngine, and returns what it returns"""
+    async def run():
+        engine = UciEngine(scripted(mode, plies))
+        await engine.start()
+        try:
+            return await test(engine)
+        finally:
+            await engine.quit()
+    return asyncio.run(run())
+
+def next_event(engine, kind):
+    """The next event of the given kind from a BackgroundEngine, skipping others"""
+    while True:
+        event, value = engine.events.get(timeout=10)
+        if event == 'error':
+            raise AssertionError(value)
+        if event == kind:
+            return value
+
+
+def test_parse_info():
+    info = parse_info('info depth 7 seldepth 9 score cp -31 upperbound nodes 1200 pv e7e5 g1f3')
+    assert info == {'depth': 7, 'seldepth': 9, 'score': ('cp', -31), 'bound': 'upperbound', 'nodes': 1200,
+                    'pv': ['e7e5', 'g1f3']}
+    assert parse_info('info score mate 3 string mate found') == {'score': ('mate', 3), 'string': 'mate found'}
+
+def test_go_command():
+    assert go_command(depth=5, movetime=None) == 'go depth 5'
+    assert go_command(wtime=1000, btime=900, winc=10) == 'go wtime 1000 btime 900 winc 10'
+    assert go_command() == 'go infinite'
+
+def test_handshake():
+    async def test(engine):
+        await engine.new_game()
+        await engine.set_option('Hash', 4)
+        return engine.name, engine.options
+    name, options = with_engine('first', test)
+    assert name == 'Scripted first'
+    assert options == {'Hash': 'spin default 1 min 1 max 16'}
+
+def test_analyse_reports_info_then_bestmove():
+    infos = []
+    async def test(engine):
+        return await engine.analyse(AFTER_E4, infos.append, depth=1)
+    assert with_engine('first', test) == ('a7a5', None)
+    assert infos == [{'depth': 1, 'score': ('cp', 0), 'nodes': 1, 'pv': ['a7a5']}]
+
+def test_stop_during_search():
+    infos = []
+    async def test(engine):
+        search = asyncio.ensure_future(engine.analyse(AFTER_E4, infos.append))
+        while len(infos) < 2:
+            await asyncio.sleep(0.01)
+        assert not search.done()
+        engine.stop()
+        result = await asyncio.wait_for(search, 5)
+        await engine.ready()
+        return result
+    assert with_engine('infinite', test) == ('a7a5', None)
+    assert [info['depth'] for info in infos[:2]] == [1, 2]
+
+def test_engine_crash_raises():
+    async def test(engine):
+        assert await engine.analyse(AFTER_E4, depth=1) == ('a7a5', None)
+        with pytest.raises(EngineError):
+            await engine.analyse(AFTER_E4, depth=1)
+    with_engine('crash', test, plies=2)
+
+def test_engine_that_cannot_start():
+    async def test():
+        with pytest.raises(EngineError):
+            await UciEngine([os.path.join(os.path.dirname(ENGINE), 'no-such-engine')]).start()
+    asyncio.run(test())
+
+
+def test_background_engine_search_and_stop():
+    engine = BackgroundEngine(scripted('infinite'))
+    try:
+        assert next_event(engine, 'ready') == 'Scripted infinite'
+        first = engine.analyse(AFTER_E4)
+        assert next_event(engine, 'info')['search_id'] == first
+        second = engine.analyse('position startpos')  # Stops the first search before starting
+        assert next_event(engine, 'bestmove') == (first, 'a7a5', None)
+        info = next_event(engine, 'info')
+        assert (info['search_id'], info['pv']) == (second, ['a2a3'])
+        engine.stop()
+        assert next_event(engine, 'bestmove') == (second, 'a2a3', None)
+    finally:
+        engine.close()
+    engine.thread.join(5)
+    assert not engine.thread.is_alive()
+    assert engine.engine.process.returncode is not None
+
+def test_background_engine_reports_errors():
+    engine = BackgroundEngine(scripted('crash'))
+    try:
+        next_event(engine, 'ready')
+        engine.analyse(AFTER_E4, depth=1)
+        event, message = engine.events.get(timeout=10)
+        assert (event, message) == ('error', 'Engine exited')
+        with pytest.raises(queue.Empty):
+            engine.events.get(timeout=0.1)
+    finally:
+        engine.close()